@@ -0,0 +1,44 @@
+"""
+Compare the per-flush cost of BatchQueue with the list slicing it replaced
+as the backlog grows.
+
+Run from the repository root:
+    python -m benchmarks.bench_batch_queue
+"""
+
+import time
+
+from server_app.services.batch_queue import BatchQueue
+
+BATCH_SIZE = 100
+
+
+def drain_list(backlog):
+    queue = [str(i) for i in range(backlog)]
+    flushes = 0
+    start = time.perf_counter()
+    while queue:
+        batch = queue[:BATCH_SIZE]
+        queue = queue[len(batch) :]
+        flushes += 1
+    return (time.perf_counter() - start) / flushes
+
+
+def drain_batch_queue(backlog):
+    queue = BatchQueue(maxlen=None)
+    queue.extend(str(i) for i in range(backlog))
+    flushes = 0
+    start = time.perf_counter()
+    while queue:
+        batch = queue.peek(BATCH_SIZE)
+        queue.commit(len(batch))
+        flushes += 1
+    return (time.perf_counter() - start) / flushes
+
+
+if __name__ == "__main__":
+    for backlog in (1000, 10000, 100000, 300000):
+        print(
+            f"{backlog:>7} queued: list slicing {drain_list(backlog) * 1e6:8.1f} us, "
+            f"BatchQueue {drain_batch_queue(backlog) * 1e6:6.1f} us per flush"
+        )
@@ -0,0 +1,60 @@
+"""
+Measure how fast an EventStream consumer drains a backlog with batched
+XREADGROUP and XACK.
+
+Uses the Redis at REDIS_URL, or fakeredis with --fake. Run from the
+repository root:
+    python -m benchmarks.bench_event_stream [--fake]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+import redis.asyncio as redis
+
+from server_app.services.event_streams import EventStream
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+KEY = "bench_events"
+
+
+async def drain(redis_client, count, batch_size):
+    await redis_client.delete(KEY)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for i in range(count):
+            EventStream(redis_client, KEY, maxlen=count).add_to(pipe, {"value": i})
+        await pipe.execute()
+
+    stream = EventStream(redis_client, KEY, maxlen=count)
+    start = time.perf_counter()
+    drained = 0
+    while True:
+        events = await stream.read(batch_size)
+        if not events:
+            break
+        await stream.ack([entry_id for entry_id, _ in events])
+        drained += len(events)
+    elapsed = time.perf_counter() - start
+    await redis_client.delete(KEY)
+    return drained / elapsed
+
+
+async def main(fake):
+    if fake:
+        import fakeredis
+
+        redis_client = fakeredis.aioredis.FakeRedis()
+    else:
+        redis_client = redis.Redis.from_url(REDIS_URL)
+    try:
+        for batch_size in (50, 500):
+            rate = await drain(redis_client, 20000, batch_size)
+            print(f"batch {batch_size:>4}: {rate:>9.0f} events/s")
+    finally:
+        await redis_client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main("--fake" in sys.argv))
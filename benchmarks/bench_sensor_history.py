@@ -0,0 +1,57 @@
+"""
+Fill a SensorHistory at 1 Hz across many sensors and report append and
+query cost.
+
+Run from the repository root:
+    python -m benchmarks.bench_sensor_history
+"""
+
+import random
+import time
+
+from irrigation_controller.sensor_history import SensorHistory
+
+
+def bench(sensor_count=100, hours=6, seed=42):
+    rng = random.Random(seed)
+    seconds = hours * 3600
+    history = SensorHistory(horizon=seconds)
+    start_time = time.time() - seconds
+
+    start = time.perf_counter()
+    for second in range(seconds):
+        timestamp = start_time + second
+        history.extend(
+            [
+                {
+                    "sensorID": sensor_id,
+                    "timestamp": timestamp,
+                    "value": 40 + rng.random(),
+                }
+                for sensor_id in range(sensor_count)
+            ]
+        )
+    elapsed = time.perf_counter() - start
+    print(
+        f"{sensor_count} sensors x {seconds} s: "
+        f"{elapsed / seconds * 1e6:.1f} us per 1 Hz batch, "
+        f"{history.memory_bytes / 2**20:.1f} MiB"
+    )
+
+    queries = {
+        "rolling_mean": lambda sensor_id: history.rolling_mean(sensor_id, 3600),
+        "slope": lambda sensor_id: history.slope(sensor_id, 3600),
+        "percentile": lambda sensor_id: history.percentile(sensor_id, 90, 3600),
+    }
+    for name, query in queries.items():
+        start = time.perf_counter()
+        for sensor_id in range(sensor_count):
+            query(sensor_id)
+        elapsed = time.perf_counter() - start
+        print(
+            f"  {name:>12} over 1 h: {elapsed / sensor_count * 1e6:.0f} us per sensor"
+        )
+
+
+if __name__ == "__main__":
+    bench()
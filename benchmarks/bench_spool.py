@@ -0,0 +1,49 @@
+"""
+Measure append and flush throughput of the SQLite upload spool with and
+without a sync per append.
+
+Run from the repository root:
+    python -m benchmarks.bench_spool
+"""
+
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from server_app.services.spool import Spool
+
+BATCH_SIZE = 100
+
+
+def bench(synchronous, count=5000):
+    with tempfile.TemporaryDirectory() as directory:
+        spool = Spool(Path(directory) / "spool.sqlite3", synchronous=synchronous)
+        queue = spool.queue("sensor_data", maxlen=None)
+        item = json.dumps({"sensorID": 1, "value": 42.0, "timestamp": 0})
+
+        start = time.perf_counter()
+        for _ in range(count):
+            queue.append(item)
+        append_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        queue.extend([item] * count)
+        extend_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        while queue:
+            queue.commit(len(queue.peek(BATCH_SIZE)))
+        flush_time = time.perf_counter() - start
+        spool.close()
+
+    print(
+        f"synchronous={synchronous:<6} append {append_time / count * 1e6:7.1f} us, "
+        f"batched append {extend_time / count * 1e6:5.1f} us per item, "
+        f"flush {2 * count / flush_time:8.0f} items/s"
+    )
+
+
+if __name__ == "__main__":
+    for synchronous in ("OFF", "NORMAL", "FULL"):
+        bench(synchronous)
@@ -0,0 +1,52 @@
+"""
+Plan synthetic fleets with plan_watering and report planning time.
+
+Run from the repository root:
+    python -m benchmarks.bench_watering_planner
+"""
+
+import random
+import time
+
+from irrigation_controller.pump_dispatcher import IrrigationJob
+from irrigation_controller.watering_planner import plan_watering
+
+
+def make_fleet(plant_count, line_count=8, seed=42):
+    rng = random.Random(seed)
+    jobs = []
+    for plant_id in range(plant_count):
+        pump = {
+            "plantID": plant_id,
+            "gpioPort": plant_id,
+            "flowRate": rng.choice([50, 100, 150, 200]),
+            "supplyLine": f"line-{plant_id % line_count}",
+        }
+        plant = {"plantID": plant_id, "waterRequirement": rng.randint(50, 1000)}
+        jobs.append(IrrigationJob(plant, [pump]))
+    return jobs
+
+
+def bench(plant_count, repeat=20, **limits):
+    jobs = make_fleet(plant_count)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        plan = plan_watering(jobs, **limits)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(
+        f"{plant_count:>6} plants {limits}: median {timings[len(timings) // 2] * 1000:.2f} ms, "
+        f"best {timings[0] * 1000:.2f} ms, makespan {plan.makespan / 60:.1f} min"
+    )
+
+
+if __name__ == "__main__":
+    for plant_count in (40, 1000, 10000):
+        bench(plant_count, max_open_pumps=8)
+        bench(
+            plant_count,
+            max_open_pumps=8,
+            max_total_flow=600,
+            supply_line_limits={"line-0": 1, "line-1": 2},
+        )
@@ -0,0 +1,95 @@
+import asyncio
+import heapq
+import itertools
+from datetime import datetime, timedelta
+
+
+def next_fire_time(schedule, now, watered_today):
+    """
+    Return the next time at which schedule has to be evaluated, or None if
+    it never runs. A schedule that is active today and whose plant has not
+    been watered yet is due immediately.
+    """
+    if not schedule.weekday_mask:
+        return None
+
+    hour, minute = divmod(schedule.start_minute, 60)
+    start_today = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+    if schedule.runs_on(now.weekday()):
+        if now < start_today:
+            return start_today
+        if not watered_today:
+            return now
+
+    for offset in range(1, 8):
+        start = start_today + timedelta(days=offset)
+        if schedule.runs_on(start.weekday()):
+            return start
+    return None
+
+
+class FireTimeScheduler:
+    """Timer heap holding the next fire time of every compiled schedule."""
+
+    def __init__(self, recheck_interval=60, max_sleep=900):
+        # Active schedules that did not lead to watering (e.g. threshold not
+        # met yet) are evaluated again after recheck_interval seconds.
+        self.recheck_interval = recheck_interval
+        # Upper bound for a single sleep so wall clock adjustments (NTP, DST)
+        # are picked up eventually.
+        self.max_sleep = max_sleep
+        self.heap = []
+        self.counter = itertools.count()
+        self.rearm_event = asyncio.Event()
+        self.rearm_event.set()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def request_rearm(self):
+        self.rearm_event.set()
+
+    def needs_rearm(self):
+        return self.rearm_event.is_set()
+
+    def rebuild(self, schedule_index, plant_ids, is_watered_today, now):
+        self.rearm_event.clear()
+        self.heap = []
+        for plant_id in plant_ids:
+            watered_today = is_watered_today(plant_id, now)
+            for schedule in schedule_index.get(plant_id, ()):
+                self.push(schedule, next_fire_time(schedule, now, watered_today))
+        heapq.heapify(self.heap)
+
+    def push(self, schedule, fire_at):
+        if fire_at is not None:
+            self.heap.append((fire_at, next(self.counter), schedule))
+
+    def rearm(self, schedule, now, watered_today):
+        fire_at = next_fire_time(schedule, now, watered_today)
+        if fire_at is not None and fire_at <= now:
+            fire_at = now + timedelta(seconds=self.recheck_interval)
+        if fire_at is not None:
+            heapq.heappush(self.heap, (fire_at, next(self.counter), schedule))
+
+    def pop_due(self, now):
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap)[2])
+        return due
+
+    def seconds_until_next(self, now):
+        if not self.heap:
+            return None
+        return max(0.0, (self.heap[0][0] - now).total_seconds())
+
+    async def wait(self, now=None):
+        """Sleep until the earliest fire time or until a rearm is requested."""
+        delay = self.seconds_until_next(now or datetime.now())
+        if delay is None or delay > self.max_sleep:
+            delay = self.max_sleep
+        try:
+            await asyncio.wait_for(self.rearm_event.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
@@ -1,21 +1,73 @@
 import asyncio
+import contextlib
 from datetime import datetime, date
 from server_app.logging_config import setup_logger
 import json
 import time
 from server_app.database.models.plants import Plants
+from irrigation_controller.schedule_index import build_schedule_index
+from irrigation_controller.fire_scheduler import FireTimeScheduler
+from irrigation_controller.pump_dispatcher import IrrigationJob, PumpDispatcher
+from irrigation_controller.reading_store import LatestReadingStore
+from irrigation_controller.moisture import MoistureAggregator
+from irrigation_controller.sensor_history import SensorHistory
+from irrigation_controller.watering_planner import irrigation_time, plan_watering
+from server_app.services.event_streams import EventStream, WATERING_STREAM
+
+# Watering events used to be appended to this list; it is only read to
+# migrate the last watered times
+WATERING_LOGS_KEY = "watering_logs"
+LAST_WATERED_KEY = "last_watered"
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
 
 
 class IrrigationService:
-    def __init__(self, controller_id, redis_client, stop_event, test=False):
+    def __init__(
+        self,
+        controller_id,
+        redis_client,
+        stop_event,
+        test=False,
+        max_open_pumps=4,
+        supply_line_limits=None,
+        max_total_flow=None,
+        reading_store=None,
+        moisture_aggregation="mean",
+        moisture_window=3,
+        sensor_history=None,
+    ):
         self.logger = setup_logger(__name__)
         self.controller_id = controller_id
         self.redis_client = redis_client
+        self.watering_stream = EventStream(redis_client, WATERING_STREAM)
         self.stop_event = stop_event
         self.plants = []
         self.schedules = []
+        self.schedule_index = {}
+        self.plants_by_id = {}
+        self.scheduler = FireTimeScheduler()
         self.pumps = []
+        self.pumps_by_plant = {}
+        self.pumps_by_id = {}
+        self.pumps_by_gpio = {}
+        self.dispatcher = PumpDispatcher(
+            self.run_irrigation_job,
+            max_open_pumps,
+            supply_line_limits,
+            self.logger,
+            max_total_flow,
+        )
         self.sensor_types = {}
+        self.moisture_sensor_ids = set()
+        self.reading_store = reading_store or LatestReadingStore(redis_client)
+        self.sensor_snapshot = None
+        self.moisture = MoistureAggregator(moisture_aggregation, moisture_window)
+        self.plant_moisture = None
+        # Recent readings of all sensors, filled by the SensorService
+        self.sensor_history = sensor_history or SensorHistory()
         self.healthy = asyncio.Event()
         self.healthy.set()
         self.last_watered_times = {}
@@ -35,6 +87,7 @@ class IrrigationService:
         try:
             await self.wait_for_plants()
             await self.initialize_last_watered_times()
+            self.scheduler.request_rearm()
             self.check_irrigation_task = asyncio.create_task(
                 self.check_for_irrigation()
             )
@@ -63,17 +116,17 @@ class IrrigationService:
             except asyncio.CancelledError:
                 pass
 
+        await self.dispatcher.cancel_all()
+
         if not self.test:
-            for pump in self.pumps:
+            for gpio_port in self.pumps_by_gpio:
                 try:
-                    self.GPIO.setup(pump["gpioPort"], self.GPIO.OUT)
-                    self.GPIO.output(
-                        pump["gpioPort"], self.GPIO.HIGH
-                    )  # Set GPIO port to HIGH
-                    self.GPIO.cleanup(pump["gpioPort"])  # Free the GPIO port
+                    self.GPIO.setup(gpio_port, self.GPIO.OUT)
+                    self.GPIO.output(gpio_port, self.GPIO.HIGH)  # Set GPIO port to HIGH
+                    self.GPIO.cleanup(gpio_port)  # Free the GPIO port
                 except Exception as e:
                     self.logger.error(
-                        f"Error setting GPIO port {pump['gpioPort']} to HIGH: {str(e)}"
+                        f"Error setting GPIO port {gpio_port} to HIGH: {str(e)}"
                     )
 
         self.logger.info("Irrigation service stopped")
@@ -82,6 +135,27 @@ class IrrigationService:
         await self.stop()
         await self.start()
 
+    async def migrate_last_watered_times(self):
+        """
+        Build the last watered hash from the watering_logs list once, for
+        controllers that logged watering before the hash existed.
+        """
+        if await self.redis_client.exists(LAST_WATERED_KEY):
+            return 0
+
+        last_watered = {}
+        for log in await self.redis_client.lrange(WATERING_LOGS_KEY, 0, -1):
+            log = json.loads(log)
+            if log["timestamp"] > last_watered.get(log["plantID"], float("-inf")):
+                last_watered[log["plantID"]] = log["timestamp"]
+
+        if last_watered:
+            await self.redis_client.hset(LAST_WATERED_KEY, mapping=last_watered)
+            self.logger.info(
+                f"Migrated last watered times of {len(last_watered)} plants from watering logs"
+            )
+        return len(last_watered)
+
     async def initialize_last_watered_times(self):
         try:
             if not self.plants:
@@ -90,27 +164,25 @@ class IrrigationService:
                 )
                 return
 
-            redis_logs = await self.redis_client.lrange("watering_logs", 0, -1)
-            redis_logs = [json.loads(log) for log in redis_logs]
+            await self.migrate_last_watered_times()
 
-            plant_ids = [plant["plantID"] for plant in self.plants]
-            redis_plant_ids = set(log["plantID"] for log in redis_logs)
-            mongodb_plant_ids = set(plant_ids) - redis_plant_ids
+            plant_ids = list(self.plants_by_id)
+            redis_times = await self.redis_client.hmget(LAST_WATERED_KEY, plant_ids)
 
             # Get last watering times from Redis
-            for log in redis_logs:
-                plant_id = log["plantID"]
-                if plant_id in plant_ids and plant_id not in self.last_watered_times:
-                    self.last_watered_times[plant_id] = log["timestamp"]
+            mongodb_plant_ids = []
+            for plant_id, timestamp in zip(plant_ids, redis_times):
+                if timestamp is None:
+                    mongodb_plant_ids.append(plant_id)
+                elif plant_id not in self.last_watered_times:
+                    self.last_watered_times[plant_id] = float(timestamp)
             self.logger.debug(
-                f"Initialized last watered times for {len(redis_logs)} plants from Redis"
+                f"Initialized last watered times for {len(plant_ids) - len(mongodb_plant_ids)} plants from Redis"
             )
 
             # Get last watering times from MongoDB for remaining plants
             if mongodb_plant_ids:
-                mongodb_times = await Plants.get_last_watering_times(
-                    list(mongodb_plant_ids)
-                )
+                mongodb_times = await Plants.get_last_watering_times(mongodb_plant_ids)
                 if mongodb_times is not None:
                     self.last_watered_times.update(mongodb_times)
                     self.logger.debug(
@@ -125,35 +197,87 @@ class IrrigationService:
         except Exception as e:
             self.logger.error(f"Error initializing last watered times: {str(e)}")
 
-    async def irrigate_plant(self, plant):
+    def get_pumps_for_plant(self, plant):
+        pumps = {
+            pump["gpioPort"]: pump
+            for pump in self.pumps_by_plant.get(plant["plantID"], ())
+        }
+        for pump_id in plant.get("pumpIDs") or ():
+            pump = self.pumps_by_id.get(pump_id)
+            if pump is not None:
+                pumps.setdefault(pump["gpioPort"], pump)
+        return list(pumps.values())
+
+    def schedule_irrigation(self, plants):
+        jobs = []
+        for plant in plants:
+            pumps = self.get_pumps_for_plant(plant)
+            if not pumps:
+                self.logger.error(f"No pumps available for plant {plant['plantID']}")
+                continue
+            # The planner reads these for the whole batch, one bad plant must
+            # not keep the others from being watered
+            water_requirement = plant.get("waterRequirement")
+            if not is_number(water_requirement) or water_requirement < 0:
+                self.logger.error(
+                    f"Invalid water requirement {water_requirement!r} "
+                    f"for plant {plant['plantID']}"
+                )
+                continue
+            if not all(
+                is_number(pump.get("flowRate")) and pump["flowRate"] > 0
+                for pump in pumps
+            ):
+                self.logger.error(
+                    f"Pump without a positive flow rate for plant {plant['plantID']}"
+                )
+                continue
+            jobs.append(IrrigationJob(plant, pumps))
+
+        plan = plan_watering(
+            jobs,
+            self.dispatcher.max_open_pumps,
+            self.dispatcher.max_total_flow,
+            self.dispatcher.supply_line_limits,
+        )
+        if len(plan) > 1:
+            self.logger.info(
+                f"Planned {len(plan)} irrigation runs, expected to finish in {plan.makespan:.0f}s"
+            )
+        for job in plan.jobs:
+            self.dispatcher.submit(job)
+        return plan
+
+    async def run_irrigation_job(self, job):
+        await self.irrigate_plant(job.plant, job.pumps)
+
+    async def irrigate_plant(self, plant, pumps=None):
         try:
             # Simulating irrigation process
             self.logger.info(f"Irrigating plant {plant['plantID']}")
 
-            pump_id = plant["pumpIDs"][0]
-            pump = next(
-                (p for p in self.pumps if p["plantID"] == plant["plantID"]), None
-            )  # Get the pump from self.pumps
+            if pumps is None:
+                pumps = self.get_pumps_for_plant(plant)
 
-            if pump is None:
-                self.logger.error(f"Could not find pump with id {pump_id}")
+            if not pumps:
+                self.logger.error(
+                    f"Could not find pumps {plant.get('pumpIDs')} for plant {plant['plantID']}"
+                )
                 return
 
-            flow_rate = pump["flowRate"]
+            # All pumps of a plant water in parallel, so the water requirement
+            # is split across their combined flow rate
+            flow_rate = sum(pump["flowRate"] for pump in pumps)
+            gpio_ports = sorted(pump["gpioPort"] for pump in pumps)
 
-            irrigation_time = (
-                60 * plant["waterRequirement"] / flow_rate
+            duration = irrigation_time(
+                plant["waterRequirement"], flow_rate
             )  # Calculate irrigation time in seconds
             self.logger.debug(
-                f"Watering plant {plant['plantID']} with pump {pump_id} with {flow_rate}ml of flowrate for {irrigation_time}s on gpio port {pump['gpioPort']}"
+                f"Watering plant {plant['plantID']} with {len(pumps)} pump(s) with {flow_rate}ml of flowrate for {duration}s on gpio ports {gpio_ports}"
             )
             if not self.test:
-
-                self.GPIO.setup(pump["gpioPort"], self.GPIO.OUT)
-                self.GPIO.output(pump["gpioPort"], self.GPIO.LOW)  # Start the pump
-                await asyncio.sleep(irrigation_time)
-                self.GPIO.output(pump["gpioPort"], self.GPIO.HIGH)  # Stop the pump
-                self.GPIO.cleanup(pump["gpioPort"])  # Free the GPIO port
+                await self.run_pumps(gpio_ports, duration)
 
             # Create watering log
             watering_log = {
@@ -162,7 +286,7 @@ class IrrigationService:
             }
 
             # Send watering log to Redis
-            await self.redis_client.rpush("watering_logs", json.dumps(watering_log))
+            await self.record_watering(watering_log)
 
             # Update last_watered_times
             self.last_watered_times[plant["plantID"]] = watering_log["timestamp"]
@@ -171,143 +295,234 @@ class IrrigationService:
         except Exception as e:
             self.logger.error(f"Error during irrigation: {str(e)}")
 
+    async def record_watering(self, watering_log):
+        # The log and the last watered time are written in one transaction
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            self.watering_stream.add_to(pipe, watering_log)
+            pipe.hset(
+                LAST_WATERED_KEY, watering_log["plantID"], watering_log["timestamp"]
+            )
+            await pipe.execute()
+
+    async def run_pumps(self, gpio_ports, duration):
+        async with contextlib.AsyncExitStack() as stack:
+            # Locks are taken in port order so overlapping runs cannot deadlock
+            for gpio_port in gpio_ports:
+                await stack.enter_async_context(self.dispatcher.gpio_lock(gpio_port))
+
+            started_ports = []
+            try:
+                for gpio_port in gpio_ports:
+                    self.GPIO.setup(gpio_port, self.GPIO.OUT)
+                    self.GPIO.output(gpio_port, self.GPIO.LOW)  # Start the pump
+                    started_ports.append(gpio_port)
+                await asyncio.sleep(duration)
+            finally:
+                for gpio_port in started_ports:
+                    self.GPIO.output(gpio_port, self.GPIO.HIGH)  # Stop the pump
+                    self.GPIO.cleanup(gpio_port)  # Free the GPIO port
+
     async def check_for_irrigation(self):
         self.logger.info("Starting irrigation check loop")
         while not self.stop_event.is_set():
             try:
-                for plant in self.plants:
+                now = datetime.now()
+                if self.scheduler.needs_rearm():
+                    self.rearm_scheduler(now)
+
+                due_schedules = self.scheduler.pop_due(now)
+                self.sensor_snapshot = None
+                self.plant_moisture = None
+                checked_plants = set()
+                plants_to_water = []
+                for schedule in due_schedules:
+                    plant = self.plants_by_id.get(schedule.plant_id)
+                    if plant is None or schedule.plant_id in checked_plants:
+                        continue
+                    if self.dispatcher.is_scheduled(schedule.plant_id):
+                        continue
+                    checked_plants.add(schedule.plant_id)
                     self.logger.debug(
                         f"Checking irrigation for plant {plant['plantID']}"
                     )
-                    if await self.is_irrigation_needed(plant):
+                    if await self.is_irrigation_needed(plant, now):
                         self.logger.info(
                             f"Irrigation needed for plant {plant['plantID']}!"
                         )
-                        await self.irrigate_plant(plant)
+                        plants_to_water.append(plant)
                     else:
                         self.logger.debug(
                             f"No irrigation needed for plant {plant['plantID']}"
                         )
-                await asyncio.sleep(5)  # Wait 5 seconds before the next check cycle
+                if plants_to_water:
+                    self.schedule_irrigation(plants_to_water)
+
+                now = datetime.now()
+                for schedule in due_schedules:
+                    self.scheduler.rearm(
+                        schedule, now, self.is_watered_today(schedule.plant_id, now)
+                    )
+                await self.scheduler.wait(now)
             except asyncio.CancelledError:
                 self.logger.info("Irrigation check loop cancelled")
                 break
             except Exception as e:
                 self.logger.error(f"Error in check_for_irrigation: {str(e)}")
                 self.healthy.clear()
+                self.scheduler.request_rearm()
                 await asyncio.sleep(5)  # Wait before retrying
         self.logger.info("Irrigation check loop ended")
 
-    def during_time(self, schedule):
-        now = datetime.now()
-        current_weekday = now.strftime("%A")
-        current_time = now.time()
+    def rearm_scheduler(self, now):
+        self.scheduler.rebuild(
+            self.schedule_index, self.plants_by_id, self.is_watered_today, now
+        )
+        self.logger.debug(
+            f"Scheduler armed with {len(self.scheduler)} schedules, next in "
+            f"{self.scheduler.seconds_until_next(now)}s"
+        )
+
+    def is_watered_today(self, plant_id, now):
+        last_watered_unix = self.last_watered_times.get(plant_id)
+        if last_watered_unix is None:
+            return False
+        return date.fromtimestamp(last_watered_unix) >= now.date()
+
+    def during_time(self, schedule, now=None):
+        now = now or datetime.now()
+        return schedule.is_active(now.weekday(), now.hour * 60 + now.minute)
+
+    async def get_sensor_snapshot(self):
+        # One fetch of the latest readings is shared by all plants of a wake
+        if self.sensor_snapshot is None:
+            self.sensor_snapshot = await self.reading_store.snapshot()
+        return self.sensor_snapshot
+
+    async def get_plant_moisture(self):
+        # Moisture of all plants is aggregated in one batch per wake
+        if self.plant_moisture is None:
+            self.moisture.update(await self.get_sensor_snapshot())
+            self.plant_moisture = self.moisture.aggregate()
+        return self.plant_moisture
+
+    def get_moisture_trend(self, plant_id, seconds=3600):
+        """Mean moisture slope of a plant's sensors in units per hour."""
+        slopes = [
+            self.sensor_history.slope(sensor_id, seconds)
+            for sensor_id in self.plants_by_id.get(plant_id, {}).get("sensorIDs") or ()
+            if sensor_id in self.moisture_sensor_ids
+        ]
+        slopes = [slope for slope in slopes if slope is not None]
+        return sum(slopes) / len(slopes) if slopes else None
 
-        # Convert startTime string to time object
+    async def is_threshold_met(self, threshold, plant_id):
         try:
-            if isinstance(schedule["startTime"], str):
-                schedule_start_time = datetime.strptime(
-                    schedule["startTime"], "%H:%M"
-                ).time()
-            elif isinstance(schedule["startTime"], time):  # Handle if already converted
-                schedule_start_time = schedule["startTime"]
+            moisture = (await self.get_plant_moisture()).get(plant_id)
+            if moisture is None:
+                self.logger.warning(
+                    f"No moisture sensor data found for plant {plant_id}"
+                )
+            elif moisture < threshold:
+                self.logger.info(
+                    f"Moisture level of plant {plant_id} is below threshold: {moisture} < {threshold}"
+                )
+                return True
             else:
-                self.logger.error(
-                    f"Unexpected type for startTime in schedule {schedule.get('scheduleID', 'N/A')}: {type(schedule['startTime'])}"
+                self.logger.info(
+                    f"Moisture level of plant {plant_id} is above threshold: {moisture} >= {threshold}"
                 )
                 return False
-        except ValueError:
-            self.logger.error(
-                f"Invalid time format for startTime in schedule {schedule.get('scheduleID', 'N/A')}: {schedule['startTime']}"
-            )
-            return False  # Cannot compare if format is wrong
-
-        schedule_weekdays = schedule["weekdays"]
-
-        weekday_match = current_weekday in schedule_weekdays
-        time_match = schedule_start_time <= current_time
-
-        result = weekday_match and time_match
-        return result
-
-    async def is_threshold_met(self, threshold):
-        try:
-            sensor_data = await self.redis_client.get("sensor_data")
-            sensor_data = eval(sensor_data or "[]")
-            for reading in sensor_data:
-                sensor_type = self.sensor_types.get(reading["sensorID"])
-                if sensor_type == "moisture":
-                    if reading["value"] < threshold:
-                        self.logger.info(
-                            f"Moisture level is below threshold: {reading['value']} < {threshold}"
-                        )
-                        return True
-                    else:
-                        self.logger.info(
-                            f"Moisture level is above threshold: {reading['value']} >= {threshold}"
-                        )
-                        return False
-            self.logger.warning("No moisture sensor data found")
         except Exception as e:
             self.logger.error(f"Error fetching or processing sensor data: {str(e)}")
         return False
 
     async def get_last_watering_time(self, plant_id):
         try:
-            watering_logs = await self.redis_client.lrange("watering_logs", 0, -1)
-            watering_logs = [json.loads(log) for log in watering_logs]
-            plant_logs = [log for log in watering_logs if log["plantID"] == plant_id]
-            if plant_logs:
-                return plant_logs[-1]["timestamp"]
+            timestamp = await self.redis_client.hget(LAST_WATERED_KEY, plant_id)
+            if timestamp is not None:
+                return float(timestamp)
         except Exception as e:
             self.logger.error(f"Error fetching last watering time: {str(e)}")
         return None
 
-    async def is_irrigation_needed(self, plant):
-        plant_schedules = [
-            s for s in self.schedules if s["plantID"] == plant["plantID"]
-        ]
-
-        last_watered_unix = self.last_watered_times.get(plant["plantID"])
-        now = datetime.now()
+    async def is_irrigation_needed(self, plant, now=None):
+        plant_schedules = self.schedule_index.get(plant["plantID"], ())
+        if not plant_schedules:
+            return False
 
-        if last_watered_unix is not None:
-            last_watered_date = date.fromtimestamp(last_watered_unix)
-        else:
-            last_watered_date = None
+        now = now or datetime.now()
+        watered_today = self.is_watered_today(plant["plantID"], now)
 
         for schedule in plant_schedules:
-            if self.during_time(schedule):
-                if last_watered_date is None or last_watered_date < now.date():
-                    if schedule["type"] == "threshold":
-                        return await self.is_threshold_met(schedule["threshold"])
-                    elif schedule["type"] == "interval":
+            if self.during_time(schedule, now):
+                if not watered_today:
+                    if schedule.type == "threshold":
+                        return await self.is_threshold_met(
+                            schedule.threshold, plant["plantID"]
+                        )
+                    elif schedule.type == "interval":
                         return True
                 else:
                     self.logger.debug(f"Plant {plant['plantID']} already watered today")
             else:
                 self.logger.debug(
-                    f"Current time is not within schedule {schedule['scheduleID']} for plant {plant['plantID']}"
+                    f"Current time is not within schedule {schedule.schedule_id} for plant {plant['plantID']}"
                 )
         return False
 
+    def sensor_thresholds(self):
+        """Moisture sensor ID -> thresholds of the threshold schedules it serves."""
+        thresholds = {}
+        for plant_id, schedules in self.schedule_index.items():
+            plant = self.plants_by_id.get(plant_id)
+            if plant is None:
+                continue
+            plant_thresholds = [
+                schedule.threshold
+                for schedule in schedules
+                if schedule.type == "threshold" and schedule.threshold is not None
+            ]
+            if not plant_thresholds:
+                continue
+            for sensor_id in plant.get("sensorIDs") or ():
+                if sensor_id in self.moisture_sensor_ids:
+                    thresholds.setdefault(sensor_id, []).extend(plant_thresholds)
+        return thresholds
+
     async def update_plants(self, new_plants):
         try:
-            self.plants = new_plants
-            self.logger.info(f"Updated plants: {len(new_plants)} plants")
+            if new_plants != self.plants:
+                self.plants = new_plants
+                self.plants_by_id = {plant["plantID"]: plant for plant in new_plants}
+                self.moisture.rebuild(new_plants, self.moisture_sensor_ids)
+                self.scheduler.request_rearm()
+                self.logger.info(f"Updated plants: {len(new_plants)} plants")
             self.plants_initialized.set()
         except Exception as e:
             self.logger.error(f"Error updating plants: {str(e)}")
 
     async def update_schedules(self, new_schedules):
         try:
+            if new_schedules == self.schedules:
+                self.logger.debug("Schedules unchanged, keeping schedule index")
+                return
+            self.schedule_index = build_schedule_index(new_schedules, self.logger)
             self.schedules = new_schedules
+            self.scheduler.request_rearm()
             self.logger.info(f"Updated schedules: {len(new_schedules)} schedules")
         except Exception as e:
             self.logger.error(f"Error updating schedules: {str(e)}")
 
     async def update_pumps(self, new_pumps):
         try:
+            pumps_by_plant = {}
+            for pump in new_pumps:
+                pumps_by_plant.setdefault(pump.get("plantID"), []).append(pump)
+            self.pumps_by_plant = pumps_by_plant
+            self.pumps_by_id = {
+                pump["pumpID"]: pump for pump in new_pumps if "pumpID" in pump
+            }
+            self.pumps_by_gpio = {pump["gpioPort"]: pump for pump in new_pumps}
             self.pumps = new_pumps
             self.logger.info(f"Updated pumps: {len(new_pumps)} pumps")
         except Exception as e:
@@ -315,7 +530,15 @@ class IrrigationService:
 
     async def update_sensor_types(self, new_sensor_types):
         try:
+            if new_sensor_types == self.sensor_types:
+                return
+            self.moisture_sensor_ids = {
+                sensor_id
+                for sensor_id, sensor_type in new_sensor_types.items()
+                if str(sensor_type).lower() == "moisture"
+            }
             self.sensor_types = new_sensor_types
+            self.moisture.rebuild(self.plants, self.moisture_sensor_ids)
             self.logger.info(f"Updated sensor types: {len(new_sensor_types)} sensors")
         except Exception as e:
             self.logger.error(f"Error updating sensor types: {str(e)}")
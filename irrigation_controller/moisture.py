@@ -0,0 +1,92 @@
+import warnings
+import numpy as np
+
+AGGREGATIONS = {
+    "min": np.nanmin,
+    "mean": np.nanmean,
+    "median": np.nanmedian,
+}
+
+
+class MoistureAggregator:
+    """
+    Resolves every plant to its own moisture sensors and reduces their
+    recent readings to one value per plant in a single NumPy pass.
+
+    Readings live in a (sensors + 1) x window array; the extra row stays NaN
+    and pads plants with fewer sensors in the plant x sensor gather matrix.
+    """
+
+    def __init__(self, method="mean", window=3):
+        if method not in AGGREGATIONS:
+            raise ValueError(f"Unknown moisture aggregation {method!r}")
+        self.reduce = AGGREGATIONS[method]
+        self.method = method
+        self.window = window
+        self.rebuild([], set())
+
+    def rebuild(self, plants, moisture_sensor_ids):
+        plant_sensors = {}
+        for plant in plants:
+            sensor_ids = [
+                sensor_id
+                for sensor_id in plant.get("sensorIDs") or ()
+                if sensor_id in moisture_sensor_ids
+            ]
+            if sensor_ids:
+                plant_sensors[plant["plantID"]] = sensor_ids
+
+        sensor_ids = sorted(
+            {sensor_id for ids in plant_sensors.values() for sensor_id in ids}, key=str
+        )
+        sensor_rows = {sensor_id: row for row, sensor_id in enumerate(sensor_ids)}
+
+        values = np.full((len(sensor_ids) + 1, self.window), np.nan)
+        timestamps = np.full(len(sensor_ids), -np.inf)
+        positions = np.zeros(len(sensor_ids), dtype=np.intp)
+        # Keep the recent window of sensors that are still in use
+        for sensor_id, row in sensor_rows.items():
+            old_row = getattr(self, "sensor_rows", {}).get(sensor_id)
+            if old_row is not None:
+                values[row] = self.values[old_row]
+                timestamps[row] = self.timestamps[old_row]
+                positions[row] = self.positions[old_row]
+
+        width = max((len(ids) for ids in plant_sensors.values()), default=0)
+        gather = np.full((len(plant_sensors), width), len(sensor_ids), dtype=np.intp)
+        for plant_row, ids in enumerate(plant_sensors.values()):
+            gather[plant_row, : len(ids)] = [
+                sensor_rows[sensor_id] for sensor_id in ids
+            ]
+
+        self.plant_ids = list(plant_sensors)
+        self.sensor_rows = sensor_rows
+        self.values = values
+        self.timestamps = timestamps
+        self.positions = positions
+        self.gather = gather
+
+    def update(self, latest_readings):
+        for sensor_id, row in self.sensor_rows.items():
+            reading = latest_readings.get(sensor_id)
+            if reading is None or reading["value"] is None:
+                continue
+            if reading["timestamp"] <= self.timestamps[row]:
+                continue
+            self.values[row, self.positions[row] % self.window] = reading["value"]
+            self.positions[row] += 1
+            self.timestamps[row] = reading["timestamp"]
+
+    def aggregate(self):
+        """Return plantID -> aggregated moisture, None for plants without data."""
+        if not self.plant_ids:
+            return {}
+        samples = self.values[self.gather].reshape(len(self.plant_ids), -1)
+        with warnings.catch_warnings():
+            # All-NaN rows are plants whose sensors have not reported yet
+            warnings.simplefilter("ignore", RuntimeWarning)
+            result = self.reduce(samples, axis=1)
+        return {
+            plant_id: None if np.isnan(value) else float(value)
+            for plant_id, value in zip(self.plant_ids, result)
+        }
@@ -0,0 +1,163 @@
+import asyncio
+from collections import Counter, deque
+
+DEFAULT_SUPPLY_LINE = "default"
+
+
+def supply_line_of(pump):
+    return pump.get("supplyLine") or DEFAULT_SUPPLY_LINE
+
+
+def over_budget(used, amount, budget):
+    """
+    Whether a run needing amount of a budget of which used is taken has to
+    wait. A run larger than the whole budget may still start while nothing
+    else holds it, and then holds all of it. plan_watering estimates the
+    runs under the same rule.
+    """
+    return budget is not None and used > 0 and used + amount > budget
+
+
+class IrrigationJob:
+    __slots__ = ("plant", "pumps")
+
+    def __init__(self, plant, pumps):
+        self.plant = plant
+        self.pumps = pumps
+
+    @property
+    def plant_id(self):
+        return self.plant["plantID"]
+
+    @property
+    def gpio_ports(self):
+        return [pump["gpioPort"] for pump in self.pumps]
+
+    @property
+    def flow_rate(self):
+        return sum(pump["flowRate"] for pump in self.pumps)
+
+    @property
+    def supply_lines(self):
+        return Counter(supply_line_of(pump) for pump in self.pumps)
+
+
+class PumpDispatcher:
+    """
+    Runs irrigation jobs as independent tasks while keeping the open pumps
+    within the controller, total flow and supply line budgets (see
+    over_budget). Jobs that do not fit yet wait in a FIFO queue and later
+    jobs that fit may start first, but once a waiting job has been
+    overtaken max_overtakes times nothing behind it starts until it does,
+    so a job with several pumps is not starved by single pump jobs. A job
+    never starts while one of its GPIO ports is driven by another job.
+    """
+
+    def __init__(
+        self,
+        run_job,
+        max_open_pumps=4,
+        supply_line_limits=None,
+        logger=None,
+        max_total_flow=None,
+        max_overtakes=4,
+    ):
+        self.run_job = run_job
+        self.max_open_pumps = max_open_pumps
+        self.max_total_flow = max_total_flow
+        self.supply_line_limits = supply_line_limits or {}
+        self.logger = logger
+        self.max_overtakes = max_overtakes
+        self.pending = deque()
+        # Times each waiting job was overtaken by a later one
+        self.overtaken = Counter()
+        self.running = {}
+        self.scheduled = set()
+        self.open_pumps = 0
+        self.open_flow = 0
+        self.open_per_line = Counter()
+        self.busy_ports = set()
+        self.gpio_locks = {}
+
+    def gpio_lock(self, gpio_port):
+        lock = self.gpio_locks.get(gpio_port)
+        if lock is None:
+            lock = self.gpio_locks[gpio_port] = asyncio.Lock()
+        return lock
+
+    def is_scheduled(self, plant_id):
+        return plant_id in self.scheduled
+
+    def submit(self, job):
+        if not job.pumps:
+            if self.logger:
+                self.logger.error(f"No pumps available for plant {job.plant_id}")
+            return False
+        if self.is_scheduled(job.plant_id):
+            if self.logger:
+                self.logger.debug(f"Plant {job.plant_id} is already queued")
+            return False
+        self.scheduled.add(job.plant_id)
+        self.pending.append(job)
+        self.dispatch()
+        return True
+
+    def fits(self, job):
+        if over_budget(self.open_pumps, len(job.pumps), self.max_open_pumps):
+            return False
+        if over_budget(self.open_flow, job.flow_rate, self.max_total_flow):
+            return False
+        for line, count in job.supply_lines.items():
+            if over_budget(
+                self.open_per_line[line], count, self.supply_line_limits.get(line)
+            ):
+                return False
+        return not any(
+            port in self.busy_ports or self.gpio_lock(port).locked()
+            for port in job.gpio_ports
+        )
+
+    def dispatch(self):
+        waiting = deque()
+        while self.pending:
+            job = self.pending.popleft()
+            if self.fits(job):
+                self.start(job)
+                self.overtaken.update(skipped.plant_id for skipped in waiting)
+            else:
+                waiting.append(job)
+                if self.overtaken[job.plant_id] >= self.max_overtakes:
+                    # Let the running jobs free its budget first
+                    break
+        waiting.extend(self.pending)
+        self.pending = waiting
+
+    def start(self, job):
+        self.overtaken.pop(job.plant_id, None)
+        self.open_pumps += len(job.pumps)
+        self.open_flow += job.flow_rate
+        self.open_per_line.update(job.supply_lines)
+        self.busy_ports.update(job.gpio_ports)
+        self.running[job.plant_id] = asyncio.create_task(self.run(job))
+
+    async def run(self, job):
+        try:
+            await self.run_job(job)
+        finally:
+            self.open_pumps -= len(job.pumps)
+            self.open_flow -= job.flow_rate
+            self.open_per_line.subtract(job.supply_lines)
+            self.busy_ports.difference_update(job.gpio_ports)
+            self.running.pop(job.plant_id, None)
+            self.scheduled.discard(job.plant_id)
+            self.dispatch()
+
+    async def cancel_all(self):
+        for job in self.pending:
+            self.scheduled.discard(job.plant_id)
+        self.pending.clear()
+        self.overtaken.clear()
+        tasks = list(self.running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
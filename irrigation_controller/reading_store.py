@@ -0,0 +1,80 @@
+import json
+from server_app.logging_config import setup_logger
+
+logger = setup_logger(__name__)
+
+LATEST_READINGS_KEY = "sensor_latest"
+
+
+def decode_sensor_id(sensor_id):
+    if isinstance(sensor_id, bytes):
+        sensor_id = sensor_id.decode()
+    try:
+        return int(sensor_id)
+    except ValueError:
+        return sensor_id
+
+
+class LatestReadingStore:
+    """
+    Latest reading per sensor, kept in a Redis hash keyed by sensorID and
+    mirrored in process so readers in the same process do not need a
+    round trip.
+
+    Share one store between the writing SensorService and its readers:
+    once the store has written and has loaded the hash once (readings from
+    before a restart), snapshot() serves the mirror without Redis.
+    """
+
+    def __init__(self, redis_client, key=LATEST_READINGS_KEY):
+        self.redis_client = redis_client
+        self.key = key
+        self.mirror = {}
+        self.local_writer = False
+        self.loaded = False
+
+    def get(self, sensor_id):
+        return self.mirror.get(sensor_id)
+
+    def merge(self, sensor_id, reading):
+        current = self.mirror.get(sensor_id)
+        if current is None or reading["timestamp"] >= current["timestamp"]:
+            self.mirror[sensor_id] = reading
+            return True
+        return False
+
+    def write_to(self, pipe, readings):
+        """Queue one HSET of the newer readings on a pipeline."""
+        self.local_writer = True
+        mapping = {}
+        for data in readings:
+            reading = {"value": data["value"], "timestamp": data["timestamp"]}
+            if self.merge(data["sensorID"], reading):
+                mapping[data["sensorID"]] = json.dumps(reading)
+        if mapping:
+            pipe.hset(self.key, mapping=mapping)
+        return len(mapping)
+
+    async def write(self, readings):
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            written = self.write_to(pipe, readings)
+            await pipe.execute()
+        return written
+
+    async def snapshot(self):
+        """Fetch all latest readings in one round trip, merged into the mirror."""
+        if self.local_writer and self.loaded:
+            return dict(self.mirror)
+        try:
+            stored = await self.redis_client.hgetall(self.key)
+        except Exception as e:
+            logger.error(f"Error fetching latest sensor readings: {str(e)}")
+            return dict(self.mirror)
+
+        for sensor_id, reading in (stored or {}).items():
+            try:
+                self.merge(decode_sensor_id(sensor_id), json.loads(reading))
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Invalid latest reading for sensor {sensor_id}: {e}")
+        self.loaded = True
+        return dict(self.mirror)
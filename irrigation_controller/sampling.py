@@ -0,0 +1,62 @@
+class SamplingCadence:
+    """
+    Sampling interval of one sensor.
+
+    With adaptive sampling the interval is halved (down to min_interval)
+    after a reading that changed faster than change_rate units per minute or
+    that lies within threshold_margin of a schedule threshold, and grows by
+    half (up to max_interval) after a stable reading.
+    """
+
+    def __init__(
+        self,
+        interval,
+        adaptive=False,
+        min_interval=None,
+        max_interval=None,
+        change_rate=0.5,
+        threshold_margin=5.0,
+    ):
+        self.base_interval = interval
+        self.interval = interval
+        self.adaptive = adaptive
+        self.min_interval = min_interval or max(interval / 10, 5)
+        self.max_interval = max_interval or interval * 4
+        self.change_rate = change_rate
+        self.threshold_margin = threshold_margin
+        self.next_due = 0.0
+        self.last_value = None
+        self.last_time = None
+
+    @classmethod
+    def from_sensor(cls, sensor, default_interval):
+        return cls(
+            sensor.get("sampleInterval") or default_interval,
+            adaptive=bool(sensor.get("adaptiveSampling")),
+            min_interval=sensor.get("minSampleInterval"),
+            max_interval=sensor.get("maxSampleInterval"),
+        )
+
+    def is_due(self, now):
+        return now >= self.next_due
+
+    def needs_fast_sampling(self, value, now, thresholds):
+        if self.last_value is not None and now > self.last_time:
+            rate = abs(value - self.last_value) / (now - self.last_time) * 60
+            if rate >= self.change_rate:
+                return True
+        return any(
+            abs(value - threshold) <= self.threshold_margin for threshold in thresholds
+        )
+
+    def observe(self, value, now, thresholds=()):
+        """Record a sample (None if the read failed) and schedule the next one."""
+        if value is not None:
+            if self.adaptive:
+                if self.needs_fast_sampling(value, now, thresholds):
+                    self.interval = max(self.min_interval, self.interval / 2)
+                else:
+                    self.interval = min(self.max_interval, self.interval * 1.5)
+            self.last_value = value
+            self.last_time = now
+        self.next_due = now + self.interval
@@ -0,0 +1,102 @@
+from datetime import time as dt_time
+
+WEEKDAYS = [
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+    "Sunday",
+]
+WEEKDAY_BITS = {name: 1 << index for index, name in enumerate(WEEKDAYS)}
+ALL_WEEKDAYS = (1 << len(WEEKDAYS)) - 1
+
+
+class CompiledSchedule:
+    __slots__ = (
+        "schedule_id",
+        "plant_id",
+        "weekday_mask",
+        "start_minute",
+        "type",
+        "threshold",
+    )
+
+    def __init__(
+        self, schedule_id, plant_id, weekday_mask, start_minute, type, threshold
+    ):
+        self.schedule_id = schedule_id
+        self.plant_id = plant_id
+        self.weekday_mask = weekday_mask
+        self.start_minute = start_minute
+        self.type = type
+        self.threshold = threshold
+
+    def runs_on(self, weekday):
+        return bool(self.weekday_mask >> weekday & 1)
+
+    def is_active(self, weekday, minute):
+        return self.runs_on(weekday) and self.start_minute <= minute
+
+
+def parse_weekday_mask(weekdays):
+    mask = 0
+    for day in weekdays or []:
+        if isinstance(day, str):
+            bit = WEEKDAY_BITS.get(day.strip().capitalize())
+            if bit is None:
+                raise ValueError(f"Unknown weekday {day!r}")
+            mask |= bit
+        elif isinstance(day, int) and 0 <= day < len(WEEKDAYS):
+            # Numeric weekdays follow datetime.weekday(): 0 is Monday
+            mask |= 1 << day
+        else:
+            raise ValueError(f"Unknown weekday {day!r}")
+    return mask
+
+
+def parse_start_minute(start_time):
+    if isinstance(start_time, str):
+        hour, _, minute = start_time.partition(":")
+        hour, minute = int(hour), int(minute)
+    elif isinstance(start_time, dt_time):
+        hour, minute = start_time.hour, start_time.minute
+    elif isinstance(start_time, dict):
+        hour, minute = int(start_time["hour"]), int(start_time["minute"])
+    else:
+        raise ValueError(f"Unexpected type for startTime: {type(start_time)}")
+
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Invalid startTime {start_time!r}")
+    return hour * 60 + minute
+
+
+def compile_schedule(schedule):
+    return CompiledSchedule(
+        schedule_id=schedule.get("scheduleID"),
+        plant_id=schedule["plantID"],
+        weekday_mask=parse_weekday_mask(schedule.get("weekdays")),
+        start_minute=parse_start_minute(schedule["startTime"]),
+        type=schedule.get("type"),
+        threshold=schedule.get("threshold"),
+    )
+
+
+def build_schedule_index(schedules, logger=None):
+    """
+    Compile schedules into a plantID -> tuple of CompiledSchedule mapping.
+    Schedules that cannot be parsed are logged and left out of the index.
+    """
+    index = {}
+    for schedule in schedules or []:
+        try:
+            compiled = compile_schedule(schedule)
+        except (KeyError, TypeError, ValueError) as e:
+            if logger is not None:
+                logger.error(
+                    f"Skipping invalid schedule {schedule.get('scheduleID', 'N/A')}: {str(e)}"
+                )
+            continue
+        index.setdefault(compiled.plant_id, []).append(compiled)
+    return {plant_id: tuple(entries) for plant_id, entries in index.items()}
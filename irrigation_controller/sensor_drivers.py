@@ -0,0 +1,180 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_DHT_PIN = 23
+
+# Sensor type -> driver class, types are lowercase
+DRIVERS = {}
+
+
+def normalize_type(sensor_type):
+    """Sensor types are stored as "Moisture" or "moisture", compare lowercase."""
+    return str(sensor_type).lower()
+
+
+def register_driver(*sensor_types):
+    def decorator(driver_class):
+        for sensor_type in sensor_types:
+            DRIVERS[normalize_type(sensor_type)] = driver_class
+        return driver_class
+
+    return decorator
+
+
+def driver_for(sensor_type, test=False):
+    if test:
+        return SimulatedDriver
+    return DRIVERS.get(normalize_type(sensor_type))
+
+
+class SensorDriver:
+    """
+    Reads one device that may back several logical sensors, e.g. a DHT
+    providing a Temperature and a Humidity sensor. read() returns a dict of
+    lowercase sensor type -> value, or None if the device could not be read.
+    """
+
+    default_interval = 300
+
+    def __init__(self, device_key, logger, interval=None):
+        self.device_key = device_key
+        self.logger = logger
+        self.interval = interval or self.default_interval
+        self.sensors = []
+
+    @classmethod
+    def device_key_for(cls, sensor):
+        return (cls.__name__, sensor.get("gpioPort"))
+
+    async def read(self):
+        raise NotImplementedError
+
+    async def poll(self, sensors=None):
+        """
+        Read the device once and return one reading per logical sensor, or
+        only for the given subset of its sensors. The value is None for
+        sensors the device returned nothing for.
+        """
+        values = await self.read()
+        if values is None:
+            return []
+        timestamp = time.time()
+        readings = []
+        for sensor in self.sensors if sensors is None else sensors:
+            readings.append(
+                {
+                    "sensorID": sensor["sensorID"],
+                    "value": values.get(normalize_type(sensor["type"])),
+                    "timestamp": timestamp,
+                }
+            )
+        return readings
+
+    def close(self):
+        pass
+
+
+class BlockingSensorDriver(SensorDriver):
+    """
+    Driver whose device access blocks. read_blocking() runs in a worker
+    thread owned by the driver, so a slow or hanging device only delays its
+    own readings. Failed reads are retried.
+    """
+
+    timeout = 3.0
+    retries = 3
+    retry_delay = 2.0
+    # Errors the device library raises for a read that may succeed on retry
+    transient_errors = (RuntimeError, OSError)
+
+    def __init__(self, device_key, logger, interval=None):
+        super().__init__(device_key, logger, interval)
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"{type(self).__name__}-{device_key[1]}"
+        )
+
+    def read_blocking(self):
+        raise NotImplementedError
+
+    async def read(self):
+        loop = asyncio.get_running_loop()
+        for attempt in range(1, self.retries + 1):
+            try:
+                values = await asyncio.wait_for(
+                    loop.run_in_executor(self.executor, self.read_blocking),
+                    timeout=self.timeout,
+                )
+                if any(value is not None for value in values.values()):
+                    return values
+                self.logger.warning(f"{self.device_key} returned no data")
+            except asyncio.TimeoutError:
+                self.logger.warning(
+                    f"Read of {self.device_key} timed out (attempt {attempt})"
+                )
+            except self.transient_errors as e:
+                self.logger.debug(
+                    f"Read of {self.device_key} failed (attempt {attempt}): {e}"
+                )
+            if attempt < self.retries:
+                await asyncio.sleep(self.retry_delay)
+        self.logger.error(f"Giving up reading {self.device_key}")
+        return None
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+@register_driver("temperature", "humidity")
+class DHTDriver(BlockingSensorDriver):
+    # The DHT11 needs about a second between reads
+    retry_delay = 2.0
+
+    def __init__(self, device_key, logger, interval=None, device=None):
+        super().__init__(device_key, logger, interval)
+        if device is None:
+            import adafruit_dht
+            import board
+
+            device = adafruit_dht.DHT11(getattr(board, f"D{self.pin}"))
+        self.device = device
+
+    @property
+    def pin(self):
+        return self.device_key[1]
+
+    @classmethod
+    def device_key_for(cls, sensor):
+        return (cls.__name__, sensor.get("gpioPort") or DEFAULT_DHT_PIN)
+
+    def read_blocking(self):
+        return {
+            "temperature": self.device.temperature,
+            "humidity": self.device.humidity,
+        }
+
+    def close(self):
+        super().close()
+        self.device.exit()
+
+
+class SimulatedDriver(SensorDriver):
+    """Fixed values for every sensor type, used in test mode."""
+
+    values = {
+        "temperature": 25.0,
+        "humidity": 60.0,
+        "moisture": 45.0,
+    }
+
+    @classmethod
+    def device_key_for(cls, sensor):
+        return (cls.__name__, sensor["sensorID"])
+
+    async def read(self):
+        return {
+            normalize_type(sensor["type"]): self.values.get(
+                normalize_type(sensor["type"]), 0.0
+            )
+            for sensor in self.sensors
+        }
@@ -0,0 +1,214 @@
+import warnings
+from collections import Counter
+import numpy as np
+from irrigation_controller.sensor_drivers import normalize_type
+
+
+class Deadband:
+    """
+    Change-only reporting for one sensor.
+
+    A reading is emitted when it differs from the last emitted value by more
+    than the absolute or relative deadband, or when nothing was emitted for
+    max_silence seconds, so consumers still see the sensor is alive.
+    """
+
+    def __init__(self, absolute=None, relative=None, max_silence=900):
+        self.absolute = absolute
+        self.relative = relative
+        self.max_silence = max_silence
+        self.last_value = None
+        self.last_timestamp = None
+
+    @classmethod
+    def from_sensor(cls, sensor, default_max_silence=900):
+        return cls(
+            absolute=sensor.get("deadbandAbs"),
+            relative=sensor.get("deadbandRel"),
+            max_silence=sensor.get("maxSilence") or default_max_silence,
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.absolute or self.relative)
+
+    def exceeded(self, value):
+        change = abs(value - self.last_value)
+        if self.absolute and change > self.absolute:
+            return True
+        if self.relative and change > self.relative * abs(self.last_value):
+            return True
+        return False
+
+    def should_emit(self, value, timestamp):
+        emit = (
+            not self.enabled
+            or self.last_value is None
+            or timestamp - self.last_timestamp >= self.max_silence
+            or self.exceeded(value)
+        )
+        if emit:
+            self.last_value = value
+            self.last_timestamp = timestamp
+        return emit
+
+
+class DeadbandFilter:
+    """Applies the deadband of every sensor and counts what it suppressed."""
+
+    def __init__(self, default_max_silence=900):
+        self.default_max_silence = default_max_silence
+        self.deadbands = {}  # Sensor ID -> Deadband
+        self.emitted = 0
+        self.suppressed = 0
+
+    def rebuild(self, sensors):
+        deadbands = {}
+        for sensor in sensors:
+            deadband = Deadband.from_sensor(sensor, self.default_max_silence)
+            previous = self.deadbands.get(sensor["sensorID"])
+            if previous is not None:
+                deadband.last_value = previous.last_value
+                deadband.last_timestamp = previous.last_timestamp
+            deadbands[sensor["sensorID"]] = deadband
+        self.deadbands = deadbands
+
+    def apply(self, readings):
+        """Return the readings that should be reported."""
+        emitted = []
+        for reading in readings:
+            deadband = self.deadbands.get(reading["sensorID"])
+            if deadband is None or deadband.should_emit(
+                reading["value"], reading["timestamp"]
+            ):
+                emitted.append(reading)
+        self.emitted += len(emitted)
+        self.suppressed += len(readings) - len(emitted)
+        return emitted
+
+    @property
+    def suppression_ratio(self):
+        total = self.emitted + self.suppressed
+        return self.suppressed / total if total else 0.0
+
+
+# Plausible value range per lowercase sensor type, readings outside are
+# glitches
+VALID_RANGES = {
+    "temperature": (-40.0, 80.0),
+    "humidity": (0.0, 100.0),
+    "moisture": (0.0, 100.0),
+}
+
+
+class GlitchFilter:
+    """
+    Rejects implausible readings in one vectorized pass per batch.
+
+    A reading is rejected when it is missing, outside the valid range of its
+    sensor (minValue/maxValue on the sensor, else VALID_RANGES of its type)
+    or when a Hampel test flags it as an outlier: it lies more than
+    n_sigmas scaled median absolute deviations from the median of the
+    sensor's recent window. Every in-range value enters the window, so a
+    real step change is accepted once it dominates the window.
+    """
+
+    def __init__(self, window=7, n_sigmas=3.0, min_deviation=1.0, min_samples=3):
+        self.window = window
+        self.n_sigmas = n_sigmas
+        # Floor of the deviation estimate, about the sensor resolution
+        self.min_deviation = min_deviation
+        self.min_samples = min_samples
+        self.ranges = {}  # Sensor ID -> (low, high)
+        self.sensor_rows = {}  # Sensor ID -> row number
+        self.values = np.full((0, window), np.nan)
+        self.positions = np.zeros(0, dtype=np.intp)
+        self.accepted = 0
+        self.rejected = Counter()  # Reason -> count
+        self.rejected_by_sensor = Counter()
+
+    def rebuild(self, sensors):
+        self.ranges = {}
+        for sensor in sensors:
+            low, high = VALID_RANGES.get(
+                normalize_type(sensor["type"]), (-np.inf, np.inf)
+            )
+            if sensor.get("minValue") is not None:
+                low = sensor["minValue"]
+            if sensor.get("maxValue") is not None:
+                high = sensor["maxValue"]
+            self.ranges[sensor["sensorID"]] = (low, high)
+
+    def row_of(self, sensor_id):
+        row = self.sensor_rows.get(sensor_id)
+        if row is not None:
+            return row
+        row = len(self.sensor_rows)
+        if row == len(self.positions):
+            extra = max(8, row)
+            self.values = np.vstack(
+                [self.values, np.full((extra, self.window), np.nan)]
+            )
+            self.positions = np.concatenate(
+                [self.positions, np.zeros(extra, dtype=np.intp)]
+            )
+        self.sensor_rows[sensor_id] = row
+        return row
+
+    def apply(self, readings):
+        """Return the readings that passed, counting the rejected ones."""
+        if not readings:
+            return []
+        rows = np.array([self.row_of(reading["sensorID"]) for reading in readings])
+        if len(np.unique(rows)) != len(rows):
+            # Readings of one sensor must see each other in the window
+            return [passed for reading in readings for passed in self.apply([reading])]
+
+        values = np.array(
+            [
+                np.nan if reading["value"] is None else reading["value"]
+                for reading in readings
+            ],
+            dtype=np.float64,
+        )
+        bounds = np.array(
+            [
+                self.ranges.get(reading["sensorID"], (-np.inf, np.inf))
+                for reading in readings
+            ],
+            dtype=np.float64,
+        )
+        valid = np.isfinite(values)
+        in_range = valid & (values >= bounds[:, 0]) & (values <= bounds[:, 1])
+
+        windows = self.values[rows]
+        missing = np.isnan(windows)
+        filled = np.count_nonzero(~missing, axis=1) >= self.min_samples
+        # nanmedian is much slower, it is only needed until windows are full
+        median_of = np.nanmedian if missing.any() else np.median
+        with warnings.catch_warnings():
+            # Sensors without history have all-NaN windows
+            warnings.simplefilter("ignore", RuntimeWarning)
+            median = median_of(windows, axis=1)
+            mad = median_of(np.abs(windows - median[:, None]), axis=1)
+        scale = np.maximum(1.4826 * np.nan_to_num(mad), self.min_deviation)
+        outlier = in_range & filled & (np.abs(values - median) > self.n_sigmas * scale)
+
+        update = rows[in_range]
+        positions = self.positions[update]
+        self.values[update, positions] = values[in_range]
+        self.positions[update] = (positions + 1) % self.window
+
+        passed = in_range & ~outlier
+        self.accepted += int(passed.sum())
+        for reason, mask in (
+            ("missing", ~valid),
+            ("range", valid & ~in_range),
+            ("outlier", outlier),
+        ):
+            if mask.any():
+                self.rejected[reason] += int(mask.sum())
+                self.rejected_by_sensor.update(
+                    readings[i]["sensorID"] for i in np.flatnonzero(mask)
+                )
+        return [reading for reading, ok in zip(readings, passed) if ok]
@@ -0,0 +1,128 @@
+import math
+import time
+import numpy as np
+
+
+class SensorHistory:
+    """
+    Recent readings of every sensor in fixed-size ring buffers.
+
+    Each sensor owns one row of a sensors x capacity array of timestamps and
+    one of values, so memory is capacity * 12 bytes per sensor no matter how
+    long the controller runs. Queries select the samples of the last
+    `seconds` with a mask over the row, the order in the ring does not
+    matter to them.
+
+    Without an explicit capacity the ring holds horizon seconds of samples
+    at sample_rate per second, 21600 samples (about 260 KB) per sensor by
+    default. Sensors sampled faster keep less than the horizon.
+    """
+
+    def __init__(self, capacity=None, horizon=6 * 3600, sample_rate=1.0):
+        self.capacity = capacity or math.ceil(horizon * sample_rate)
+        capacity = self.capacity
+        # Samples older than this are never returned
+        self.horizon = horizon
+        self.sensor_rows = {}  # Sensor ID -> row number
+        self.timestamps = np.full((0, capacity), -np.inf)
+        self.values = np.full((0, capacity), np.nan, dtype=np.float32)
+        self.positions = np.zeros(0, dtype=np.intp)
+
+    @property
+    def memory_bytes(self):
+        return self.timestamps.nbytes + self.values.nbytes + self.positions.nbytes
+
+    def row_of(self, sensor_id):
+        row = self.sensor_rows.get(sensor_id)
+        if row is not None:
+            return row
+        row = len(self.sensor_rows)
+        if row == len(self.positions):
+            # Add rows in chunks so new sensors rarely reallocate
+            extra = max(8, row)
+            self.timestamps = np.vstack(
+                [self.timestamps, np.full((extra, self.capacity), -np.inf)]
+            )
+            self.values = np.vstack(
+                [
+                    self.values,
+                    np.full((extra, self.capacity), np.nan, dtype=np.float32),
+                ]
+            )
+            self.positions = np.concatenate(
+                [self.positions, np.zeros(extra, dtype=np.intp)]
+            )
+        self.sensor_rows[sensor_id] = row
+        return row
+
+    def append(self, sensor_id, timestamp, value):
+        row = self.row_of(sensor_id)
+        position = self.positions[row]
+        self.timestamps[row, position] = timestamp
+        self.values[row, position] = value
+        self.positions[row] = (position + 1) % self.capacity
+
+    def extend(self, readings):
+        """Append a batch of reading dicts (sensorID, timestamp, value)."""
+        if not readings:
+            return
+        rows = np.fromiter(
+            (self.row_of(reading["sensorID"]) for reading in readings),
+            dtype=np.intp,
+            count=len(readings),
+        )
+        timestamps = np.fromiter(
+            (reading["timestamp"] for reading in readings),
+            dtype=np.float64,
+            count=len(readings),
+        )
+        values = np.fromiter(
+            (reading["value"] for reading in readings),
+            dtype=np.float32,
+            count=len(readings),
+        )
+        if len(np.unique(rows)) != len(rows):
+            # Several readings of one sensor, their slots depend on each other
+            for row, timestamp, value in zip(rows, timestamps, values):
+                position = self.positions[row]
+                self.timestamps[row, position] = timestamp
+                self.values[row, position] = value
+                self.positions[row] = (position + 1) % self.capacity
+            return
+        positions = self.positions[rows]
+        self.timestamps[rows, positions] = timestamps
+        self.values[rows, positions] = values
+        self.positions[rows] = (positions + 1) % self.capacity
+
+    def window(self, sensor_id, seconds=None, now=None):
+        """Return (timestamps, values) of a sensor's samples in the window."""
+        row = self.sensor_rows.get(sensor_id)
+        if row is None:
+            return np.empty(0), np.empty(0, dtype=np.float32)
+        now = time.time() if now is None else now
+        seconds = self.horizon if seconds is None else min(seconds, self.horizon)
+        timestamps = self.timestamps[row]
+        mask = (timestamps >= now - seconds) & (timestamps <= now)
+        return timestamps[mask], self.values[row][mask]
+
+    def count(self, sensor_id, seconds=None, now=None):
+        return len(self.window(sensor_id, seconds, now)[0])
+
+    def rolling_mean(self, sensor_id, seconds=None, now=None):
+        _, values = self.window(sensor_id, seconds, now)
+        return float(values.mean()) if len(values) else None
+
+    def slope(self, sensor_id, seconds=None, now=None):
+        """Least-squares trend of the window in units per hour."""
+        timestamps, values = self.window(sensor_id, seconds, now)
+        if len(values) < 2:
+            return None
+        offsets = timestamps - timestamps.mean()
+        spread = np.dot(offsets, offsets)
+        if spread == 0:
+            return None
+        return float(np.dot(offsets, values - values.mean()) / spread * 3600)
+
+    def percentile(self, sensor_id, q, seconds=None, now=None):
+        _, values = self.window(sensor_id, seconds, now)
+        return float(np.percentile(values, q)) if len(values) else None
@@ -1,105 +1,216 @@
 import asyncio
 import time
-import json
 from server_app.logging_config import setup_logger
+from irrigation_controller.reading_store import LatestReadingStore
+from irrigation_controller.sensor_drivers import driver_for
+from irrigation_controller.sampling import SamplingCadence
+from irrigation_controller.sensor_filters import DeadbandFilter, GlitchFilter
+from irrigation_controller.sensor_history import SensorHistory
+from server_app.services.event_streams import EventStream, SENSOR_STREAM
 
 
 class SensorService:
-    def __init__(self, controller_id, redis_client, stop_event, test=False):
+    def __init__(
+        self,
+        controller_id,
+        redis_client,
+        stop_event,
+        test=False,
+        reading_store=None,
+        sensor_history=None,
+    ):
         self.logger = setup_logger(__name__)
         self.controller_id = controller_id
         self.redis_client = redis_client
+        self.sensor_stream = EventStream(redis_client, SENSOR_STREAM)
         self.stop_event = stop_event
         self.sensors = []
+        self.reading_store = reading_store or LatestReadingStore(redis_client)
+        self.sensor_history = sensor_history or SensorHistory()
         self.healthy = asyncio.Event()
         self.healthy.set()
         self.test = test
-        if test is False:
-            import adafruit_dht
-            import board
-
-            self.dhtDevice = adafruit_dht.DHT11(board.D23)
+        self.drivers = {}  # Device key -> driver
+        self.poll_tasks = {}  # Device key -> polling task
+        self.cadences = {}  # Sensor ID -> SamplingCadence
+        self.thresholds = {}  # Sensor ID -> schedule thresholds it serves
+        self.glitches = GlitchFilter()
+        self.deadband = DeadbandFilter()
+        self.running = False
 
     async def start(self):
         self.logger.info("Starting sensor service")
         self.healthy.set()
-        asyncio.create_task(self.update_data())
+        self.running = True
+        self.start_polling()
 
     async def stop(self):
         self.logger.info("Stopping sensor service")
         self.stop_event.set()
-        await asyncio.sleep(1)  # Give time for the update_data loop to stop
+        self.running = False
+        tasks = list(self.poll_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.poll_tasks = {}
+        for driver in self.drivers.values():
+            driver.close()
+        self.drivers = {}
+        self.sensors = []
 
     async def restart(self):
         await self.stop()
         await self.start()
 
-    async def update_data(self):
-        while not self.stop_event.is_set():
-            try:
-                new_data = await self.read_sensor_data()
-                await asyncio.sleep(300)  # Read data every hour
+    def build_drivers(self, sensors):
+        drivers = {}
+        for sensor in sensors:
+            driver_class = driver_for(sensor["type"], self.test)
+            if driver_class is None:
+                self.logger.warning(
+                    f"No driver for sensor {sensor['sensorID']} of type {sensor['type']}"
+                )
+                continue
+            key = driver_class.device_key_for(sensor)
+            driver = drivers.get(key)
+            if driver is None:
+                # Keep devices that are already open
+                driver = self.drivers.get(key) or driver_class(key, self.logger)
+                driver.sensors = []
+                drivers[key] = driver
+            driver.sensors.append(sensor)
+        return drivers
 
-                if new_data:  # Only push if there's data
-                    for data in new_data:
-                        await self.redis_client.rpush("sensor_data", json.dumps(data))
+    def start_polling(self):
+        for key, driver in self.drivers.items():
+            task = self.poll_tasks.get(key)
+            if task is None or task.done():
+                self.poll_tasks[key] = asyncio.create_task(self.poll_driver(driver))
 
+    async def poll_driver(self, driver):
+        # Every device is polled by its own task on its own cadence, so a slow
+        # device never delays the others. One read serves all sensors of the
+        # device that are due.
+        while not self.stop_event.is_set():
+            due = []
+            try:
+                now = time.monotonic()
+                due = [
+                    sensor
+                    for sensor in driver.sensors
+                    if self.cadence_for(sensor, driver).is_due(now)
+                ]
+                if due:
+                    readings = await driver.poll(due)
+                    if readings:
+                        await self.publish(readings)
+                    self.observe(due, readings)
             except Exception as e:
-                self.logger.error(f"Error in update_data: {e}")
+                self.logger.error(f"Error polling {driver.device_key}: {e}")
                 self.healthy.clear()
-                await asyncio.sleep(5)  # Wait before retrying
+                # Count it as a failed read, so the sensors wait a full
+                # interval instead of being polled again right away
+                self.observe(due, [])
+            await asyncio.sleep(self.seconds_until_due(driver))
+
+    def cadence_for(self, sensor, driver):
+        cadence = self.cadences.get(sensor["sensorID"])
+        if cadence is None:
+            cadence = SamplingCadence.from_sensor(sensor, driver.interval)
+            self.cadences[sensor["sensorID"]] = cadence
+        return cadence
+
+    def observe(self, sensors, readings):
+        now = time.monotonic()
+        values = {reading["sensorID"]: reading["value"] for reading in readings}
+        for sensor in sensors:
+            sensor_id = sensor["sensorID"]
+            self.cadences[sensor_id].observe(
+                values.get(sensor_id), now, self.thresholds.get(sensor_id, ())
+            )
+
+    def seconds_until_due(self, driver):
+        next_due = min(
+            (
+                self.cadences[sensor["sensorID"]].next_due
+                for sensor in driver.sensors
+                if sensor["sensorID"] in self.cadences
+            ),
+            default=time.monotonic() + driver.interval,
+        )
+        return max(0.0, next_due - time.monotonic())
+
+    async def publish(self, readings):
+        readings = self.glitches.apply(readings)
+        # History keeps every valid sample, the deadband only applies to
+        # reporting
+        self.sensor_history.extend(readings)
+        # Only readings that moved past their deadband are reported
+        readings = self.deadband.apply(readings)
+        if not readings:
+            return
+        # The latest readings and all stream entries go out in one round trip
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            self.reading_store.write_to(pipe, readings)
+            for data in readings:
+                self.sensor_stream.add_to(pipe, data)
+            await pipe.execute()
 
     async def read_sensor_data(self):
-        if self.test is False:
-            sensor_data = []
-            for sensor in self.sensors:
-                self.logger.info(
-                    f"Reading data from sensor {sensor['sensorID']} of type {sensor['type']}"
-                )
-                if sensor["type"] == "Temperature":
-                    sensor_data.append(
-                        {
-                            "sensorID": sensor["sensorID"],
-                            "value": self.dhtDevice.temperature,
-                            "timestamp": time.time(),
-                        }
-                    )
-                elif sensor["type"] == "Humidity":
-                    sensor_data.append(
-                        {
-                            "sensorID": sensor["sensorID"],
-                            "value": self.dhtDevice.humidity,
-                            "timestamp": time.time(),
-                        }
-                    )
-            return sensor_data
-        else:
-            # Simulate sensor data for testing
-            sensor_data = []
-            for sensor in self.sensors:
-                self.logger.info(
-                    f"Simulating data for sensor {sensor['sensorID']} of type {sensor['type']}"
-                )
-                if sensor["type"] == "Temperature":
-                    sensor_data.append(
-                        {
-                            "sensorID": sensor["sensorID"],
-                            "value": 25.0,  # Simulated temperature
-                            "timestamp": time.time(),
-                        }
-                    )
-                elif sensor["type"] == "Humidity":
-                    sensor_data.append(
-                        {
-                            "sensorID": sensor["sensorID"],
-                            "value": 60.0,  # Simulated humidity
-                            "timestamp": time.time(),
-                        }
-                    )
-            return sensor_data
+        """Read every device once, concurrently."""
+        results = await asyncio.gather(
+            *(driver.poll() for driver in self.drivers.values()),
+            return_exceptions=True,
+        )
+        sensor_data = []
+        for driver, readings in zip(self.drivers.values(), results):
+            if isinstance(readings, Exception):
+                self.logger.error(f"Error reading {driver.device_key}: {readings}")
+                continue
+            sensor_data.extend(readings)
+        return sensor_data
 
     async def update_sensors(self, new_sensors):
+        if new_sensors == self.sensors:
+            return
         self.sensors = new_sensors
+        drivers = self.build_drivers(new_sensors)
+        for key, driver in self.drivers.items():
+            if key not in drivers:
+                task = self.poll_tasks.pop(key, None)
+                if task is not None:
+                    task.cancel()
+                driver.close()
+        self.drivers = drivers
+
+        cadences = {}
+        for driver in drivers.values():
+            for sensor in driver.sensors:
+                cadence = SamplingCadence.from_sensor(sensor, driver.interval)
+                previous = self.cadences.get(sensor["sensorID"])
+                if previous is not None:
+                    cadence.next_due = previous.next_due
+                cadences[sensor["sensorID"]] = cadence
+        self.cadences = cadences
+        self.glitches.rebuild(new_sensors)
+        self.deadband.rebuild(new_sensors)
+        self.logger.info(
+            f"Updated sensors: {len(new_sensors)} sensors on {len(drivers)} devices"
+        )
+        if self.running:
+            self.start_polling()
+
+    async def update_thresholds(self, new_thresholds):
+        self.thresholds = new_thresholds
+
+    def get_stats(self):
+        return {
+            "emitted": self.deadband.emitted,
+            "suppressed": self.deadband.suppressed,
+            "suppression_ratio": self.deadband.suppression_ratio,
+            "accepted": self.glitches.accepted,
+            "rejected": dict(self.glitches.rejected),
+        }
 
     async def is_healthy(self):
         return self.healthy.is_set()
@@ -0,0 +1,142 @@
+import numpy as np
+
+from irrigation_controller.pump_dispatcher import DEFAULT_SUPPLY_LINE, supply_line_of
+
+
+def irrigation_time(water_requirement, flow_rate):
+    """Seconds a pump with flow_rate ml/min needs to deliver water_requirement ml."""
+    return 60 * water_requirement / flow_rate
+
+
+class PlannedRun:
+    __slots__ = ("job", "duration", "start")
+
+    def __init__(self, job, duration, start):
+        self.job = job
+        self.duration = duration
+        self.start = start
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+
+class WateringPlan:
+    def __init__(self, jobs, starts, durations):
+        # Jobs ordered by planned start time
+        self.jobs = jobs
+        self.starts = starts
+        self.durations = durations
+        self.makespan = float((starts + durations).max()) if len(jobs) else 0.0
+
+    def __len__(self):
+        return len(self.jobs)
+
+    @property
+    def runs(self):
+        return [
+            PlannedRun(job, float(duration), float(start))
+            for job, start, duration in zip(self.jobs, self.starts, self.durations)
+        ]
+
+
+def lane_starts(weights, lanes):
+    """
+    Start of every run (given longest first) when the runs are dealt onto
+    lanes in snake order, 0, 1, .., lanes - 1, lanes - 1, .., 0, 0, .., and
+    each lane runs its share back to back. weights is the time a run holds
+    its lane.
+    """
+    count = len(weights)
+    rounds = np.zeros((-(-count // (2 * lanes)) * 2, lanes))
+    rounds.flat[:count] = weights
+    # Every other round is dealt backwards
+    rounds[1::2] = rounds[1::2, ::-1]
+    starts = np.cumsum(rounds, axis=0) - rounds
+    starts[1::2] = starts[1::2, ::-1]
+    return starts.ravel()[:count]
+
+
+def fluid_starts(durations, usage, budget):
+    """
+    Latest start of every run (given longest first) that still lets all runs
+    before it share budget without exceeding it, treating the budget as a
+    fluid. A run larger than the budget uses all of it.
+    """
+    work = np.minimum(usage, budget) * durations
+    return np.maximum(np.cumsum(work) / budget - durations, 0.0)
+
+
+def plan_watering(
+    jobs, max_open_pumps=None, max_total_flow=None, supply_line_limits=None
+):
+    """
+    Order irrigation jobs longest processing time first and estimate when
+    each one starts under the open pump, total flow and supply line budgets.
+
+    The pump budget and every limited supply line are lanes that the runs
+    are dealt onto in snake order, the total flow is shared as a fluid; each
+    budget gives a start by cumulative sums and a run starts at the latest
+    of them. All of it is a handful of vectorized passes. The
+    PumpDispatcher enforces the budgets when the runs are executed, the
+    plan orders the jobs it is handed and estimates the makespan. Both
+    follow over_budget: a run larger than a budget starts once nothing else
+    holds it and then holds all of it.
+    """
+    jobs = [job for job in jobs if job.pumps]
+    if not jobs:
+        return WateringPlan([], np.empty(0), np.empty(0))
+    supply_line_limits = supply_line_limits or {}
+    line_numbers = {line: number for number, line in enumerate(supply_line_limits)}
+
+    pump_lists = [job.pumps for job in jobs]
+    water = np.array([job.plant["waterRequirement"] for job in jobs], dtype=float)
+    flows = np.array([pumps[0]["flowRate"] for pumps in pump_lists], dtype=float)
+    pump_counts = np.array([len(pumps) for pumps in pump_lists], dtype=float)
+    # Pumps a run opens on its (first pump's) supply line
+    line_pumps = np.ones(len(jobs))
+    for index in np.flatnonzero(pump_counts > 1).tolist():
+        flows[index] = jobs[index].flow_rate
+        line_pumps[index] = jobs[index].supply_lines[
+            supply_line_of(pump_lists[index][0])
+        ]
+    if line_numbers:
+        lines = np.array(
+            [
+                line_numbers.get(pumps[0].get("supplyLine") or DEFAULT_SUPPLY_LINE, -1)
+                for pumps in pump_lists
+            ],
+            dtype=np.intp,
+        )
+    else:
+        lines = np.full(len(jobs), -1, dtype=np.intp)
+
+    durations = irrigation_time(water, flows)
+    # Longest first with ties in submission order
+    rank = np.argsort(-durations, kind="stable")
+    durations = durations[rank]
+    flows = flows[rank]
+    pump_counts = pump_counts[rank]
+    lines = lines[rank]
+    line_pumps = line_pumps[rank]
+
+    starts = np.zeros(len(jobs))
+    if max_open_pumps is not None:
+        # A run with several pumps holds its lane for their pump-seconds
+        weights = np.minimum(pump_counts, max_open_pumps) * durations
+        starts = np.maximum(starts, lane_starts(weights, max_open_pumps))
+    if max_total_flow is not None:
+        starts = np.maximum(starts, fluid_starts(durations, flows, max_total_flow))
+    for line, number in line_numbers.items():
+        on_line = np.flatnonzero(lines == number)
+        if len(on_line):
+            limit = supply_line_limits[line]
+            weights = np.minimum(line_pumps[on_line], limit) * durations[on_line]
+            starts[on_line] = np.maximum(starts[on_line], lane_starts(weights, limit))
+
+    order = np.argsort(starts, kind="stable")
+    return WateringPlan(
+        [jobs[index] for index in rank[order].tolist()],
+        starts[order],
+        durations[order],
+    )
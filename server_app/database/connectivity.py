@@ -0,0 +1,122 @@
+import asyncio
+import time
+from pymongo import monitoring
+from pymongo.errors import ConnectionFailure
+from ..logging_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# Errors of a MongoDB operation that mean the server could not be reached,
+# ConnectionFailure covers AutoReconnect and server selection timeouts
+NETWORK_ERRORS = (ConnectionFailure, OSError)
+
+
+class ConnectivityMonitor(monitoring.ServerHeartbeatListener):
+    """
+    Tracks whether MongoDB is reachable without opening connections of its
+    own.
+
+    The state follows the driver's server heartbeats and the outcome of our
+    own operations. Heartbeats are tracked per server, MongoDB counts as
+    reachable while any member of the deployment answers, so one member
+    down in a replica set does not flap the state. Only while offline does
+    probe() ping the server, with an exponential backoff between attempts.
+
+    Heartbeat events arrive on the driver's monitor threads, so they are
+    handed to the event loop with call_soon_threadsafe.
+    """
+
+    def __init__(self, initial_backoff=1.0, max_backoff=300.0):
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.backoff = initial_backoff
+        self.online = True
+        self.last_change = time.monotonic()
+        self.last_error = None
+        self.loop = None
+        self.online_event = None
+        # (host, port) -> whether its last heartbeat succeeded
+        self.servers = {}
+
+    def attach(self, loop=None):
+        """Bind to the event loop that waits on the connectivity state."""
+        self.loop = loop or asyncio.get_running_loop()
+        self.online_event = asyncio.Event()
+        if self.online:
+            self.online_event.set()
+
+    def set_online(self, online, error=None):
+        if error is not None:
+            self.last_error = error
+        if online == self.online:
+            return
+        self.online = online
+        self.last_change = time.monotonic()
+        if online:
+            self.backoff = self.initial_backoff
+            logger.info("MongoDB is reachable again")
+        else:
+            logger.warning(f"MongoDB is unreachable: {error}")
+        if self.online_event is not None:
+            if online:
+                self.online_event.set()
+            else:
+                self.online_event.clear()
+
+    def set_server(self, connection_id, reachable, error=None):
+        self.servers[connection_id] = reachable
+        online = any(self.servers.values())
+        self.set_online(online, None if online else error)
+
+    def from_driver_thread(self, connection_id, reachable, error=None):
+        if self.loop is None or self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.set_server, connection_id, reachable, error)
+
+    # ServerHeartbeatListener interface, called by the driver's monitors
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.from_driver_thread(event.connection_id, True)
+
+    def failed(self, event):
+        self.from_driver_thread(event.connection_id, False, event.reply)
+
+    def record_success(self):
+        self.set_online(True)
+
+    def record_failure(self, error):
+        """Mark offline if error means MongoDB could not be reached."""
+        if isinstance(error, NETWORK_ERRORS):
+            self.set_online(False, error)
+            return True
+        return False
+
+    async def wait_online(self):
+        if self.online_event is None:
+            self.attach()
+        await self.online_event.wait()
+
+    async def probe(self, ping):
+        """
+        Wait for the current backoff, or less if a heartbeat brings the
+        server back, then try ping() once. The backoff doubles after
+        every failed attempt.
+        """
+        if self.online_event is None:
+            self.attach()
+        try:
+            await asyncio.wait_for(self.online_event.wait(), timeout=self.backoff)
+            return True
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await ping()
+        except Exception as e:
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            self.last_error = e
+            logger.debug(f"MongoDB probe failed, next in {self.backoff:.0f}s: {e}")
+            return False
+        self.set_online(True)
+        return True
@@ -3,8 +3,8 @@ from dotenv import load_dotenv
 import os
 from pymongo.errors import ConfigurationError
 from ..logging_config import setup_logger  # Changed import
-import socket
 import asyncio
+from .connectivity import ConnectivityMonitor
 
 logger = setup_logger(__name__)
 
@@ -13,36 +13,20 @@ load_dotenv()
 _ATLAS_URI = os.getenv("ATLAS_URI")
 
 
-def check_internet_connection(host="8.8.8.8", port=53, timeout=5):
-    """
-    Check if there is an internet connection by trying to connect to
-    Google's DNS server.
-    """
-    try:
-        socket.setdefaulttimeout(timeout)
-        socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect((host, port))
-        return True
-    except socket.error:
-        return False
-
-
 class DatabaseConnection:
     def __init__(self):
         self.client = None
         self.db = None
+        self.connectivity = ConnectivityMonitor()
 
     async def connect(self, retry_interval=5):
-        while not check_internet_connection():
-            logger.warning(
-                "No internet connection available. Retrying in {} seconds...".format(
-                    retry_interval
-                )
-            )
-            await asyncio.sleep(retry_interval)
-
+        # Reachability is reported by the driver's heartbeats from here on
+        self.connectivity.attach()
         while self.client is None or self.db is None:
             try:
-                self.client = motor.motor_asyncio.AsyncIOMotorClient(_ATLAS_URI)
+                self.client = motor.motor_asyncio.AsyncIOMotorClient(
+                    _ATLAS_URI, event_listeners=[self.connectivity]
+                )
                 self.db = self.client.irrigation_system
                 logger.info("Connected to MongoDB successfully.")
             except ConfigurationError as e:
@@ -53,6 +37,9 @@ class DatabaseConnection:
                 self.db = None
                 await asyncio.sleep(retry_interval)
 
+    async def ping(self):
+        await self.client.admin.command("ping")
+
     def is_connected(self):
         return self.client is not None and self.db is not None
 
@@ -5,3 +5,5 @@ from .pumps import Pumps
 from .schedules import Schedules
 from .logs import Logs
 from .realtime_sensor_data import RealtimeSensorData
+from .tombstones import Tombstones
+from .controller_config import ConfigSnapshot, ControllerConfig
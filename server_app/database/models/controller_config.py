@@ -0,0 +1,78 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from ..database import db_connection
+from .plants import Plants
+from .pumps import Pumps
+from .schedules import Schedules
+from .sensors import Sensors
+from .tombstones import Tombstones
+
+
+@dataclass
+class ConfigSnapshot:
+    """Configuration documents of one controller, all or changed ones."""
+
+    plants: list[dict] = field(default_factory=list)
+    sensors: list[dict] = field(default_factory=list)
+    schedules: list[dict] = field(default_factory=list)
+    pumps: list[dict] = field(default_factory=list)
+    tombstones: list[dict] = field(default_factory=list)
+    changed_since: datetime | None = None
+
+    def documents(self, name):
+        return getattr(self, name)
+
+
+class ControllerConfig:
+    """
+    Loads a controller's plants, sensors, schedules and pumps, and with
+    changed_since also its tombstones, in one aggregation. Each collection
+    is a $unionWith branch with its own match and projection, tagged with
+    its name. Needs MongoDB 4.4 or newer.
+    """
+
+    MODELS = {
+        "plants": Plants,
+        "sensors": Sensors,
+        "schedules": Schedules,
+        "pumps": Pumps,
+        "tombstones": Tombstones,
+    }
+    SOURCE_FIELD = "_source"
+
+    @classmethod
+    def branch(cls, name, query):
+        return [
+            {"$match": query},
+            {
+                "$project": {
+                    **cls.MODELS[name].PROJECTION,
+                    cls.SOURCE_FIELD: {"$literal": name},
+                }
+            },
+        ]
+
+    @classmethod
+    def pipeline(cls, controller_id, changed_since=None):
+        query = {"controllerID": controller_id}
+        if changed_since is not None:
+            query["lastChanged"] = {"$gte": changed_since}
+        names = ["sensors", "schedules", "pumps"]
+        if changed_since is not None:
+            names.append("tombstones")
+        return cls.branch("plants", query) + [
+            {"$unionWith": {"coll": name, "pipeline": cls.branch(name, query)}}
+            for name in names
+        ]
+
+    @classmethod
+    async def load(cls, controller_id, changed_since=None):
+        if not db_connection.is_connected():
+            return None
+        cursor = db_connection.db.plants.aggregate(
+            cls.pipeline(controller_id, changed_since), batchSize=10000
+        )
+        snapshot = ConfigSnapshot(changed_since=changed_since)
+        async for document in cursor:
+            snapshot.documents(document.pop(cls.SOURCE_FIELD)).append(document)
+        return snapshot
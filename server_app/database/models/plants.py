@@ -1,8 +1,19 @@
 from ..database import db_connection
 from pymongo import UpdateOne
+from .tombstones import Tombstones, now
 
 
 class Plants:
+    # Fields the controller syncs
+    PROJECTION = {
+        "plantID": 1,
+        "sensorIDs": 1,
+        "pumpIDs": 1,
+        "waterRequirement": 1,
+        "lastChanged": 1,
+        "_id": 0,
+    }
+
     @classmethod
     async def get_collection(cls):
         if not db_connection.is_connected():
@@ -14,7 +25,7 @@ class Plants:
         collection = await Plants.get_collection()
         if collection is None:
             return None
-        result = await collection.insert_one(plant_data)
+        result = await collection.insert_one({**plant_data, "lastChanged": now()})
         return str(result.inserted_id)
 
     @classmethod
@@ -37,20 +48,14 @@ class Plants:
             return last_plant["plantID"]
 
     @classmethod
-    async def get_plants_by_controller_id(cls, controller_id):
+    async def get_plants_by_controller_id(cls, controller_id, changed_since=None):
         collection = await cls.get_collection()
         if collection is None:
             return None
-        cursor = collection.find(
-            {"controllerID": controller_id},
-            {
-                "plantID": 1,
-                "sensorIDs": 1,
-                "pumpIDs": 1,
-                "waterRequirement": 1,
-                "_id": 0,
-            },
-        )
+        query = {"controllerID": controller_id}
+        if changed_since is not None:
+            query["lastChanged"] = {"$gte": changed_since}
+        cursor = collection.find(query, cls.PROJECTION)
         return await cursor.to_list(length=None)
 
     @classmethod
@@ -64,10 +69,21 @@ class Plants:
         if collection is None:
             return None
         result = await collection.update_one(
-            {"plantID": plant_id}, {"$set": update_data}
+            {"plantID": plant_id}, {"$set": {**update_data, "lastChanged": now()}}
         )
         return result.modified_count
 
+    @classmethod
+    async def delete(cls, plant_id):
+        collection = await cls.get_collection()
+        if collection is None:
+            return None
+        plant = await collection.find_one_and_delete({"plantID": plant_id})
+        if plant is None:
+            return 0
+        await Tombstones.record("plants", plant)
+        return 1
+
     @classmethod
     async def bulk_update_watering_history(cls, watering_data):
         collection = await cls.get_collection()
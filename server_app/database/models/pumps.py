@@ -1,8 +1,22 @@
 from motor.motor_asyncio import AsyncIOMotorCollection
 from ..database import db_connection
+from .tombstones import Tombstones, now
 
 
 class Pumps:
+    # Fields the controller syncs
+    PROJECTION = {
+        "pumpID": 1,
+        "plantID": 1,
+        "gpioPort": 1,
+        "type": 1,
+        "status": 1,
+        "flowRate": 1,
+        "supplyLine": 1,
+        "lastChanged": 1,
+        "_id": 0,
+    }
+
     @classmethod
     async def get_collection(cls):
         if not db_connection.is_connected():
@@ -14,25 +28,18 @@ class Pumps:
         collection = await cls.get_collection()
         if collection is None:
             return None
-        result = await collection.insert_one(pump_data)
+        result = await collection.insert_one({**pump_data, "lastChanged": now()})
         return result.inserted_id
 
     @classmethod
-    async def get_pumps_by_controller(cls, controller_id):
+    async def get_pumps_by_controller(cls, controller_id, changed_since=None):
         collection = await cls.get_collection()
         if collection is None:
             return None
-        cursor = collection.find(
-            {"controllerID": controller_id},
-            {
-                "plantID": 1,
-                "gpioPort": 1,
-                "type": 1,
-                "status": 1,
-                "flowRate": 1,
-                "_id": 0,
-            },
-        )
+        query = {"controllerID": controller_id}
+        if changed_since is not None:
+            query["lastChanged"] = {"$gte": changed_since}
+        cursor = collection.find(query, cls.PROJECTION)
         return await cursor.to_list(length=None)
 
     @classmethod
@@ -47,7 +54,9 @@ class Pumps:
         collection = await cls.get_collection()
         if collection is None:
             return None
-        result = await collection.update_one({"pumpID": pump_id}, {"$set": update_data})
+        result = await collection.update_one(
+            {"pumpID": pump_id}, {"$set": {**update_data, "lastChanged": now()}}
+        )
         return result.modified_count
 
     @classmethod
@@ -55,8 +64,11 @@ class Pumps:
         collection = await cls.get_collection()
         if collection is None:
             return None
-        result = await collection.delete_one({"pumpID": pump_id})
-        return result.deleted_count
+        pump = await collection.find_one_and_delete({"pumpID": pump_id})
+        if pump is None:
+            return 0
+        await Tombstones.record("pumps", pump)
+        return 1
 
 
 async def create_new_pump(plant_data):
@@ -1,8 +1,21 @@
 from motor.motor_asyncio import AsyncIOMotorCollection
 from ..database import db_connection
+from .tombstones import Tombstones, now
 
 
 class Schedules:
+    # Fields the controller syncs
+    PROJECTION = {
+        "scheduleID": 1,
+        "plantID": 1,
+        "weekdays": 1,
+        "startTime": 1,
+        "type": 1,
+        "threshold": 1,
+        "lastChanged": 1,
+        "_id": 0,
+    }
+
     @classmethod
     async def get_collection(cls):
         if not db_connection.is_connected():
@@ -26,17 +39,31 @@ class Schedules:
         collection = await cls.get_collection()
         if collection is None:
             return None
-        result = await collection.insert_one(schedule_data)
+        result = await collection.insert_one({**schedule_data, "lastChanged": now()})
         return result.inserted_id
 
     @classmethod
-    async def get_schedules_by_controller(cls, controller_id):
+    async def get_schedules_by_controller(cls, controller_id, changed_since=None):
         collection = await cls.get_collection()
         if collection is None:
             return None
-        cursor = collection.find({"controllerID": controller_id})
+        query = {"controllerID": controller_id}
+        if changed_since is not None:
+            query["lastChanged"] = {"$gte": changed_since}
+        cursor = collection.find(query, cls.PROJECTION)
         return await cursor.to_list(length=None)
 
+    @classmethod
+    async def delete(cls, schedule_id):
+        collection = await cls.get_collection()
+        if collection is None:
+            return None
+        schedule = await collection.find_one_and_delete({"scheduleID": schedule_id})
+        if schedule is None:
+            return 0
+        await Tombstones.record("schedules", schedule)
+        return 1
+
 
 async def get_highest_id():
     return await Schedules.get_highest_id()
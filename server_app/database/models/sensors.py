@@ -1,13 +1,32 @@
 from motor.motor_asyncio import AsyncIOMotorCollection
-from app.database.database import db_connection
-from app.logging_config import setup_logger
+from ..database import db_connection
+from ...logging_config import setup_logger
 import json
 from pymongo import UpdateOne
+from .tombstones import Tombstones, now
 
 logger = setup_logger(__name__)
 
 
 class Sensors:
+    # Fields the controller syncs
+    PROJECTION = {
+        "sensorID": 1,
+        "type": 1,
+        "gpioPort": 1,
+        "sampleInterval": 1,
+        "adaptiveSampling": 1,
+        "minSampleInterval": 1,
+        "maxSampleInterval": 1,
+        "deadbandAbs": 1,
+        "deadbandRel": 1,
+        "maxSilence": 1,
+        "minValue": 1,
+        "maxValue": 1,
+        "lastChanged": 1,
+        "_id": 0,
+    }
+
     @classmethod
     async def get_collection(cls):
         if not db_connection.is_connected():
@@ -19,20 +38,31 @@ class Sensors:
         collection = await cls.get_collection()
         if collection is None:
             return None
-        result = await collection.insert_one(sensor_data)
+        result = await collection.insert_one({**sensor_data, "lastChanged": now()})
         return result.inserted_id
 
     @classmethod
-    async def get_sensors_by_controller(cls, controller_id):
+    async def get_sensors_by_controller(cls, controller_id, changed_since=None):
         collection = await cls.get_collection()
         if collection is None:
             return None
-        cursor = collection.find(
-            {"controllerID": controller_id},
-            projection={"sensorID": 1, "type": 1, "_id": 0},
-        )
+        query = {"controllerID": controller_id}
+        if changed_since is not None:
+            query["lastChanged"] = {"$gte": changed_since}
+        cursor = collection.find(query, projection=cls.PROJECTION)
         return await cursor.to_list(length=None)
 
+    @classmethod
+    async def delete(cls, sensor_id):
+        collection = await cls.get_collection()
+        if collection is None:
+            return None
+        sensor = await collection.find_one_and_delete({"sensorID": sensor_id})
+        if sensor is None:
+            return 0
+        await Tombstones.record("sensors", sensor)
+        return 1
+
     @classmethod
     async def process_sensor_data_batch(cls, sensor_data_list):
         collection = await cls.get_collection()
@@ -84,6 +114,55 @@ class Sensors:
             logger.warning("No valid sensor data to process")
             return False, {}
 
+    @classmethod
+    async def process_sensor_windows(cls, windows):
+        """
+        Append window summaries to the readings of their sensors. Returns the
+        last reading of every sensor, or None if MongoDB is not connected.
+        """
+        collection = await cls.get_collection()
+        if collection is None:
+            return None
+        windows_by_sensor = {}
+        latest_readings = {}
+        for window in windows:
+            sensor_id = window["sensorID"]
+            windows_by_sensor.setdefault(sensor_id, []).append(
+                {
+                    "timestamp": window["windowStart"],
+                    "window": window["windowSeconds"],
+                    "value": window["mean"],
+                    "min": window["min"],
+                    "max": window["max"],
+                    "count": window["count"],
+                    "last": window["last"],
+                }
+            )
+            if (
+                sensor_id not in latest_readings
+                or window["lastTimestamp"] > latest_readings[sensor_id]["timestamp"]
+            ):
+                latest_readings[sensor_id] = {
+                    "value": window["last"],
+                    "timestamp": window["lastTimestamp"],
+                }
+
+        # One update per sensor for all of its windows
+        bulk_operations = [
+            UpdateOne(
+                {"sensorID": sensor_id},
+                {"$push": {"readings": {"$each": readings}}},
+                upsert=True,
+            )
+            for sensor_id, readings in windows_by_sensor.items()
+        ]
+        if bulk_operations:
+            result = await collection.bulk_write(bulk_operations)
+            logger.info(
+                f"Stored {len(windows)} windows for {result.modified_count} sensors"
+            )
+        return latest_readings
+
     @classmethod
     async def get_sensor_type(cls, sensorID):
         collection = await cls.get_collection()
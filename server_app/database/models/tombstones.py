@@ -0,0 +1,55 @@
+from datetime import datetime, timezone
+from ..database import db_connection
+
+
+def now():
+    return datetime.now(timezone.utc)
+
+
+class Tombstones:
+    """
+    Records deleted configuration documents so controllers syncing deltas
+    by lastChanged also learn about deletions.
+    """
+
+    PROJECTION = {"collection": 1, "key": 1, "lastChanged": 1, "_id": 0}
+    # ID field of the documents of every configuration collection
+    KEYS = {
+        "plants": "plantID",
+        "sensors": "sensorID",
+        "schedules": "scheduleID",
+        "pumps": "pumpID",
+    }
+
+    @classmethod
+    async def get_collection(cls):
+        if not db_connection.is_connected():
+            return None
+        return db_connection.db.tombstones
+
+    @classmethod
+    async def record(cls, collection_name, document):
+        collection = await cls.get_collection()
+        if collection is None:
+            return None
+        key = cls.KEYS[collection_name]
+        result = await collection.insert_one(
+            {
+                "collection": collection_name,
+                "controllerID": document.get("controllerID"),
+                "key": {key: document[key]},
+                "lastChanged": now(),
+            }
+        )
+        return result.inserted_id
+
+    @classmethod
+    async def get_since(cls, controller_id, since):
+        collection = await cls.get_collection()
+        if collection is None:
+            return None
+        cursor = collection.find(
+            {"controllerID": controller_id, "lastChanged": {"$gte": since}},
+            cls.PROJECTION,
+        )
+        return await cursor.to_list(length=None)
@@ -1,8 +1,12 @@
 import asyncio
+import os
 import signal
+import redis.asyncio as redis
 from server_app.logging_config import setup_logger
 from irrigation_controller.irrigation_service import IrrigationService
 from irrigation_controller.sensor_service import SensorService
+from irrigation_controller.sensor_history import SensorHistory
+from irrigation_controller.reading_store import LatestReadingStore
 from server_app.services.database_service import DatabaseService
 from server_app.database.models import IrrigationControllers
 import traceback
@@ -11,11 +15,22 @@ import argparse
 
 logger = setup_logger("main")
 
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Local SQLite file buffering uploads while MongoDB is unreachable
+SPOOL_PATH = os.getenv("SPOOL_PATH", "upload_spool.sqlite3")
+# Setting a path enables configuration pushes by MongoDB change streams
+RESUME_TOKEN_PATH = os.getenv("RESUME_TOKEN_PATH")
+# Pumps allowed to run at once, 1 waters one plant after the other
+MAX_OPEN_PUMPS = int(os.getenv("MAX_OPEN_PUMPS", "1"))
+# Total flow in ml/min the supply can deliver, unlimited if unset
+MAX_TOTAL_FLOW = os.getenv("MAX_TOTAL_FLOW")
+
 
 class MainController:
     def __init__(self, test_mode=False):
         self.controller_id = None
         self.stop_event = asyncio.Event()
+        self.redis_client = None
         self.sensor_service = None
         self.irrigation_service = None
         self.database_service = None
@@ -31,18 +46,48 @@ class MainController:
     async def initialize(self):
         await db_connection.connect()
         self.controller_id = await self.initialize_controller()
+        # One pooled client is shared by all services
+        self.redis_client = redis.Redis(
+            connection_pool=redis.ConnectionPool.from_url(REDIS_URL, max_connections=16)
+        )
+        # Filled by the sensor service, queried by the irrigation service
+        sensor_history = SensorHistory()
+        reading_store = LatestReadingStore(self.redis_client)
         self.sensor_service = SensorService(
-            self.controller_id, self.stop_event, self.test_mode
+            self.controller_id,
+            self.redis_client,
+            self.stop_event,
+            self.test_mode,
+            reading_store=reading_store,
+            sensor_history=sensor_history,
         )
         self.irrigation_service = IrrigationService(
-            self.controller_id, self.stop_event, self.test_mode
+            self.controller_id,
+            self.redis_client,
+            self.stop_event,
+            self.test_mode,
+            max_open_pumps=MAX_OPEN_PUMPS,
+            max_total_flow=float(MAX_TOTAL_FLOW) if MAX_TOTAL_FLOW else None,
+            reading_store=reading_store,
+            sensor_history=sensor_history,
         )
         self.database_service = DatabaseService(
             self.controller_id,
             self.sensor_service,
             self.irrigation_service,
             self.stop_event,
+            self.redis_client,
+            spool_path=SPOOL_PATH,
+            resume_token_path=RESUME_TOKEN_PATH,
         )
+        # Read the legacy watering_logs list before the ingest drains it
+        await self.migrate_last_watered_times()
+
+    async def migrate_last_watered_times(self):
+        try:
+            await self.irrigation_service.migrate_last_watered_times()
+        except Exception as e:
+            logger.error(f"Error migrating last watered times: {str(e)}")
 
     async def initialize_controller(self):
         try:
@@ -162,6 +207,8 @@ class MainController:
             logger.debug(f"Traceback: {traceback.format_exc()}")
         finally:
             await self.stop_services()
+            if self.redis_client is not None:
+                await self.redis_client.aclose()
             logger.info("All services stopped. Exiting.")
 
 
@@ -0,0 +1,282 @@
+import asyncio
+import itertools
+import json
+import math
+from collections import deque
+from server_app.logging_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# What a full queue does with new items
+BLOCK = "block"  # put() waits until an upload made room
+DROP_OLDEST = "drop_oldest"
+DOWNSAMPLE = "downsample"  # Merge the oldest raw readings into aggregates
+NEVER_DROP = "never_drop"  # Keep growing, for events that must not be lost
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, DOWNSAMPLE, NEVER_DROP)
+
+
+class QueueFull(Exception):
+    pass
+
+
+def item_size(item):
+    """Approximate memory of a queued item, the length of its JSON."""
+    if isinstance(item, (str, bytes)):
+        return len(item)
+    return len(json.dumps(item))
+
+
+def downsample_readings(items, bucket_seconds):
+    """
+    Merge sensor readings (JSON strings) into one reading per sensor and
+    time bucket, keeping count, min and max. Readings that were merged
+    before are weighted by their count. Unparsable items are kept as they
+    are, ahead of the aggregates.
+    """
+    kept = []
+    buckets = {}
+    for item in items:
+        try:
+            reading = json.loads(item)
+            key = (
+                reading["sensorID"],
+                math.floor(reading["timestamp"] / bucket_seconds),
+            )
+            value = float(reading["value"])
+        except (TypeError, ValueError, KeyError):
+            kept.append(item)
+            continue
+        count = reading.get("count", 1)
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = {
+                "sensorID": reading["sensorID"],
+                "total": value * count,
+                "count": count,
+                "min": reading.get("min", value),
+                "max": reading.get("max", value),
+                "timestamp": reading["timestamp"],
+            }
+            continue
+        bucket["total"] += value * count
+        bucket["count"] += count
+        bucket["min"] = min(bucket["min"], reading.get("min", value))
+        bucket["max"] = max(bucket["max"], reading.get("max", value))
+        bucket["timestamp"] = max(bucket["timestamp"], reading["timestamp"])
+
+    aggregates = sorted(buckets.values(), key=lambda bucket: bucket["timestamp"])
+    return kept + [
+        json.dumps(
+            {
+                "sensorID": bucket["sensorID"],
+                "value": bucket["total"] / bucket["count"],
+                "timestamp": bucket["timestamp"],
+                "count": bucket["count"],
+                "min": bucket["min"],
+                "max": bucket["max"],
+            }
+        )
+        for bucket in aggregates
+    ]
+
+
+class BoundedQueue:
+    """
+    Capacity, memory accounting and overflow policy of an upload queue.
+
+    A queue is full beyond maxlen items or max_bytes of item JSON. The
+    consumer peeks a batch, writes it and then commits it; the overflow
+    policies never touch a batch that is in flight. Subclasses store the
+    items and implement the storage hooks.
+    """
+
+    def __init__(
+        self,
+        name="queue",
+        maxlen=100000,
+        max_bytes=None,
+        policy=DROP_OLDEST,
+        downsample_bucket=900,
+    ):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {policy!r}")
+        self.name = name
+        self.maxlen = maxlen
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.downsample_bucket = downsample_bucket
+        self.bytes = 0
+        self.dropped = 0
+        self.downsampled = 0
+        self.blocked = 0
+        self.overflowing = False
+        self.space = None
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def is_full(self, extra_items=0, extra_bytes=0):
+        if self.maxlen is not None and len(self) + extra_items > self.maxlen:
+            return True
+        return self.max_bytes is not None and self.bytes + extra_bytes > self.max_bytes
+
+    def append(self, item):
+        self.extend([item])
+
+    def extend(self, items):
+        """Add items without waiting, then apply the overflow policy."""
+        items = list(items)
+        if not items:
+            return
+        self.push(items)
+        if self.is_full():
+            self.overflow()
+
+    async def put(self, item):
+        """Add an item, waiting for room first if the policy is BLOCK."""
+        if self.policy == BLOCK:
+            while len(self) and self.is_full(1, item_size(item)):
+                self.blocked += 1
+                if self.space is None:
+                    self.space = asyncio.Event()
+                self.space.clear()
+                await self.space.wait()
+        self.append(item)
+
+    def overflow(self):
+        if not self.overflowing:
+            self.overflowing = True
+            logger.warning(
+                f"Queue {self.name} is full ({len(self)} items, {self.bytes} bytes), "
+                f"policy {self.policy}"
+            )
+        if self.policy in (NEVER_DROP, BLOCK):
+            # BLOCK only holds back put(), items added directly are kept
+            return
+        if self.policy == DOWNSAMPLE:
+            self.downsample()
+        excess = len(self) - self.maxlen if self.maxlen is not None else 0
+        if excess > 0:
+            self.dropped += self.drop_front(excess)
+        while self.is_full() and len(self):
+            self.dropped += self.drop_front(1)
+
+    def downsample(self):
+        # Merge the older half of what is not in flight
+        skip = self.in_flight()
+        count = (len(self) - skip) // 2
+        if count < 2:
+            return
+        items = self.front(count, skip)
+        merged = downsample_readings(items, self.downsample_bucket)
+        if len(merged) < len(items):
+            self.replace_front(count, skip, merged)
+            self.downsampled += len(items) - len(merged)
+
+    def committed(self):
+        self.overflowing = False
+        if self.space is not None:
+            self.space.set()
+
+    def stats(self):
+        return {
+            "depth": len(self),
+            "bytes": self.bytes,
+            "dropped": self.dropped,
+            "downsampled": self.downsampled,
+            "blocked": self.blocked,
+        }
+
+    # Storage hooks
+    def push(self, items):
+        raise NotImplementedError
+
+    def in_flight(self):
+        """Number of items at the front that are peeked and not committed."""
+        raise NotImplementedError
+
+    def front(self, count, skip):
+        raise NotImplementedError
+
+    def replace_front(self, count, skip, items):
+        raise NotImplementedError
+
+    def drop_front(self, count):
+        raise NotImplementedError
+
+
+class BatchQueue(BoundedQueue):
+    """
+    FIFO of items waiting to be uploaded, held in memory.
+
+    The consumer peeks a batch, writes it and only then commits it, which
+    pops the batch off the front in O(batch) no matter how long the backlog
+    is. Failed writes simply do not commit.
+
+    There is one consumer per queue. Items dropped between peek and commit
+    are taken into account, so commit never removes unsent items.
+    """
+
+    def __init__(self, name="queue", maxlen=100000, **limits):
+        super().__init__(name, maxlen, **limits)
+        self.items = deque()
+        self.sizes = deque()
+        # Items ever removed from the front, by commit or by dropping
+        self.removed = 0
+        self.peek_mark = 0
+        self.peeked = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def push(self, items):
+        sizes = [item_size(item) for item in items]
+        self.items.extend(items)
+        self.sizes.extend(sizes)
+        self.bytes += sum(sizes)
+
+    def in_flight(self):
+        return max(0, self.peeked - (self.removed - self.peek_mark))
+
+    def front(self, count, skip):
+        return list(itertools.islice(self.items, skip, skip + count))
+
+    def replace_front(self, count, skip, items):
+        self.items.rotate(-skip)
+        self.sizes.rotate(-skip)
+        for _ in range(count):
+            self.items.popleft()
+            self.bytes -= self.sizes.popleft()
+        sizes = [item_size(item) for item in items]
+        self.items.extendleft(reversed(items))
+        self.sizes.extendleft(reversed(sizes))
+        self.bytes += sum(sizes)
+        self.items.rotate(skip)
+        self.sizes.rotate(skip)
+
+    def drop_front(self, count):
+        count = min(count, len(self.items))
+        for _ in range(count):
+            self.items.popleft()
+            self.bytes -= self.sizes.popleft()
+        self.removed += count
+        return count
+
+    def peek(self, count=None):
+        """Return up to count items from the front without removing them."""
+        self.peek_mark = self.removed
+        if count is None or count >= len(self.items):
+            batch = list(self.items)
+        else:
+            batch = list(itertools.islice(self.items, count))
+        self.peeked = len(batch)
+        return batch
+
+    def commit(self, count):
+        """Remove the first count items of the last peeked batch."""
+        count -= self.removed - self.peek_mark
+        count = self.drop_front(min(max(count, 0), len(self.items)))
+        self.peek_mark = self.removed
+        self.peeked = 0
+        self.committed()
+        return count
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import time
+from bson import json_util
+from pymongo.errors import OperationFailure
+from server_app.logging_config import setup_logger
+from server_app.database.database import db_connection
+
+logger = setup_logger(__name__)
+
+# Server errors meaning change streams cannot be used at all: not a replica
+# set (40573), not permitted (13) or not supported by the server (115)
+UNSUPPORTED_CODES = (13, 115, 40573)
+# The resume token points at oplog history that is gone
+HISTORY_LOST_CODES = (280, 286)
+
+
+class ResumeTokenStore:
+    """
+    The last resume token of a change stream in a local file, so a restarted
+    controller continues where it stopped. Writes go to a temporary file
+    that replaces the old one, a crash leaves either token intact.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.token = None
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.token = json_util.loads(f.read())
+        except FileNotFoundError:
+            self.token = None
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable resume token {self.path}: {e}")
+            self.token = None
+        return self.token
+
+    def save(self, token):
+        if token is None or token == self.token:
+            return
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            f.write(json_util.dumps(token))
+        os.replace(temporary, self.path)
+        self.token = token
+
+    def clear(self):
+        self.token = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class ChangeWatcher:
+    """
+    Pushes configuration edits to the controller through a MongoDB change
+    stream on plants, sensors, schedules, pumps and tombstones of this
+    controller.
+
+    Every change is applied to the ConfigSync state and on_change(names) is
+    awaited with the collections that changed. The stream resumes from the
+    stored token after reconnects and restarts. The token is written at
+    most every save_interval seconds and when the stream closes, idle
+    getMores advance it every max_await_ms and would otherwise write the
+    SD card each second; after a crash the changes since the last save are
+    applied again, which is harmless. Without a usable token a
+    full sync runs once the stream is open, so nothing written before it
+    is missed. If the server has no change streams the watcher stops and
+    polling alone keeps the configuration current.
+    """
+
+    COLLECTIONS = ("plants", "sensors", "schedules", "pumps", "tombstones")
+
+    def __init__(
+        self,
+        controller_id,
+        config_sync,
+        on_change,
+        token_store,
+        stop_event,
+        max_await_ms=1000,
+        retry_interval=30,
+        save_interval=60,
+    ):
+        self.controller_id = controller_id
+        self.config_sync = config_sync
+        self.on_change = on_change
+        self.tokens = token_store
+        self.stop_event = stop_event
+        self.max_await_ms = max_await_ms
+        self.retry_interval = retry_interval
+        self.save_interval = save_interval
+        self.last_save = 0.0
+        self.streaming = False
+        self.available = True
+
+    def pipeline(self):
+        return [
+            {
+                "$match": {
+                    "ns.coll": {"$in": list(self.COLLECTIONS)},
+                    "operationType": {"$in": ["insert", "update", "replace"]},
+                    "fullDocument.controllerID": self.controller_id,
+                }
+            }
+        ]
+
+    async def run(self):
+        while self.available and not self.stop_event.is_set():
+            try:
+                await self.watch()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in UNSUPPORTED_CODES:
+                    logger.warning(
+                        f"Change streams unavailable, polling for configuration: {e}"
+                    )
+                    self.available = False
+                    return
+                if e.code in HISTORY_LOST_CODES:
+                    logger.warning("Resume token expired, resynchronizing")
+                    self.tokens.clear()
+                    continue
+                logger.error(f"Change stream failed: {str(e)}")
+                await asyncio.sleep(self.retry_interval)
+            except Exception as e:
+                logger.error(f"Change stream failed: {str(e)}")
+                await asyncio.sleep(self.retry_interval)
+
+    async def watch(self):
+        if not db_connection.is_connected():
+            raise ConnectionError("MongoDB is not connected")
+        token = self.tokens.load()
+        stream = db_connection.db.watch(
+            self.pipeline(),
+            full_document="updateLookup",
+            resume_after=token,
+            max_await_time_ms=self.max_await_ms,
+        )
+        async with stream:
+            self.streaming = True
+            self.last_save = time.monotonic()
+            try:
+                if token is None:
+                    await self.on_change(await self.config_sync.full_sync())
+                    self.save_token(stream.resume_token)
+                while stream.alive and not self.stop_event.is_set():
+                    change = await stream.try_next()
+                    if change is not None:
+                        await self.handle(change)
+                    # Also advances while idle, with the post batch token
+                    if time.monotonic() - self.last_save >= self.save_interval:
+                        self.save_token(stream.resume_token)
+                # Stopped with every change applied
+                self.save_token(stream.resume_token)
+            finally:
+                self.streaming = False
+
+    def save_token(self, token):
+        self.tokens.save(token)
+        self.last_save = time.monotonic()
+
+    async def handle(self, change):
+        name = change["ns"]["coll"]
+        document = change.get("fullDocument")
+        if document is None:
+            # Deleted before the lookup, its tombstone follows
+            return
+        if name == "tombstones":
+            changed = self.config_sync.apply_tombstone(document)
+            name = document["collection"]
+        else:
+            changed = self.config_sync.apply_change(name, document)
+        if changed:
+            await self.on_change({name})
@@ -0,0 +1,201 @@
+import time
+from datetime import datetime, timedelta
+from pymongo.errors import OperationFailure
+from server_app.logging_config import setup_logger
+from server_app.database.models import (
+    ConfigSnapshot,
+    ControllerConfig,
+    Plants,
+    Pumps,
+    Schedules,
+    Sensors,
+    Tombstones,
+)
+
+logger = setup_logger(__name__)
+
+
+class CollectionState:
+    """In-memory copy of one configuration collection, keyed by its ID."""
+
+    def __init__(self, name, key, fetch, projection=None):
+        self.name = name
+        self.key = key
+        # fetch(controller_id, changed_since=None) -> list of documents
+        self.fetch = fetch
+        # Fields fetch returns, applied to documents from other sources
+        self.projection = projection
+        self.documents = {}
+
+    def project(self, document):
+        if self.projection is None:
+            return document
+        return {
+            name: value for name, value in document.items() if self.projection.get(name)
+        }
+
+    def replace(self, documents):
+        self.documents = {document[self.key]: document for document in documents}
+
+    def apply(self, documents, tombstones):
+        changed = False
+        for document in documents:
+            if self.documents.get(document[self.key]) != document:
+                self.documents[document[self.key]] = document
+                changed = True
+        for tombstone in tombstones:
+            deleted = self.documents.pop(tombstone["key"].get(self.key), None)
+            # A document recreated after its deletion is newer than the tombstone
+            if deleted is not None and deleted.get("lastChanged", datetime.min) > (
+                tombstone["lastChanged"]
+            ):
+                self.documents[deleted[self.key]] = deleted
+            else:
+                changed = changed or deleted is not None
+        return changed
+
+    def values(self):
+        return list(self.documents.values())
+
+
+class ConfigSync:
+    """
+    Keeps the controller's plants, sensors, schedules and pumps in sync by
+    fetching only documents whose lastChanged is at or after the watermark,
+    plus tombstones of deleted documents.
+
+    The watermark is the newest lastChanged seen, minus an overlap that
+    covers writes which committed late or on a skewed clock; re-applying a
+    document is harmless. A full sync runs at start and every
+    full_sync_interval seconds to pick up documents written without
+    lastChanged or deleted without a tombstone.
+
+    Each sync is one aggregation round trip (ControllerConfig.load). On
+    servers without $unionWith it falls back to one query per collection.
+    """
+
+    def __init__(self, controller_id, overlap=60, full_sync_interval=3600):
+        self.controller_id = controller_id
+        self.overlap = timedelta(seconds=overlap)
+        self.full_sync_interval = full_sync_interval
+        self.collections = {
+            "plants": CollectionState(
+                "plants",
+                "plantID",
+                Plants.get_plants_by_controller_id,
+                Plants.PROJECTION,
+            ),
+            "sensors": CollectionState(
+                "sensors",
+                "sensorID",
+                Sensors.get_sensors_by_controller,
+                Sensors.PROJECTION,
+            ),
+            "schedules": CollectionState(
+                "schedules",
+                "scheduleID",
+                Schedules.get_schedules_by_controller,
+                Schedules.PROJECTION,
+            ),
+            "pumps": CollectionState(
+                "pumps", "pumpID", Pumps.get_pumps_by_controller, Pumps.PROJECTION
+            ),
+        }
+        self.watermark = None
+        self.last_full_sync = None
+        # load(controller_id, changed_since=None) -> ConfigSnapshot
+        self.load = ControllerConfig.load
+        self.combined = True
+
+    async def ensure_indexes(self):
+        for model in (Plants, Sensors, Schedules, Pumps, Tombstones):
+            collection = await model.get_collection()
+            if collection is not None:
+                await collection.create_index([("controllerID", 1), ("lastChanged", 1)])
+
+    def advance_watermark(self, documents):
+        for document in documents:
+            changed = document.get("lastChanged")
+            if changed is not None and (
+                self.watermark is None or changed > self.watermark
+            ):
+                self.watermark = changed
+
+    def full_sync_due(self):
+        return (
+            self.last_full_sync is None
+            or time.monotonic() - self.last_full_sync >= self.full_sync_interval
+        )
+
+    async def sync(self):
+        """Return the names of the collections that changed."""
+        if self.full_sync_due():
+            return await self.full_sync()
+        return await self.delta_sync()
+
+    async def fetch(self, changed_since=None):
+        """Return a ConfigSnapshot of all documents or the changed ones."""
+        if self.combined:
+            try:
+                snapshot = await self.load(self.controller_id, changed_since)
+            except OperationFailure as e:
+                logger.warning(
+                    f"Combined configuration query failed, "
+                    f"using one query per collection: {e}"
+                )
+                self.combined = False
+            else:
+                if snapshot is None:
+                    raise ConnectionError("MongoDB is not connected")
+                return snapshot
+
+        snapshot = ConfigSnapshot(changed_since=changed_since)
+        for name, state in self.collections.items():
+            documents = await state.fetch(self.controller_id, changed_since)
+            if documents is None:
+                raise ConnectionError("MongoDB is not connected")
+            snapshot.documents(name).extend(documents)
+        if changed_since is not None:
+            tombstones = await Tombstones.get_since(self.controller_id, changed_since)
+            if tombstones is None:
+                raise ConnectionError("MongoDB is not connected")
+            snapshot.tombstones.extend(tombstones)
+        return snapshot
+
+    async def full_sync(self):
+        """Reload every collection, all of them count as changed."""
+        snapshot = await self.fetch()
+        for name, state in self.collections.items():
+            state.replace(snapshot.documents(name))
+            self.advance_watermark(snapshot.documents(name))
+        self.last_full_sync = time.monotonic()
+        return set(self.collections)
+
+    async def delta_sync(self):
+        since = (self.watermark or datetime.min + self.overlap) - self.overlap
+        snapshot = await self.fetch(since)
+
+        changed = set()
+        for name, state in self.collections.items():
+            deleted = [
+                tombstone
+                for tombstone in snapshot.tombstones
+                if tombstone["collection"] == name
+            ]
+            if state.apply(snapshot.documents(name), deleted):
+                changed.add(name)
+            self.advance_watermark(snapshot.documents(name))
+        self.advance_watermark(snapshot.tombstones)
+        return changed
+
+    def apply_change(self, name, document):
+        """Apply one full document pushed by a change stream."""
+        state = self.collections[name]
+        return state.apply([state.project(document)], [])
+
+    def apply_tombstone(self, tombstone):
+        state = self.collections.get(tombstone["collection"])
+        return state is not None and state.apply([], [tombstone])
+
+    def documents(self, name):
+        return self.collections[name].values()
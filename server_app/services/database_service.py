@@ -1,15 +1,40 @@
 import asyncio
 from server_app.logging_config import setup_logger
+from server_app.database.database import db_connection
 from server_app.database.models import (
     Plants,
     Sensors,
-    Schedules,
-    Pumps,
     RealtimeSensorData,
     Logs,
 )
+from server_app.services.event_streams import SENSOR_STREAM, WATERING_STREAM
+from server_app.services.config_sync import ConfigSync
+from server_app.services.change_watcher import ChangeWatcher, ResumeTokenStore
+from server_app.services.batch_queue import (
+    BatchQueue,
+    DOWNSAMPLE,
+    DROP_OLDEST,
+    NEVER_DROP,
+)
+from server_app.services.ingest_pump import IngestPump
+from server_app.services.spool import Spool
+from server_app.services.window_aggregator import WindowAggregator
+import json
 import time
 
+# Capacity and overflow policy of the upload queues, sized so a week offline
+# stays well inside the memory of a Pi
+QUEUE_LIMITS = {
+    "watering_logs": {"maxlen": 10000, "policy": NEVER_DROP},
+    "sensor_data": {
+        "maxlen": 200000,
+        "max_bytes": 32 * 2**20,
+        "policy": DOWNSAMPLE,
+        "downsample_bucket": 900,
+    },
+    "logs": {"maxlen": 50000, "max_bytes": 16 * 2**20, "policy": DROP_OLDEST},
+}
+
 
 class DatabaseService:
     def __init__(
@@ -18,6 +43,16 @@ class DatabaseService:
         sensor_service,
         irrigation_service,
         stop_event,
+        redis_client=None,
+        sensor_window_seconds=300,
+        sensor_upload_interval=None,
+        raw_retention=86400,
+        connectivity=None,
+        spool_path=None,
+        queue_limits=None,
+        resume_token_path=None,
+        config_poll_interval=10,
+        watched_poll_interval=300,
     ):
         self.controller_id = controller_id
         self.sensor_service = sensor_service
@@ -25,32 +60,100 @@ class DatabaseService:
         self.stop_event = stop_event
         self.logger = setup_logger(__name__)
         self.batch_size = 100
+        # Spooled sensor readings are summarized per upload, larger batches
+        # split fewer windows across uploads
+        self.spooled_sensor_batch_size = 5000
+        self.sensor_window_seconds = sensor_window_seconds
         self.healthy = asyncio.Event()
         self.healthy.set()
         self.exception_count = 0
         self.exception_threshold = 5
         self.reset_time = 60
-        self.network_check_interval = 1
+        # Reachability of MongoDB from driver heartbeats and our own writes
+        self.connectivity = connectivity or db_connection.connectivity
         self.network_available = asyncio.Event()
         self.network_available.set()
         self.last_check_time = 0
+        self.config_poll_interval = config_poll_interval
+        # Polling is only a safety net while the change stream delivers edits
+        self.watched_poll_interval = watched_poll_interval
 
         # In-memory data structures
         self.plants_cache = []  # Stores list of plant dicts
-        self.watering_logs_queue = []  # Stores list of watering log dicts
-        self.sensor_data_queue = []  # Stores list of sensor data JSON strings
-        self.logs_queue = []  # Stores list of log JSON strings
-        self.data_lock = asyncio.Lock()  # To protect concurrent access to queues
+        self.config_sync = ConfigSync(controller_id)
+        # With a resume token path edits are pushed by a change stream
+        self.watcher = None
+        self.watcher_task = None
+        if resume_token_path:
+            self.watcher = ChangeWatcher(
+                controller_id,
+                self.config_sync,
+                self.apply_config,
+                ResumeTokenStore(resume_token_path),
+                stop_event,
+            )
+        # With a spool path the queues survive restarts and power loss
+        self.spool = Spool(spool_path) if spool_path else None
+        queue = self.spool.queue if self.spool else BatchQueue
+        limits = {**QUEUE_LIMITS, **(queue_limits or {})}
+        # Watering event JSON strings
+        self.watering_logs_queue = queue("watering_logs", **limits["watering_logs"])
+        # Sensor data JSON strings
+        self.sensor_data_queue = queue("sensor_data", **limits["sensor_data"])
+        # Log JSON strings
+        self.logs_queue = queue("logs", **limits["logs"])
+        self.data_lock = asyncio.Lock()  # Protects the plants cache
+
+        # Redis streams written by the sensor and irrigation services
+        self.redis_client = redis_client
+        self.ingest = None
+        self.ingest_task = None
+        if redis_client is not None:
+            # Sensor readings are uploaded as window summaries unless the
+            # window is disabled with sensor_window_seconds=None
+            aggregators = {}
+            if sensor_window_seconds:
+                aggregators[SENSOR_STREAM] = WindowAggregator(
+                    self.write_sensor_windows,
+                    window_seconds=sensor_window_seconds,
+                    upload_interval=sensor_upload_interval,
+                )
+            self.ingest = IngestPump(
+                redis_client,
+                {
+                    SENSOR_STREAM: self.write_sensor_events,
+                    WATERING_STREAM: self.write_watering_events,
+                },
+                consumer=f"controller-{controller_id}",
+                logger=self.logger,
+                aggregators=aggregators,
+                raw_retention=raw_retention,
+                # Only a durable spool may take over events from Redis
+                queues=(
+                    {
+                        SENSOR_STREAM: self.sensor_data_queue,
+                        WATERING_STREAM: self.watering_logs_queue,
+                    }
+                    if self.spool is not None
+                    else None
+                ),
+            )
 
     async def start(self):
         self.logger.info("Starting database service")
         self.healthy.set()
         await self.initialize_plants()
+        try:
+            await self.config_sync.ensure_indexes()
+        except Exception as e:
+            self.logger.error(f"Error creating sync indexes: {str(e)}")
         await self.run()
 
     async def stop(self):
         self.logger.info("Stopping database service")
         self.stop_event.set()
+        if self.spool is not None:
+            self.spool.compact()
 
     async def initialize_plants(self):
         try:
@@ -75,131 +178,166 @@ class DatabaseService:
             self.healthy.clear()
 
     async def run(self):
+        if self.ingest is not None and self.ingest_task is None:
+            self.ingest_task = asyncio.create_task(self.run_ingest())
+        if self.watcher is not None and self.watcher_task is None:
+            self.watcher_task = asyncio.create_task(self.watcher.run())
+        try:
+            await self.run_loop()
+        finally:
+            if self.ingest_task is not None:
+                self.ingest_task.cancel()
+                self.ingest_task = None
+            if self.watcher_task is not None:
+                self.watcher_task.cancel()
+                self.watcher_task = None
+
+    async def run_loop(self):
         while not self.stop_event.is_set():
             try:
                 current_time = time.time()
 
-                # Check if network is available
+                # Only probe MongoDB while it is known to be unreachable
                 if not await self.network_is_available():
-                    self.logger.warning(
-                        "Network not available, skipping this iteration"
-                    )
-                    await asyncio.sleep(1)
+                    if self.network_available.is_set():
+                        self.network_available.clear()
+                        self.logger.warning("MongoDB not reachable, pausing uploads")
+                    await self.connectivity.probe(db_connection.ping)
                     continue
 
-                # Check for new data every 10 seconds
-                if current_time - self.last_check_time >= 10:
+                self.network_available.set()
+
+                if current_time - self.last_check_time >= self.poll_interval():
                     await self.check_for_new_data()
                     self.last_check_time = current_time
+                    self.logger.debug(f"Upload queues: {self.get_queue_stats()}")
 
-                await self.save_sensor_data()
-                await self.save_watering_logs()
-                await asyncio.sleep(1)
+                # Events spooled while offline are uploaded back to back
+                uploaded = await self.save_sensor_data()
+                uploaded += await self.save_watering_logs()
+                if not uploaded:
+                    await asyncio.sleep(1)
             except asyncio.TimeoutError:
                 pass
+            except Exception as e:
+                self.logger.error(f"Error in database loop: {str(e)}")
+                if not self.connectivity.record_failure(e):
+                    self.increment_exception_count()
+                await asyncio.sleep(1)
 
-    async def network_is_available(self):
-        try:
-            # Try to connect to a known IP address (e.g., Google's DNS server)
-            reader, writer = await asyncio.wait_for(
-                asyncio.open_connection("8.8.8.8", 53), timeout=5
-            )
-            writer.close()
-            await writer.wait_closed()
-            return True
-        except (asyncio.TimeoutError, OSError, ConnectionRefusedError):
-            return False
-        except Exception as e:
-            self.logger.error(f"Error checking network availability: {e}")
-            return False
-
-    async def save_watering_logs(self):
-        try:
-            async with self.data_lock:
-                if not self.watering_logs_queue:
-                    return
-                logs_to_process = list(self.watering_logs_queue)
+    def poll_interval(self):
+        if self.watcher is not None and self.watcher.streaming:
+            return self.watched_poll_interval
+        return self.config_poll_interval
 
-            if not logs_to_process:
-                return
+    async def network_is_available(self):
+        return self.connectivity.online
 
-            watering_data = []
-            for log_data in logs_to_process:
-                plant_id = log_data["plantID"]
-                timestamp = log_data["timestamp"]
-                watering_data.append((plant_id, timestamp))
+    async def run_ingest(self):
+        legacy_drained = False
+        while not self.stop_event.is_set():
+            try:
+                if not self.network_available.is_set() and self.ingest.queues:
+                    # Keep the capped streams from dropping events while offline
+                    await self.ingest.spill_once(self.ingest.block_ms)
+                    continue
+                await self.network_available.wait()
+                if not legacy_drained:
+                    legacy_drained = True
+                    try:
+                        await self.ingest.drain_legacy_lists()
+                    except Exception as e:
+                        self.logger.error(f"Error draining legacy lists: {str(e)}")
+                # Blocks in Redis for up to block_ms while the streams are empty
+                await self.ingest.drain_once(self.ingest.block_ms)
+                await self.ingest.upload_windows()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error(f"Error in ingest: {str(e)}")
+                if not self.connectivity.record_failure(e):
+                    self.increment_exception_count()
+                await asyncio.sleep(5)  # Wait before retrying
+
+    async def write_sensor_events(self, sensor_data_list):
+        result = await Sensors.process_sensor_data_batch(sensor_data_list)
+        if result is None:
+            raise ConnectionError("MongoDB is not connected")
+        self.connectivity.record_success()
+        success, latest_readings = result
+        if success:
+            await RealtimeSensorData.update_realtime_sensor_data(latest_readings)
 
-            # Bulk update watering history for plants
-            updated_count = await Plants.bulk_update_watering_history(watering_data)
-            self.logger.info(f"Updated watering history for {updated_count} plants")
+    async def write_sensor_windows(self, windows):
+        latest_readings = await Sensors.process_sensor_windows(windows)
+        if latest_readings is None:
+            raise ConnectionError("MongoDB is not connected")
+        self.connectivity.record_success()
+        await RealtimeSensorData.update_realtime_sensor_data(latest_readings)
 
-            async with self.data_lock:
-                self.watering_logs_queue = self.watering_logs_queue[
-                    len(logs_to_process) :
-                ]
+    async def write_watering_events(self, watering_logs):
+        watering_data = []
+        for log in watering_logs:
+            try:
+                log_data = json.loads(log)
+                watering_data.append((log_data["plantID"], log_data["timestamp"]))
+            except (ValueError, KeyError, TypeError) as e:
+                self.logger.warning(f"Invalid watering log {log}: {e}")
 
-            self.logger.info(f"Processed {len(logs_to_process)} watering logs")
+        updated_count = await Plants.bulk_update_watering_history(watering_data)
+        if updated_count is None:
+            raise ConnectionError("MongoDB is not connected")
+        self.connectivity.record_success()
+        self.logger.info(f"Updated watering history for {updated_count} plants")
 
-        except Exception as e:
-            self.logger.error(f"Error processing watering logs: {str(e)}")
+    async def save_watering_logs(self):
+        """Upload one batch of spooled watering events, return its size."""
+        return await self.upload_queued(
+            self.watering_logs_queue, self.write_watering_events
+        )
 
     async def save_sensor_data(self):
-        try:
-            sensor_data_list_batch = []
-            async with self.data_lock:
-                if not self.sensor_data_queue:
-                    return {}
-                count_to_process = min(len(self.sensor_data_queue), self.batch_size)
-                sensor_data_list_batch = self.sensor_data_queue[:count_to_process]
-
-            if not sensor_data_list_batch:
-                return {}
-
-            success, latest_readings = await Sensors.process_sensor_data_batch(
-                sensor_data_list_batch
+        """Upload one batch of spooled sensor readings, return its size."""
+        if not self.sensor_window_seconds:
+            return await self.upload_queued(
+                self.sensor_data_queue, self.write_sensor_events
             )
-            await RealtimeSensorData.update_realtime_sensor_data(latest_readings)
+        # Like readings from the stream they are uploaded as window summaries
+        return await self.upload_queued(
+            self.sensor_data_queue,
+            self.write_spooled_sensor_windows,
+            self.spooled_sensor_batch_size,
+        )
 
-            if success:
-                async with self.data_lock:
-                    self.sensor_data_queue = self.sensor_data_queue[
-                        len(sensor_data_list_batch) :
-                    ]
-                self.logger.info(
-                    f"Removed {len(sensor_data_list_batch)} sensor data items from queue"
-                )
-            else:
-                self.logger.warning(
-                    "Transaction failed. Data remains in queue for retry."
-                )
+    async def write_spooled_sensor_windows(self, sensor_data_list):
+        windows = WindowAggregator.summarize(
+            sensor_data_list, self.sensor_window_seconds
+        )
+        if windows:
+            await self.write_sensor_windows(windows)
 
-            """
-        except (NetworkTimeout, ConnectionFailure) as e:
-            self.logger.error(f"Network error: {e}")
-            self.network_available.clear()
-            return False, {}
-            """
+    async def upload_queued(self, queue, write, batch_size=None):
+        batch = queue.peek(batch_size or self.batch_size)
+        if not batch:
+            return 0
+        try:
+            await write(batch)
         except Exception as e:
-            self.logger.error(f"Unexpected error: {e}")
-            self.increment_exception_count()
-            return False, {}
+            self.logger.error(f"Error uploading queued {queue.name}: {str(e)}")
+            if not self.connectivity.record_failure(e):
+                self.increment_exception_count()
+            return 0
+        return queue.commit(len(batch))
 
     async def save_logs(self):
         try:
-            logs_batch = []
-            async with self.data_lock:
-                if not self.logs_queue:
-                    return
-                count_to_process = min(len(self.logs_queue), self.batch_size)
-                logs_batch = self.logs_queue[:count_to_process]
-
+            logs_batch = self.logs_queue.peek(self.batch_size)
             if not logs_batch:
                 return
 
             inserted_count = await Logs.process_logs(logs_batch)
 
-            async with self.data_lock:
-                self.logs_queue = self.logs_queue[inserted_count:]
+            self.logs_queue.commit(inserted_count)
             self.logger.info(f"Inserted {inserted_count} logs into the database")
 
         except Exception as e:
@@ -219,27 +357,36 @@ class DatabaseService:
 
     async def check_for_new_data(self):
         self.logger.info("Checking for new data...")
-        await asyncio.gather(
-            self.check_for_new_plants(),
-            self.check_for_new_sensors(),
-            self.check_for_new_schedules(),
-            self.check_for_new_pumps(),
-        )
+        # Only documents changed since the last sync are fetched
+        changed = await self.config_sync.sync()
+        await self.apply_config(changed)
         self.logger.info("Finished checking for new data.")
 
-    async def check_for_new_plants(self):
-        plants = await Plants.get_plants_by_controller_id(self.controller_id)
+    async def apply_config(self, changed):
+        """Hand the changed collections to the services."""
+        if "plants" in changed:
+            await self.apply_plants(self.config_sync.documents("plants"))
+        if "sensors" in changed:
+            await self.apply_sensors(self.config_sync.documents("sensors"))
+        if "schedules" in changed:
+            await self.apply_schedules(self.config_sync.documents("schedules"))
+        if "pumps" in changed:
+            await self.apply_pumps(self.config_sync.documents("pumps"))
+        if changed:
+            self.logger.info(f"Updated configuration: {', '.join(sorted(changed))}")
+            # Sensors close to a schedule threshold are sampled faster
+            await self.sensor_service.update_thresholds(
+                self.irrigation_service.sensor_thresholds()
+            )
+
+    async def apply_plants(self, plants):
         if not plants:
             self.logger.warning("No plants found for this controller.")
-            async with self.data_lock:
-                self.plants_cache = []
-        else:
-            async with self.data_lock:
-                self.plants_cache = plants
-        await self.irrigation_service.update_plants(plants if plants else [])
+        async with self.data_lock:
+            self.plants_cache = plants
+        await self.irrigation_service.update_plants(plants)
 
-    async def check_for_new_sensors(self):
-        sensors = await Sensors.get_sensors_by_controller(self.controller_id)
+    async def apply_sensors(self, sensors):
         if not sensors:
             self.logger.warning("No sensors found for this controller.")
         else:
@@ -247,14 +394,12 @@ class DatabaseService:
             await self.sensor_service.update_sensors(sensors)
             await self.irrigation_service.update_sensor_types(sensor_types)
 
-    async def check_for_new_schedules(self):
-        schedules = await Schedules.get_schedules_by_controller(self.controller_id)
+    async def apply_schedules(self, schedules):
         if not schedules:
             self.logger.warning("No schedules found for this controller.")
         await self.irrigation_service.update_schedules(schedules)
 
-    async def check_for_new_pumps(self):
-        pumps = await Pumps.get_pumps_by_controller(self.controller_id)
+    async def apply_pumps(self, pumps):
         if not pumps:
             self.logger.warning("No pumps found for this controller.")
         await self.irrigation_service.update_pumps(pumps)
@@ -266,20 +411,27 @@ class DatabaseService:
         await self.healthy.wait()
 
     async def add_watering_log(self, log_data: dict):
-        async with self.data_lock:
-            self.watering_logs_queue.append(log_data)
+        await self.watering_logs_queue.put(json.dumps(log_data))
         self.logger.debug(f"Added watering log to queue: {log_data}")
 
     async def add_sensor_data_item(self, sensor_data_json: str):
-        async with self.data_lock:
-            self.sensor_data_queue.append(sensor_data_json)
+        await self.sensor_data_queue.put(sensor_data_json)
         self.logger.debug(f"Added sensor data to queue: {sensor_data_json[:50]}...")
 
     async def add_log_item(self, log_json: str):
-        async with self.data_lock:
-            self.logs_queue.append(log_json)
+        await self.logs_queue.put(log_json)
         self.logger.debug(f"Added general log to queue: {log_json[:50]}...")
 
+    def get_queue_stats(self):
+        return {
+            queue.name: queue.stats()
+            for queue in (
+                self.watering_logs_queue,
+                self.sensor_data_queue,
+                self.logs_queue,
+            )
+        }
+
     async def get_cached_plants(self):
         async with self.data_lock:
             return list(self.plants_cache)
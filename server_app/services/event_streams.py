@@ -0,0 +1,134 @@
+import json
+from redis.exceptions import ResponseError
+from server_app.logging_config import setup_logger
+
+logger = setup_logger(__name__)
+
+WATERING_STREAM = "watering_events"
+SENSOR_STREAM = "sensor_events"
+CONSUMER_GROUP = "database_service"
+
+
+def decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class EventStream:
+    """
+    Capped Redis stream of JSON events, consumed through a consumer group.
+
+    Producers append with XADD MAXLEN ~ so the stream stays bounded.
+    The consumer acknowledges entries only after they were written to
+    MongoDB. Entries that were read but not acknowledged (crash, failed
+    write) are delivered again from the pending entries list, so delivery
+    is at least once.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        key,
+        maxlen=10000,
+        group=CONSUMER_GROUP,
+        consumer="controller",
+        claim_idle_ms=60000,
+    ):
+        self.redis_client = redis_client
+        self.key = key
+        self.maxlen = maxlen
+        self.group = group
+        self.consumer = consumer
+        # Entries pending longer than this on other consumers are taken over
+        self.claim_idle_ms = claim_idle_ms
+        # Start by re-reading our own pending entries from before a restart
+        self.recovering = True
+        self.pending_cursor = "0"
+        self.group_ready = False
+
+    def add_to(self, pipe, data):
+        """Queue an XADD of data on a pipeline."""
+        return pipe.xadd(
+            self.key, {"data": json.dumps(data)}, maxlen=self.maxlen, approximate=True
+        )
+
+    async def add(self, data):
+        return await self.redis_client.xadd(
+            self.key, {"data": json.dumps(data)}, maxlen=self.maxlen, approximate=True
+        )
+
+    async def ensure_group(self):
+        if self.group_ready:
+            return
+        try:
+            await self.redis_client.xgroup_create(
+                self.key, self.group, id="0", mkstream=True
+            )
+            logger.info(f"Created consumer group {self.group} on {self.key}")
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self.group_ready = True
+
+    def parse(self, entries):
+        events = []
+        for entry_id, fields in entries:
+            if not fields:
+                # Pending entry that was trimmed away before it was acked
+                events.append((decode(entry_id), None))
+                continue
+            data = decode(fields.get(b"data", fields.get("data")))
+            events.append((decode(entry_id), data))
+        return events
+
+    async def claim_stale(self, count):
+        result = await self.redis_client.xautoclaim(
+            self.key,
+            self.group,
+            self.consumer,
+            min_idle_time=self.claim_idle_ms,
+            start_id="0-0",
+            count=count,
+        )
+        return self.parse(result[1])
+
+    async def read(self, count, block=None):
+        """
+        Return up to count (entry_id, json_data) tuples. While recovering,
+        pending entries are returned before any new ones.
+        """
+        await self.ensure_group()
+        if self.recovering:
+            # Page through the pending entries, some may still be held
+            # unacknowledged on purpose (see WindowAggregator)
+            response = await self.redis_client.xreadgroup(
+                self.group, self.consumer, {self.key: self.pending_cursor}, count=count
+            )
+            events = self.parse(response[0][1]) if response else []
+            if events:
+                self.pending_cursor = events[-1][0]
+            else:
+                events = await self.claim_stale(count)
+            if events:
+                return events
+            self.recovering = False
+
+        response = await self.redis_client.xreadgroup(
+            self.group, self.consumer, {self.key: ">"}, count=count, block=block
+        )
+        return self.parse(response[0][1]) if response else []
+
+    async def ack(self, entry_ids):
+        if not entry_ids:
+            return 0
+        return await self.redis_client.xack(self.key, self.group, *entry_ids)
+
+    async def trim_before(self, timestamp):
+        """Drop entries added before the given UNIX time."""
+        return await self.redis_client.xtrim(
+            self.key, minid=f"{int(timestamp * 1000)}-0", approximate=True
+        )
+
+    def retry_pending(self):
+        """Deliver unacknowledged entries again on the next read."""
+        self.recovering = True
+        self.pending_cursor = "0"
@@ -0,0 +1,199 @@
+import time
+from server_app.services.event_streams import EventStream, decode
+
+# Lists that producers appended to before the event streams existed
+LEGACY_LISTS = {
+    "sensor_data": "sensor_events",
+    "watering_logs": "watering_events",
+}
+
+
+class IngestPump:
+    """
+    Drains the Redis event streams into MongoDB in large batches.
+
+    All streams are read with a single blocking XREADGROUP per round trip
+    and every batch is handed straight to the bulk writer of its stream.
+    Entries are acknowledged once the writer returned.
+
+    Streams with an aggregator are buffered into time windows instead and
+    their entries are acknowledged when the window summaries were written.
+    Raw entries of those streams are kept in Redis for raw_retention seconds.
+
+    While MongoDB is unreachable, spill_once() moves entries into local
+    queues instead, so the capped streams do not drop them during long
+    outages. The queues bound what is kept with their overflow policies.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        writers,
+        consumer,
+        logger,
+        batch_size=1000,
+        block_ms=1000,
+        report_interval=60,
+        aggregators=None,
+        raw_retention=86400,
+        queues=None,
+    ):
+        self.redis_client = redis_client
+        # Stream key -> coroutine function writing a list of JSON events
+        self.writers = writers
+        self.streams = {
+            key: EventStream(redis_client, key, consumer=consumer) for key in writers
+        }
+        self.logger = logger
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.report_interval = report_interval
+        # Stream key -> WindowAggregator
+        self.aggregators = aggregators or {}
+        self.raw_retention = raw_retention
+        # Stream key -> durable BoundedQueue taking its events while offline
+        self.queues = queues or {}
+        self.spilled_total = 0
+        self.drained_total = 0
+        self.window_drained = 0
+        self.window_start = time.monotonic()
+        self.rate = 0.0
+
+    async def read_batches(self, block_ms):
+        recovering = [stream for stream in self.streams.values() if stream.recovering]
+        if recovering:
+            # Pending entries are re-read per stream until none are left
+            batches = {}
+            for stream in recovering:
+                events = await stream.read(self.batch_size)
+                if events:
+                    batches[stream.key] = events
+            if batches:
+                return batches
+
+        for stream in self.streams.values():
+            await stream.ensure_group()
+        any_stream = next(iter(self.streams.values()))
+        response = await self.redis_client.xreadgroup(
+            any_stream.group,
+            any_stream.consumer,
+            {key: ">" for key in self.streams},
+            count=self.batch_size,
+            block=block_ms,
+        )
+        batches = {}
+        for key, entries in response or []:
+            key = decode(key)
+            batches[key] = self.streams[key].parse(entries)
+        return batches
+
+    async def drain_once(self, block_ms=None):
+        """Read and store one batch per stream, return the number of events."""
+        batches = await self.read_batches(block_ms)
+        drained = 0
+        error = None
+        for key, events in batches.items():
+            stream = self.streams[key]
+            try:
+                aggregator = self.aggregators.get(key)
+                if aggregator is not None:
+                    await stream.ack(aggregator.add(events))
+                    drained += len(events)
+                    continue
+                event_data = [data for _, data in events if data is not None]
+                if event_data:
+                    await self.writers[key](event_data)
+                # Only acknowledge once the events are stored in MongoDB
+                await stream.ack([entry_id for entry_id, _ in events])
+                drained += len(events)
+            except Exception as e:
+                # The other streams' batches were delivered by the same read
+                # and are stored regardless, only this one is read again
+                self.logger.error(f"Error storing events from {key}: {str(e)}")
+                stream.retry_pending()
+                error = error or e
+        self.record(drained)
+        if error is not None:
+            raise error
+        return drained
+
+    async def spill_once(self, block_ms=None):
+        """
+        Move one batch per stream into its local queue and acknowledge it,
+        return the number of events.
+        """
+        batches = await self.read_batches(block_ms)
+        spilled = 0
+        error = None
+        for key, events in batches.items():
+            aggregator = self.aggregators.get(key)
+            if aggregator is not None:
+                # Entries held for a window are uploaded with that window
+                events = [
+                    (entry_id, data)
+                    for entry_id, data in events
+                    if entry_id not in aggregator.buffered_ids
+                ]
+            try:
+                self.queues[key].extend(data for _, data in events if data is not None)
+                # The queue committed the events to disk, Redis can let go of them
+                await self.streams[key].ack([entry_id for entry_id, _ in events])
+            except Exception as e:
+                self.logger.error(f"Error spilling events from {key}: {str(e)}")
+                self.streams[key].retry_pending()
+                error = error or e
+                continue
+            spilled += len(events)
+        self.spilled_total += spilled
+        if error is not None:
+            raise error
+        return spilled
+
+    async def upload_windows(self, now=None, force=False):
+        """Upload closed windows that are due, return the number of entries."""
+        uploaded = 0
+        for key, aggregator in self.aggregators.items():
+            if not (force or aggregator.upload_due()):
+                continue
+            stream = self.streams[key]
+            entry_ids = await aggregator.upload(now)
+            await stream.ack(entry_ids)
+            uploaded += len(entry_ids)
+            await stream.trim_before(time.time() - self.raw_retention)
+        return uploaded
+
+    async def drain_legacy_lists(self):
+        """Move events left in the pre-stream lists to MongoDB with LMPOP."""
+        keys = list(LEGACY_LISTS)
+        drained = 0
+        while True:
+            result = await self.redis_client.lmpop(
+                len(keys), *keys, direction="LEFT", count=self.batch_size
+            )
+            if not result:
+                break
+            key, items = decode(result[0]), [decode(item) for item in result[1]]
+            try:
+                await self.writers[LEGACY_LISTS[key]](items)
+            except Exception:
+                # Put the batch back in its original order
+                await self.redis_client.lpush(key, *reversed(items))
+                raise
+            drained += len(items)
+        if drained:
+            self.logger.info(f"Drained {drained} events from legacy lists")
+        self.record(drained)
+        return drained
+
+    def record(self, drained):
+        self.drained_total += drained
+        self.window_drained += drained
+        elapsed = time.monotonic() - self.window_start
+        if elapsed >= self.report_interval:
+            self.rate = self.window_drained / elapsed
+            self.logger.info(
+                f"Ingest drained {self.window_drained} events in {elapsed:.0f}s "
+                f"({self.rate:.1f} events/s, {self.drained_total} total)"
+            )
+            self.window_drained = 0
+            self.window_start = time.monotonic()
@@ -0,0 +1,173 @@
+import json
+import sqlite3
+from server_app.logging_config import setup_logger
+from server_app.services.batch_queue import BoundedQueue
+
+logger = setup_logger(__name__)
+
+
+class Spool:
+    """
+    Crash-safe local storage for items waiting to be uploaded.
+
+    All queues live in one SQLite database in WAL mode. Appends are single
+    small transactions; with synchronous=NORMAL a power loss may lose the
+    last few appends but never corrupts the file, synchronous=FULL also
+    syncs every append. Committed items are deleted and the file is
+    compacted (WAL checkpoint and incremental vacuum) after every
+    compact_every deleted items.
+    """
+
+    def __init__(self, path, synchronous="NORMAL", compact_every=10000):
+        self.path = path
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        # Must be set before the first table is created to take effect
+        self.connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(f"PRAGMA synchronous={synchronous}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, queue TEXT NOT NULL, "
+            "item TEXT NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS spool_queue ON spool (queue, id)"
+        )
+        self.compact_every = compact_every
+        self.deleted_since_compaction = 0
+        self.queues = {}
+
+    def queue(self, name, maxlen=100000, **limits):
+        if name not in self.queues:
+            self.queues[name] = SpoolQueue(self, name, maxlen, **limits)
+        return self.queues[name]
+
+    def deleted(self, count):
+        self.deleted_since_compaction += count
+        if self.deleted_since_compaction >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.connection.execute("PRAGMA incremental_vacuum")
+        self.deleted_since_compaction = 0
+
+    def close(self):
+        self.compact()
+        self.connection.close()
+
+
+class SpoolQueue(BoundedQueue):
+    """
+    One queue of a Spool with the interface of BatchQueue. Items are stored
+    as JSON. Items left from before a restart are replayed first.
+    """
+
+    def __init__(self, spool, name, maxlen=100000, **limits):
+        super().__init__(name, maxlen, **limits)
+        self.spool = spool
+        self.connection = spool.connection
+        self.peeked_ids = []
+        self.size, self.bytes = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(item)), 0) FROM spool "
+            "WHERE queue = ?",
+            (name,),
+        ).fetchone()
+        if self.size:
+            logger.info(f"Replaying {self.size} spooled items of {name}")
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, items):
+        with self.connection:
+            self.connection.execute("BEGIN")
+            super().extend(items)
+
+    def push(self, items):
+        rows = [(self.name, json.dumps(item)) for item in items]
+        self.connection.executemany(
+            "INSERT INTO spool (queue, item) VALUES (?, ?)", rows
+        )
+        self.size += len(rows)
+        self.bytes += sum(len(item) for _, item in rows)
+
+    def in_flight(self):
+        if not self.peeked_ids:
+            return 0
+        (count,) = self.connection.execute(
+            "SELECT COUNT(*) FROM spool WHERE queue = ? AND id <= ?",
+            (self.name, self.peeked_ids[-1]),
+        ).fetchone()
+        return count
+
+    def rows_after(self, count, skip):
+        return self.connection.execute(
+            "SELECT id, item FROM spool WHERE queue = ? ORDER BY id LIMIT ? OFFSET ?",
+            (self.name, count, skip),
+        ).fetchall()
+
+    def front(self, count, skip):
+        return [json.loads(item) for _, item in self.rows_after(count, skip)]
+
+    def replace_front(self, count, skip, items):
+        rows = self.rows_after(count, skip)
+        ids = [row_id for row_id, _ in rows]
+        self.delete(ids)
+        # Reuse the oldest ids so the merged items keep their place
+        new_rows = [
+            (row_id, self.name, json.dumps(item)) for row_id, item in zip(ids, items)
+        ]
+        self.connection.executemany(
+            "INSERT INTO spool (id, queue, item) VALUES (?, ?, ?)", new_rows
+        )
+        self.size += len(new_rows)
+        self.bytes += sum(len(item) for _, _, item in new_rows)
+
+    def delete(self, ids):
+        (removed_bytes,) = self.connection.execute(
+            f"SELECT COALESCE(SUM(LENGTH(item)), 0) FROM spool "
+            f"WHERE id IN ({','.join('?' * len(ids))})",
+            ids,
+        ).fetchone()
+        self.connection.execute(
+            f"DELETE FROM spool WHERE id IN ({','.join('?' * len(ids))})", ids
+        )
+        self.size -= len(ids)
+        self.bytes -= removed_bytes
+        # Compacted with the next commit, not inside this transaction
+        self.spool.deleted_since_compaction += len(ids)
+
+    def drop_front(self, count):
+        ids = [row_id for row_id, _ in self.rows_after(count, 0)]
+        if ids:
+            self.delete(ids)
+        return len(ids)
+
+    def peek(self, count=None):
+        """Return up to count items from the front without removing them."""
+        rows = self.rows_after(-1 if count is None else count, 0)
+        self.peeked_ids = [row_id for row_id, _ in rows]
+        return [json.loads(item) for _, item in rows]
+
+    def commit(self, count):
+        """Remove the first count items of the last peeked batch."""
+        if count <= 0 or not self.peeked_ids:
+            return 0
+        last_id = self.peeked_ids[min(count, len(self.peeked_ids)) - 1]
+        with self.connection:
+            self.connection.execute("BEGIN")
+            removed, removed_bytes = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(item)), 0) FROM spool "
+                "WHERE queue = ? AND id <= ?",
+                (self.name, last_id),
+            ).fetchone()
+            self.connection.execute(
+                "DELETE FROM spool WHERE queue = ? AND id <= ?", (self.name, last_id)
+            )
+        self.size -= removed
+        self.bytes -= removed_bytes
+        self.peeked_ids = []
+        self.committed()
+        self.spool.deleted(removed)
+        return removed
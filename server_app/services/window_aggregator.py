@@ -0,0 +1,187 @@
+import json
+import math
+import time
+import numpy as np
+
+
+class WindowAggregator:
+    """
+    Rolls raw sensor readings into fixed time windows before upload.
+
+    Readings are buffered in growable NumPy arrays together with the stream
+    entry they came from. Once a window has ended it is summarised per
+    sensor (min, max, mean, count, last) and handed to write_windows; only
+    then are its entries acknowledged, so a crash before the upload replays
+    the raw readings from the stream.
+    """
+
+    def __init__(
+        self, write_windows, window_seconds=300, upload_interval=None, capacity=1024
+    ):
+        self.write_windows = write_windows
+        self.window_seconds = window_seconds
+        # How often closed windows are uploaded, defaults to once per window
+        self.upload_interval = upload_interval or window_seconds
+        self.last_upload = time.monotonic()
+        self.sensor_rows = {}  # Sensor ID -> row number
+        self.sensor_ids = []  # Row number -> sensor ID
+        self.rows = np.empty(capacity, dtype=np.int64)
+        self.timestamps = np.empty(capacity, dtype=np.float64)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.entry_ids = []
+        self.buffered_ids = set()
+        self.size = 0
+
+    @classmethod
+    def summarize(cls, readings, window_seconds):
+        """
+        Summaries of all windows of a list of JSON readings, ended or not.
+        Used for readings that are no longer in a stream, such as spooled ones.
+        """
+        aggregator = cls(None, window_seconds, capacity=max(len(readings), 1))
+        aggregator.add(enumerate(readings))
+        summaries, _ = aggregator.closed_windows(math.inf)
+        return summaries
+
+    def __len__(self):
+        return self.size
+
+    def grow(self, needed):
+        capacity = len(self.rows)
+        while capacity < needed:
+            capacity *= 2
+        if capacity == len(self.rows):
+            return
+        for name in ("rows", "timestamps", "values"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[: self.size] = old[: self.size]
+            setattr(self, name, new)
+
+    def row_of(self, sensor_id):
+        row = self.sensor_rows.get(sensor_id)
+        if row is None:
+            row = self.sensor_rows[sensor_id] = len(self.sensor_ids)
+            self.sensor_ids.append(sensor_id)
+        return row
+
+    def add(self, events):
+        """
+        Buffer (entry_id, json_data) events. Returns the entry IDs that carry
+        no usable reading and can be acknowledged right away.
+        """
+        rows, timestamps, values, entry_ids, unusable = [], [], [], [], []
+        for entry_id, data in events:
+            if entry_id in self.buffered_ids:
+                # Delivered again while still waiting for its window
+                continue
+            try:
+                reading = json.loads(data)
+                row = self.row_of(reading["sensorID"])
+                timestamp = float(reading["timestamp"])
+                value = float(reading["value"])
+            except (TypeError, ValueError, KeyError):
+                unusable.append(entry_id)
+                continue
+            rows.append(row)
+            timestamps.append(timestamp)
+            values.append(value)
+            entry_ids.append(entry_id)
+
+        if entry_ids:
+            start, end = self.size, self.size + len(entry_ids)
+            self.grow(end)
+            self.rows[start:end] = rows
+            self.timestamps[start:end] = timestamps
+            self.values[start:end] = values
+            self.entry_ids.extend(entry_ids)
+            self.buffered_ids.update(entry_ids)
+            self.size = end
+        return unusable
+
+    def closed_mask(self, now):
+        window_starts = self.window_starts()
+        return window_starts + self.window_seconds <= now
+
+    def window_starts(self):
+        timestamps = self.timestamps[: self.size]
+        return np.floor(timestamps / self.window_seconds) * self.window_seconds
+
+    def closed_windows(self, now):
+        """Return (summaries, entry_ids) of the windows that ended before now."""
+        closed = self.closed_mask(now)
+        if not closed.any():
+            return [], []
+
+        rows = self.rows[: self.size][closed]
+        timestamps = self.timestamps[: self.size][closed]
+        values = self.values[: self.size][closed]
+        starts = self.window_starts()[closed]
+
+        # Group by sensor and window, oldest reading first within a group
+        order = np.lexsort((timestamps, starts, rows))
+        rows, timestamps, values, starts = (
+            rows[order],
+            timestamps[order],
+            values[order],
+            starts[order],
+        )
+        boundary = np.ones(len(rows), dtype=bool)
+        boundary[1:] = (rows[1:] != rows[:-1]) | (starts[1:] != starts[:-1])
+        first = np.flatnonzero(boundary)
+        last = np.append(first[1:], len(rows)) - 1
+        counts = last - first + 1
+
+        minimums = np.minimum.reduceat(values, first)
+        maximums = np.maximum.reduceat(values, first)
+        means = np.add.reduceat(values, first) / counts
+
+        summaries = [
+            {
+                "sensorID": self.sensor_ids[rows[i]],
+                "windowStart": float(starts[i]),
+                "windowSeconds": self.window_seconds,
+                "min": float(minimum),
+                "max": float(maximum),
+                "mean": float(mean),
+                "count": int(count),
+                "last": float(values[j]),
+                "lastTimestamp": float(timestamps[j]),
+            }
+            for i, j, minimum, maximum, mean, count in zip(
+                first, last, minimums, maximums, means, counts
+            )
+        ]
+        entry_ids = [
+            entry_id for entry_id, is_closed in zip(self.entry_ids, closed) if is_closed
+        ]
+        return summaries, entry_ids
+
+    def discard_closed(self, now):
+        """Drop the readings of windows that ended before now."""
+        keep = ~self.closed_mask(now)
+        kept = int(keep.sum())
+        self.rows[:kept] = self.rows[: self.size][keep]
+        self.timestamps[:kept] = self.timestamps[: self.size][keep]
+        self.values[:kept] = self.values[: self.size][keep]
+        self.entry_ids = [
+            entry_id for entry_id, is_kept in zip(self.entry_ids, keep) if is_kept
+        ]
+        self.buffered_ids = set(self.entry_ids)
+        self.size = kept
+
+    def upload_due(self):
+        return time.monotonic() - self.last_upload >= self.upload_interval
+
+    async def upload(self, now=None):
+        """
+        Write the summaries of all closed windows and return the entry IDs
+        they cover. Nothing is discarded if the write fails.
+        """
+        now = time.time() if now is None else now
+        summaries, entry_ids = self.closed_windows(now)
+        if summaries:
+            await self.write_windows(summaries)
+        self.discard_closed(now)
+        self.last_upload = time.monotonic()
+        return entry_ids
@@ -0,0 +1,151 @@
+import pytest
+import asyncio
+import json
+from server_app.services.batch_queue import (
+    BatchQueue,
+    BLOCK,
+    DOWNSAMPLE,
+    NEVER_DROP,
+    downsample_readings,
+)
+from server_app.services.spool import Spool
+
+
+class TestBatchQueue:
+    def test_commit_after_peek(self):
+        queue = BatchQueue()
+        queue.extend(range(5))
+        assert queue.peek(3) == [0, 1, 2]
+        # A failed upload does not commit, the batch is peeked again
+        assert queue.peek(3) == [0, 1, 2]
+        queue.append(5)
+        assert queue.commit(3) == 3
+        assert queue.peek() == [3, 4, 5]
+
+    def test_drops_oldest_when_full(self):
+        queue = BatchQueue(maxlen=3)
+        queue.extend(range(3))
+        batch = queue.peek(2)
+        queue.extend([3, 4])
+        assert queue.dropped == 2
+        # Both peeked items were dropped meanwhile, nothing unsent is removed
+        assert queue.commit(len(batch)) == 0
+        assert queue.peek() == [2, 3, 4]
+
+    def test_memory_cap(self):
+        queue = BatchQueue(maxlen=None, max_bytes=10)
+        queue.extend(["abcd", "efgh", "ijkl"])
+        assert queue.peek() == ["efgh", "ijkl"]
+        assert queue.stats() == {
+            "depth": 2,
+            "bytes": 8,
+            "dropped": 1,
+            "downsampled": 0,
+            "blocked": 0,
+        }
+
+    def test_never_drop(self):
+        queue = BatchQueue(maxlen=2, policy=NEVER_DROP)
+        queue.extend(range(5))
+        assert len(queue) == 5
+        assert queue.dropped == 0
+
+    def test_downsample_keeps_in_flight_batch(self):
+        queue = BatchQueue(maxlen=10, policy=DOWNSAMPLE, downsample_bucket=60)
+        queue.extend(
+            json.dumps({"sensorID": 1, "value": float(i), "timestamp": i * 10})
+            for i in range(10)
+        )
+        batch = queue.peek(2)
+        queue.append(json.dumps({"sensorID": 1, "value": 0.0, "timestamp": 100}))
+        # Four readings after the batch were merged into one per minute
+        assert len(queue) == 8
+        assert queue.downsampled == 3
+        assert queue.dropped == 0
+        assert queue.peek(2) == batch
+        merged = json.loads(queue.peek(3)[2])
+        assert merged == {
+            "sensorID": 1,
+            "value": 3.5,
+            "timestamp": 50,
+            "count": 4,
+            "min": 2.0,
+            "max": 5.0,
+        }
+        assert queue.commit(2) == 2
+
+    def test_downsampled_readings_are_weighted(self):
+        readings = [
+            json.dumps({"sensorID": 1, "value": 10.0, "timestamp": 0, "count": 3}),
+            json.dumps({"sensorID": 1, "value": 20.0, "timestamp": 30}),
+            json.dumps({"sensorID": 2, "value": 5.0, "timestamp": 30}),
+            "not json",
+        ]
+        merged = downsample_readings(readings, 60)
+        assert merged[0] == "not json"
+        assert json.loads(merged[1])["value"] == 12.5
+        assert json.loads(merged[1])["count"] == 4
+        assert json.loads(merged[2])["sensorID"] == 2
+
+    @pytest.mark.asyncio
+    async def test_block_waits_for_commit(self):
+        queue = BatchQueue(maxlen=2, policy=BLOCK)
+        await queue.put(1)
+        await queue.put(2)
+        producer = asyncio.create_task(queue.put(3))
+        await asyncio.sleep(0.01)
+        assert not producer.done()
+        assert queue.blocked == 1
+
+        queue.commit(len(queue.peek(1)))
+        await asyncio.wait_for(producer, timeout=1)
+        assert queue.peek() == [2, 3]
+
+
+class TestSpoolQueue:
+    def test_items_survive_reopening(self, tmp_path):
+        path = tmp_path / "spool.sqlite3"
+        spool = Spool(path)
+        queue = spool.queue("watering_logs")
+        queue.extend([{"plantID": 1, "timestamp": 1}, {"plantID": 2, "timestamp": 2}])
+        queue.append({"plantID": 3, "timestamp": 3})
+        assert queue.peek(1) == [{"plantID": 1, "timestamp": 1}]
+        assert queue.commit(1) == 1
+        # Simulate a crash, nothing is closed or flushed
+        del spool, queue
+
+        queue = Spool(path).queue("watering_logs")
+        assert len(queue) == 2
+        assert [log["plantID"] for log in queue.peek()] == [2, 3]
+
+    def test_queues_are_capped_and_compacted(self, tmp_path):
+        spool = Spool(tmp_path / "spool.sqlite3", compact_every=50)
+        sensor_data = spool.queue("sensor_data", maxlen=100)
+        logs = spool.queue("logs")
+        sensor_data.extend(str(i) for i in range(150))
+        logs.append("log")
+        assert len(sensor_data) == 100
+        assert sensor_data.dropped == 50
+        assert sensor_data.peek(2) == ["50", "51"]
+
+        batch = sensor_data.peek(60)
+        assert sensor_data.commit(len(batch)) == 60
+        assert spool.deleted_since_compaction == 0
+        assert len(sensor_data) == 40
+        assert logs.peek() == ["log"]
+        spool.close()
+
+    def test_policies_apply_to_spooled_queues(self, tmp_path):
+        spool = Spool(tmp_path / "spool.sqlite3")
+        queue = spool.queue(
+            "sensor_data", maxlen=4, policy=DOWNSAMPLE, downsample_bucket=60
+        )
+        queue.extend(
+            json.dumps({"sensorID": 1, "value": float(i), "timestamp": i})
+            for i in range(5)
+        )
+        assert len(queue) == 4
+        assert queue.downsampled == 1
+        assert json.loads(queue.peek(1)[0])["count"] == 2
+        assert queue.bytes == sum(len(json.dumps(item)) for item in queue.peek())
+        spool.close()
@@ -0,0 +1,205 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+from pymongo.errors import OperationFailure
+from server_app.database.database import db_connection
+from server_app.services.change_watcher import ChangeWatcher, ResumeTokenStore
+from server_app.services.config_sync import ConfigSync
+
+# A single-node replica set, e.g. mongod --replSet rs0 plus rs.initiate()
+REPLICA_SET_URI = os.getenv("MONGODB_REPLICA_SET_URI")
+
+
+class FakeStream:
+    """Hands out queued change events like a motor change stream."""
+
+    def __init__(self, changes, stop_event):
+        self.changes = list(changes)
+        self.stop_event = stop_event
+        self.resume_token = None
+        self.alive = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.alive = False
+
+    async def try_next(self):
+        if not self.changes:
+            self.stop_event.set()
+            return None
+        change = self.changes.pop(0)
+        self.resume_token = {"_data": f"token-{change['ns']['coll']}"}
+        return change
+
+
+class IdleStream(FakeStream):
+    """Returns no changes but advances the post batch token, like idle getMores."""
+
+    def __init__(self, polls, stop_event):
+        super().__init__([], stop_event)
+        self.polls = polls
+
+    async def try_next(self):
+        self.polls -= 1
+        if self.polls == 0:
+            self.stop_event.set()
+        self.resume_token = {"_data": f"idle-{self.polls}"}
+        return None
+
+
+def change(collection, document):
+    return {
+        "ns": {"db": "irrigation_system", "coll": collection},
+        "fullDocument": document,
+    }
+
+
+@pytest.mark.asyncio
+class TestChangeWatcher:
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        self.stop_event = asyncio.Event()
+        self.sync = ConfigSync(1)
+        self.sync.collections["plants"].replace(
+            [{"plantID": 1, "waterRequirement": 100}]
+        )
+        self.sync.full_sync = AsyncMock(return_value={"plants"})
+        self.on_change = AsyncMock()
+        self.tokens = ResumeTokenStore(str(tmp_path / "token.json"))
+        self.watcher = ChangeWatcher(
+            1, self.sync, self.on_change, self.tokens, self.stop_event
+        )
+
+    def stream(self, *changes):
+        db = MagicMock()
+        db.watch.return_value = FakeStream(changes, self.stop_event)
+        return patch.multiple(db_connection, client=MagicMock(), db=db)
+
+    async def test_token_store_round_trip(self, tmp_path):
+        self.tokens.save({"_data": "8263"})
+        assert ResumeTokenStore(self.tokens.path).load() == {"_data": "8263"}
+        self.tokens.clear()
+        assert self.tokens.load() is None
+        (tmp_path / "broken.json").write_text("{not json")
+        assert ResumeTokenStore(str(tmp_path / "broken.json")).load() is None
+
+    async def test_applies_projected_changes(self):
+        plant = {"_id": "x", "plantID": 1, "waterRequirement": 150, "name": "Basil"}
+        with self.stream(change("plants", plant)):
+            await self.watcher.run()
+        self.on_change.assert_any_await({"plants"})
+        assert self.sync.documents("plants") == [
+            {"plantID": 1, "waterRequirement": 150}
+        ]
+        assert self.tokens.load() == {"_data": "token-plants"}
+
+    async def test_tombstones_and_unchanged_documents(self):
+        self.tokens.save({"_data": "earlier"})
+        tombstone = {
+            "collection": "plants",
+            "controllerID": 1,
+            "key": {"plantID": 1},
+            "lastChanged": datetime(2025, 5, 1),
+        }
+        with self.stream(
+            change("plants", {"plantID": 1, "waterRequirement": 100}),
+            change("tombstones", tombstone),
+        ):
+            await self.watcher.run()
+        # Resumed from the stored token, so no full sync
+        self.sync.full_sync.assert_not_awaited()
+        self.on_change.assert_awaited_once_with({"plants"})
+        assert self.sync.documents("plants") == []
+
+    async def test_idle_tokens_are_saved_throttled(self):
+        self.tokens.save({"_data": "earlier"})
+        db = MagicMock()
+        db.watch.return_value = IdleStream(100, self.stop_event)
+        with (
+            patch.multiple(db_connection, client=MagicMock(), db=db),
+            patch.object(self.tokens, "save", wraps=self.tokens.save) as save,
+        ):
+            await self.watcher.run()
+        # Only the token the stream stopped at is written
+        save.assert_called_once_with({"_data": "idle-0"})
+        assert ResumeTokenStore(self.tokens.path).load() == {"_data": "idle-0"}
+
+    async def test_full_sync_without_token(self):
+        with self.stream():
+            await self.watcher.run()
+        self.sync.full_sync.assert_awaited_once()
+        self.on_change.assert_awaited_once_with({"plants"})
+
+    async def test_falls_back_to_polling(self):
+        db = MagicMock()
+        db.watch.side_effect = OperationFailure(
+            "The $changeStream stage is only supported on replica sets", 40573
+        )
+        with patch.multiple(db_connection, client=MagicMock(), db=db):
+            await asyncio.wait_for(self.watcher.run(), timeout=1)
+        assert not self.watcher.available
+        assert not self.watcher.streaming
+
+    async def test_expired_token_is_cleared(self):
+        self.tokens.save({"_data": "expired"})
+        db = MagicMock()
+        db.watch.side_effect = [
+            OperationFailure("Resume point no longer in the oplog", 286),
+            FakeStream([], self.stop_event),
+        ]
+        with patch.multiple(db_connection, client=MagicMock(), db=db):
+            await self.watcher.run()
+        assert db.watch.call_args_list[1].kwargs["resume_after"] is None
+        self.sync.full_sync.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(
+    not REPLICA_SET_URI, reason="set MONGODB_REPLICA_SET_URI to a replica set"
+)
+async def test_pushes_edits_from_replica_set(tmp_path):
+    import motor.motor_asyncio
+    from server_app.database.models import Plants
+
+    client = motor.motor_asyncio.AsyncIOMotorClient(REPLICA_SET_URI)
+    name = f"irrigation_test_{uuid.uuid4().hex[:8]}"
+    controller_id = 4242
+    stop_event = asyncio.Event()
+    changes = asyncio.Queue()
+
+    async def on_change(names):
+        await changes.put((time.monotonic(), names))
+
+    sync = ConfigSync(controller_id)
+    watcher = ChangeWatcher(
+        controller_id,
+        sync,
+        on_change,
+        ResumeTokenStore(str(tmp_path / "token.json")),
+        stop_event,
+        max_await_ms=200,
+    )
+    with patch.multiple(db_connection, client=client, db=client[name]):
+        task = asyncio.create_task(watcher.run())
+        try:
+            # The initial full sync
+            await asyncio.wait_for(changes.get(), timeout=10)
+            started = time.monotonic()
+            await Plants.create(
+                {"plantID": 1, "controllerID": controller_id, "waterRequirement": 300}
+            )
+            received, names = await asyncio.wait_for(changes.get(), timeout=5)
+            assert names == {"plants"}
+            assert received - started < 1
+            assert sync.documents("plants")[0]["waterRequirement"] == 300
+        finally:
+            stop_event.set()
+            await asyncio.wait_for(task, timeout=5)
+            await client.drop_database(name)
+            client.close()
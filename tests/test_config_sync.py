@@ -0,0 +1,230 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+import asyncio
+from datetime import datetime, timedelta
+from pymongo.errors import OperationFailure
+from server_app.database.database import db_connection
+from server_app.database.models import (
+    ConfigSnapshot,
+    ControllerConfig,
+    Plants,
+    Pumps,
+    Schedules,
+    Sensors,
+)
+from server_app.services.config_sync import ConfigSync
+from server_app.services.database_service import DatabaseService
+
+T0 = datetime(2025, 5, 1, 12, 0)
+
+
+def at(minutes):
+    return T0 + timedelta(minutes=minutes)
+
+
+class FakeCollections:
+    """Serves the configuration queries and tombstones from lists."""
+
+    def __init__(self):
+        self.documents = {"plants": [], "sensors": [], "schedules": [], "pumps": []}
+        self.tombstones = []
+        self.queries = []
+
+    def fetcher(self, name):
+        async def fetch(controller_id, changed_since=None):
+            self.queries.append((name, changed_since))
+            return [
+                dict(document)
+                for document in self.documents[name]
+                if changed_since is None
+                or document.get("lastChanged", datetime.min) >= changed_since
+            ]
+
+        return fetch
+
+    async def get_since(self, controller_id, since):
+        return [
+            tombstone
+            for tombstone in self.tombstones
+            if tombstone["lastChanged"] >= since
+        ]
+
+    async def load(self, controller_id, changed_since=None):
+        self.queries.append(("combined", changed_since))
+        snapshot = ConfigSnapshot(changed_since=changed_since)
+        for name in self.documents:
+            snapshot.documents(name).extend(
+                dict(document)
+                for document in self.documents[name]
+                if changed_since is None
+                or document.get("lastChanged", datetime.min) >= changed_since
+            )
+        if changed_since is not None:
+            snapshot.tombstones.extend(
+                await self.get_since(controller_id, changed_since)
+            )
+        return snapshot
+
+
+@pytest.mark.asyncio
+class TestConfigSync:
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.db = FakeCollections()
+        self.db.documents["plants"] = [
+            {"plantID": 1, "waterRequirement": 100, "lastChanged": at(0)},
+            {"plantID": 2, "waterRequirement": 200},
+        ]
+        self.db.documents["pumps"] = [{"pumpID": 7, "plantID": 1, "lastChanged": at(1)}]
+        self.sync = ConfigSync(1, overlap=60)
+        self.sync.load = self.db.load
+        for name, state in self.sync.collections.items():
+            state.fetch = self.db.fetcher(name)
+        patcher = patch(
+            "server_app.services.config_sync.Tombstones.get_since",
+            new=self.db.get_since,
+        )
+        patcher.start()
+        yield
+        patcher.stop()
+
+    async def test_first_sync_is_full(self):
+        assert await self.sync.sync() == {"plants", "sensors", "schedules", "pumps"}
+        assert len(self.sync.documents("plants")) == 2
+        assert self.sync.watermark == at(1)
+        assert self.db.queries == [("combined", None)]
+
+    async def test_steady_state_fetches_nothing_new(self):
+        await self.sync.sync()
+        self.db.queries.clear()
+        assert await self.sync.sync() == set()
+        assert self.db.queries == [("combined", at(0))]
+
+    async def test_falls_back_to_one_query_per_collection(self):
+        self.sync.load = AsyncMock(
+            side_effect=OperationFailure("Unrecognized pipeline stage name", 40324)
+        )
+        await self.sync.sync()
+        assert not self.sync.combined
+        assert {name for name, _ in self.db.queries} == set(self.sync.collections)
+        self.db.tombstones.append(
+            {"collection": "pumps", "key": {"pumpID": 7}, "lastChanged": at(2)}
+        )
+        assert await self.sync.sync() == {"pumps"}
+        self.sync.load.assert_awaited_once()
+
+    async def test_applies_changes_and_tombstones(self):
+        await self.sync.sync()
+        self.db.documents["plants"][0] = {
+            "plantID": 1,
+            "waterRequirement": 150,
+            "lastChanged": at(5),
+        }
+        self.db.documents["pumps"] = []
+        self.db.tombstones.append(
+            {"collection": "pumps", "key": {"pumpID": 7}, "lastChanged": at(6)}
+        )
+        assert await self.sync.sync() == {"plants", "pumps"}
+        assert {
+            plant["plantID"]: plant["waterRequirement"]
+            for plant in self.sync.documents("plants")
+        } == {1: 150, 2: 200}
+        assert self.sync.documents("pumps") == []
+        assert self.sync.watermark == at(6)
+        # Re-reading the overlap changes nothing
+        assert await self.sync.sync() == set()
+
+    async def test_periodic_full_sync(self):
+        await self.sync.sync()
+        self.sync.last_full_sync -= self.sync.full_sync_interval
+        del self.db.documents["plants"][1]
+        assert "plants" in await self.sync.sync()
+        assert [plant["plantID"] for plant in self.sync.documents("plants")] == [1]
+
+    async def test_database_service_pushes_only_changed_collections(self):
+        service = DatabaseService(1, AsyncMock(), AsyncMock(), asyncio.Event())
+        service.config_sync = self.sync
+        service.irrigation_service.sensor_thresholds = lambda: {}
+        await service.check_for_new_data()
+        service.irrigation_service.update_plants.assert_awaited_once()
+        service.irrigation_service.update_pumps.reset_mock()
+
+        self.db.documents["plants"][0]["lastChanged"] = at(10)
+        self.db.documents["plants"][0]["waterRequirement"] = 120
+        await service.check_for_new_data()
+        assert service.irrigation_service.update_plants.await_count == 2
+        service.irrigation_service.update_pumps.assert_not_awaited()
+        assert service.plants_cache[0]["waterRequirement"] == 120
+
+
+@pytest.mark.asyncio
+class TestControllerConfig:
+    async def test_pipeline_is_one_tagged_branch_per_collection(self):
+        pipeline = ControllerConfig.pipeline(1)
+        assert pipeline[0] == {"$match": {"controllerID": 1}}
+        assert pipeline[1]["$project"]["_source"] == {"$literal": "plants"}
+        unions = [stage["$unionWith"]["coll"] for stage in pipeline[2:]]
+        assert unions == ["sensors", "schedules", "pumps"]
+
+        delta = ControllerConfig.pipeline(1, changed_since=T0)
+        assert delta[0] == {"$match": {"controllerID": 1, "lastChanged": {"$gte": T0}}}
+        assert delta[-1]["$unionWith"]["coll"] == "tombstones"
+        assert delta[-1]["$unionWith"]["pipeline"][0] == delta[0]
+
+    async def test_load_splits_documents_by_collection(self):
+        documents = [
+            {"plantID": 1, "_source": "plants"},
+            {"sensorID": 3, "type": "moisture", "_source": "sensors"},
+            {"pumpID": 7, "_source": "pumps"},
+            {"collection": "pumps", "key": {"pumpID": 8}, "_source": "tombstones"},
+        ]
+
+        async def cursor():
+            for document in documents:
+                yield document
+
+        db = MagicMock()
+        db.plants.aggregate.return_value = cursor()
+        with patch.multiple(db_connection, client=MagicMock(), db=db):
+            snapshot = await ControllerConfig.load(1, changed_since=T0)
+        db.plants.aggregate.assert_called_once()
+        assert snapshot.plants == [{"plantID": 1}]
+        assert snapshot.sensors == [{"sensorID": 3, "type": "moisture"}]
+        assert snapshot.schedules == []
+        assert snapshot.tombstones == [{"collection": "pumps", "key": {"pumpID": 8}}]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "model, name, key",
+    [
+        (Plants, "plants", "plantID"),
+        (Sensors, "sensors", "sensorID"),
+        (Schedules, "schedules", "scheduleID"),
+        (Pumps, "pumps", "pumpID"),
+    ],
+)
+async def test_delete_writes_tombstone(model, name, key):
+    document = {"plantID": 1, key: 3, "controllerID": 1, "lastChanged": T0}
+    db = MagicMock()
+    collection = getattr(db, name)
+    collection.find_one_and_delete = AsyncMock(side_effect=[document, None])
+    db.tombstones.insert_one = AsyncMock()
+    sync = ConfigSync(1)
+    sync.collections[name].replace([document])
+
+    with patch.multiple(db_connection, client=MagicMock(), db=db):
+        assert await model.delete(3) == 1
+        # Nothing to delete, no tombstone
+        assert await model.delete(3) == 0
+    collection.find_one_and_delete.assert_awaited_with({key: 3})
+    db.tombstones.insert_one.assert_awaited_once()
+
+    tombstone = db.tombstones.insert_one.await_args.args[0]
+    assert tombstone["collection"] == name
+    assert tombstone["controllerID"] == 1
+    assert tombstone["key"] == {key: 3}
+    # Read back from MongoDB without tzinfo
+    tombstone["lastChanged"] = tombstone["lastChanged"].replace(tzinfo=None)
+    assert sync.apply_tombstone(tombstone)
+    assert sync.documents(name) == []
@@ -0,0 +1,84 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+import asyncio
+import threading
+from pymongo.errors import AutoReconnect, OperationFailure
+from server_app.database.connectivity import ConnectivityMonitor
+from server_app.services.database_service import DatabaseService
+
+
+@pytest.mark.asyncio
+class TestConnectivityMonitor:
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.monitor = ConnectivityMonitor(initial_backoff=0.01, max_backoff=0.04)
+
+    async def heartbeat(self, succeeded, server=("localhost", 27017)):
+        if self.monitor.loop is None:
+            self.monitor.attach()
+        # The driver reports heartbeats from its own monitor threads
+        callback = self.monitor.succeeded if succeeded else self.monitor.failed
+        event = MagicMock(connection_id=server)
+        thread = threading.Thread(target=callback, args=(event,))
+        thread.start()
+        thread.join()
+        await asyncio.sleep(0)
+
+    async def test_follows_driver_heartbeats(self):
+        await self.heartbeat(False)
+        assert not self.monitor.online
+        await self.heartbeat(True)
+        assert self.monitor.online
+        await asyncio.wait_for(self.monitor.wait_online(), timeout=1)
+
+    async def test_one_member_down_does_not_flap(self):
+        members = [("rs-0", 27017), ("rs-1", 27017), ("rs-2", 27017)]
+        for _ in range(3):
+            for member in members:
+                await self.heartbeat(member != ("rs-1", 27017), member)
+                assert self.monitor.online
+        for member in members:
+            await self.heartbeat(False, member)
+        assert not self.monitor.online
+        await self.heartbeat(True, ("rs-2", 27017))
+        assert self.monitor.online
+
+    async def test_only_network_errors_mark_offline(self):
+        assert not self.monitor.record_failure(OperationFailure("bad query"))
+        assert self.monitor.online
+        assert self.monitor.record_failure(AutoReconnect("connection reset"))
+        assert not self.monitor.online
+        self.monitor.record_success()
+        assert self.monitor.online
+
+    async def test_probe_backs_off_while_offline(self):
+        self.monitor.record_failure(ConnectionError("MongoDB is not connected"))
+        ping = AsyncMock(side_effect=AutoReconnect("timed out"))
+        backoffs = []
+        for _ in range(4):
+            assert not await self.monitor.probe(ping)
+            backoffs.append(self.monitor.backoff)
+        assert backoffs == [0.02, 0.04, 0.04, 0.04]
+
+        ping.side_effect = None
+        assert await self.monitor.probe(ping)
+        assert self.monitor.online
+        assert self.monitor.backoff == 0.01
+
+    async def test_heartbeat_ends_probe_wait(self):
+        self.monitor.record_failure(ConnectionError("MongoDB is not connected"))
+        self.monitor.backoff = 10
+        ping = AsyncMock()
+        probe = asyncio.create_task(self.monitor.probe(ping))
+        await asyncio.sleep(0)
+        await self.heartbeat(True)
+        assert await asyncio.wait_for(probe, timeout=1)
+        ping.assert_not_awaited()
+
+    async def test_database_service_uses_monitor_state(self):
+        service = DatabaseService(
+            1, AsyncMock(), AsyncMock(), asyncio.Event(), connectivity=self.monitor
+        )
+        assert await service.network_is_available()
+        self.monitor.record_failure(AutoReconnect("connection reset"))
+        assert not await service.network_is_available()
@@ -0,0 +1,401 @@
+import pytest
+from unittest.mock import patch, AsyncMock
+import asyncio
+import json
+import time
+import fakeredis
+from server_app.services.event_streams import EventStream
+from server_app.services.database_service import DatabaseService
+from server_app.services.window_aggregator import WindowAggregator
+
+
+@pytest.mark.asyncio
+class TestEventStream:
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.redis_client = fakeredis.aioredis.FakeRedis()
+        self.stream = EventStream(self.redis_client, "events", maxlen=100)
+
+    async def test_stream_is_trimmed(self):
+        for i in range(1000):
+            await self.stream.add({"value": i})
+        # MAXLEN ~ may keep a few more entries than requested, never the history
+        assert await self.redis_client.xlen("events") < 200
+
+    async def test_pending_entries_are_recovered_after_restart(self):
+        for i in range(5):
+            await self.stream.add({"value": i})
+
+        events = await self.stream.read(3)
+        assert [json.loads(data)["value"] for _, data in events] == [0, 1, 2]
+        await self.stream.ack([events[0][0]])
+
+        # A new consumer instance with the same name resumes with the
+        # unacknowledged entries before reading new ones
+        restarted = EventStream(self.redis_client, "events", maxlen=100)
+        events = await restarted.read(10)
+        assert [json.loads(data)["value"] for _, data in events] == [1, 2]
+        await restarted.ack([entry_id for entry_id, _ in events])
+
+        events = await restarted.read(10)
+        assert [json.loads(data)["value"] for _, data in events] == [3, 4]
+
+    async def test_stale_entries_of_other_consumers_are_claimed(self):
+        await self.stream.add({"value": 1})
+        dead = EventStream(self.redis_client, "events", consumer="dead")
+        assert len(await dead.read(10)) == 1
+
+        taker = EventStream(
+            self.redis_client, "events", consumer="taker", claim_idle_ms=0
+        )
+        events = await taker.read(10)
+        assert [json.loads(data)["value"] for _, data in events] == [1]
+
+    async def test_drains_backlog_in_batches(self):
+        count = 5000
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for i in range(count):
+                EventStream(self.redis_client, "bulk", maxlen=count).add_to(
+                    pipe, {"value": i}
+                )
+            await pipe.execute()
+
+        stream = EventStream(self.redis_client, "bulk", maxlen=count)
+        drained = 0
+        while True:
+            events = await stream.read(500)
+            if not events:
+                break
+            await stream.ack([entry_id for entry_id, _ in events])
+            drained += len(events)
+
+        assert drained == count
+        assert (await self.redis_client.xpending("bulk", stream.group))["pending"] == 0
+
+
+@pytest.mark.asyncio
+class TestDatabaseServiceStreams:
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.redis_client = fakeredis.aioredis.FakeRedis()
+        self.service = DatabaseService(
+            1,
+            AsyncMock(),
+            AsyncMock(),
+            asyncio.Event(),
+            self.redis_client,
+            sensor_window_seconds=None,
+        )
+        self.sensor_stream = self.service.ingest.streams["sensor_events"]
+
+    @patch(
+        "server_app.services.database_service.RealtimeSensorData.update_realtime_sensor_data",
+        new_callable=AsyncMock,
+    )
+    @patch(
+        "server_app.services.database_service.Sensors.process_sensor_data_batch",
+        new_callable=AsyncMock,
+    )
+    async def test_events_are_acked_after_mongodb_write(
+        self, mock_process_batch, mock_update_realtime
+    ):
+        await self.sensor_stream.add({"sensorID": 1, "value": 20, "timestamp": 1})
+
+        mock_process_batch.side_effect = Exception("connection lost")
+        with pytest.raises(Exception):
+            await self.service.ingest.drain_once()
+        pending = await self.redis_client.xpending("sensor_events", "database_service")
+        assert pending["pending"] == 1
+
+        mock_process_batch.side_effect = None
+        mock_process_batch.return_value = (True, {1: {"value": 20, "timestamp": 1}})
+        assert await self.service.ingest.drain_once() == 1
+        pending = await self.redis_client.xpending("sensor_events", "database_service")
+        assert pending["pending"] == 0
+        assert mock_process_batch.await_count == 2
+        mock_update_realtime.assert_awaited_once()
+
+    @patch(
+        "server_app.services.database_service.Plants.bulk_update_watering_history",
+        new_callable=AsyncMock,
+    )
+    @patch(
+        "server_app.services.database_service.Sensors.process_sensor_data_batch",
+        new_callable=AsyncMock,
+    )
+    async def test_drains_all_streams_in_one_round_trip(
+        self, mock_process_batch, mock_bulk_update
+    ):
+        mock_process_batch.return_value = (False, {})
+        mock_bulk_update.return_value = 1
+        ingest = self.service.ingest
+        # Consume the initial recovery pass on the empty streams
+        assert await ingest.drain_once() == 0
+
+        await ingest.streams["watering_events"].add({"plantID": 4, "timestamp": 1})
+        for i in range(3):
+            await self.sensor_stream.add({"sensorID": 1, "value": i, "timestamp": i})
+
+        with patch.object(
+            self.redis_client, "xreadgroup", wraps=self.redis_client.xreadgroup
+        ) as spy:
+            assert await ingest.drain_once() == 4
+        spy.assert_called_once()
+        assert len(mock_process_batch.await_args.args[0]) == 3
+        mock_bulk_update.assert_awaited_once_with([(4, 1)])
+        assert ingest.drained_total == 4
+
+    @patch(
+        "server_app.services.database_service.Plants.bulk_update_watering_history",
+        new_callable=AsyncMock,
+    )
+    @patch(
+        "server_app.services.database_service.Sensors.process_sensor_data_batch",
+        new_callable=AsyncMock,
+    )
+    async def test_failed_stream_does_not_strand_the_others(
+        self, mock_process_batch, mock_bulk_update
+    ):
+        ingest = self.service.ingest
+        assert await ingest.drain_once() == 0
+        await self.sensor_stream.add({"sensorID": 1, "value": 20, "timestamp": 1})
+        await ingest.streams["watering_events"].add({"plantID": 4, "timestamp": 1})
+
+        mock_process_batch.side_effect = Exception("connection lost")
+        mock_bulk_update.return_value = 1
+        with pytest.raises(Exception):
+            await ingest.drain_once()
+        # The watering event from the same read is stored anyway
+        mock_bulk_update.assert_awaited_once_with([(4, 1)])
+        watering = await self.redis_client.xpending(
+            "watering_events", "database_service"
+        )
+        assert watering["pending"] == 0
+
+        mock_process_batch.side_effect = None
+        mock_process_batch.return_value = (False, {})
+        assert await ingest.drain_once() == 1
+        sensors = await self.redis_client.xpending("sensor_events", "database_service")
+        assert sensors["pending"] == 0
+
+    @patch(
+        "server_app.services.database_service.Plants.bulk_update_watering_history",
+        new_callable=AsyncMock,
+    )
+    async def test_drains_legacy_lists(self, mock_bulk_update):
+        for timestamp in range(5):
+            await self.redis_client.rpush(
+                "watering_logs", json.dumps({"plantID": 4, "timestamp": timestamp})
+            )
+
+        mock_bulk_update.side_effect = Exception("connection lost")
+        with pytest.raises(Exception):
+            await self.service.ingest.drain_legacy_lists()
+        assert (
+            await self.redis_client.lindex("watering_logs", 0)
+            == json.dumps({"plantID": 4, "timestamp": 0}).encode()
+        )
+        assert await self.redis_client.llen("watering_logs") == 5
+
+        mock_bulk_update.side_effect = None
+        mock_bulk_update.return_value = 5
+        assert await self.service.ingest.drain_legacy_lists() == 5
+        assert await self.redis_client.llen("watering_logs") == 0
+
+
+@pytest.mark.asyncio
+class TestOfflineSpool:
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        self.redis_client = fakeredis.aioredis.FakeRedis()
+        self.path = str(tmp_path / "spool.sqlite3")
+        self.service = DatabaseService(
+            1,
+            AsyncMock(),
+            AsyncMock(),
+            asyncio.Event(),
+            self.redis_client,
+            spool_path=self.path,
+        )
+        self.ingest = self.service.ingest
+        self.sensor_stream = self.ingest.streams["sensor_events"]
+
+    @patch(
+        "server_app.services.database_service.RealtimeSensorData.update_realtime_sensor_data",
+        new_callable=AsyncMock,
+    )
+    @patch(
+        "server_app.services.database_service.Plants.bulk_update_watering_history",
+        new_callable=AsyncMock,
+    )
+    @patch(
+        "server_app.services.database_service.Sensors.process_sensor_windows",
+        new_callable=AsyncMock,
+    )
+    @patch(
+        "server_app.services.database_service.Sensors.process_sensor_data_batch",
+        new_callable=AsyncMock,
+    )
+    async def test_streams_spill_into_spool_while_offline(
+        self,
+        mock_process_batch,
+        mock_process_windows,
+        mock_bulk_update,
+        mock_update_realtime,
+    ):
+        for i in range(250):
+            await self.sensor_stream.add({"sensorID": 1, "value": i, "timestamp": i})
+        await self.ingest.streams["watering_events"].add({"plantID": 4, "timestamp": 7})
+
+        while await self.ingest.spill_once():
+            pass
+        pending = await self.redis_client.xpending("sensor_events", "database_service")
+        assert pending["pending"] == 0
+        assert len(self.service.sensor_data_queue) == 250
+        assert len(self.service.watering_logs_queue) == 1
+
+        # The spool survives a restart of the controller
+        self.service.spool.connection.close()
+        restarted = DatabaseService(
+            1,
+            AsyncMock(),
+            AsyncMock(),
+            asyncio.Event(),
+            self.redis_client,
+            spool_path=self.path,
+        )
+        mock_process_windows.return_value = {}
+        mock_bulk_update.return_value = 1
+        uploaded = 0
+        while batch := await restarted.save_sensor_data():
+            uploaded += batch
+        assert uploaded == 250
+        # Uploaded as window summaries, not reading by reading
+        mock_process_batch.assert_not_awaited()
+        mock_process_windows.assert_awaited_once()
+        windows = mock_process_windows.await_args.args[0]
+        assert [window["windowStart"] for window in windows] == [0.0]
+        assert windows[0]["count"] == 250
+        assert windows[0]["last"] == 249.0
+        assert await restarted.save_watering_logs() == 1
+        mock_bulk_update.assert_awaited_once_with([(4, 7)])
+
+    async def test_in_memory_queues_do_not_take_over_events(self):
+        service = DatabaseService(
+            1, AsyncMock(), AsyncMock(), asyncio.Event(), self.redis_client
+        )
+        assert service.ingest.queues == {}
+
+
+@pytest.mark.asyncio
+class TestSensorWindows:
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.redis_client = fakeredis.aioredis.FakeRedis()
+        self.service = DatabaseService(
+            1,
+            AsyncMock(),
+            AsyncMock(),
+            asyncio.Event(),
+            self.redis_client,
+            sensor_window_seconds=60,
+        )
+        self.ingest = self.service.ingest
+        self.sensor_stream = self.ingest.streams["sensor_events"]
+
+    async def test_window_summaries(self):
+        aggregator = WindowAggregator(AsyncMock(), window_seconds=60, capacity=2)
+        readings = [(1, 20.0, 0), (1, 22.0, 30), (2, 50.0, 10), (1, 30.0, 70)]
+        events = [
+            (f"{i}-0", json.dumps({"sensorID": s, "value": v, "timestamp": t}))
+            for i, (s, v, t) in enumerate(readings)
+        ]
+        assert aggregator.add(events + [("9-0", "not json")]) == ["9-0"]
+
+        summaries, entry_ids = aggregator.closed_windows(now=60)
+        assert entry_ids == ["0-0", "1-0", "2-0"]
+        assert summaries == [
+            {
+                "sensorID": 1,
+                "windowStart": 0.0,
+                "windowSeconds": 60,
+                "min": 20.0,
+                "max": 22.0,
+                "mean": 21.0,
+                "count": 2,
+                "last": 22.0,
+                "lastTimestamp": 30.0,
+            },
+            {
+                "sensorID": 2,
+                "windowStart": 0.0,
+                "windowSeconds": 60,
+                "min": 50.0,
+                "max": 50.0,
+                "mean": 50.0,
+                "count": 1,
+                "last": 50.0,
+                "lastTimestamp": 10.0,
+            },
+        ]
+        aggregator.discard_closed(now=60)
+        assert len(aggregator) == 1
+        assert aggregator.entry_ids == ["3-0"]
+
+    @patch(
+        "server_app.services.database_service.RealtimeSensorData.update_realtime_sensor_data",
+        new_callable=AsyncMock,
+    )
+    @patch(
+        "server_app.services.database_service.Sensors.process_sensor_windows",
+        new_callable=AsyncMock,
+    )
+    async def test_entries_are_acked_once_their_window_is_uploaded(
+        self, mock_process_windows, mock_update_realtime
+    ):
+        now = time.time()
+        for offset in (-200, -190, 0):
+            await self.sensor_stream.add(
+                {"sensorID": 1, "value": 20, "timestamp": now + offset}
+            )
+        assert await self.ingest.drain_once() == 3
+        pending = await self.redis_client.xpending("sensor_events", "database_service")
+        assert pending["pending"] == 3
+
+        mock_process_windows.side_effect = Exception("connection lost")
+        with pytest.raises(Exception):
+            await self.ingest.upload_windows(force=True)
+        pending = await self.redis_client.xpending("sensor_events", "database_service")
+        assert pending["pending"] == 3
+
+        mock_process_windows.side_effect = None
+        mock_process_windows.return_value = {1: {"value": 20, "timestamp": now}}
+        assert await self.ingest.upload_windows(force=True) >= 1
+        windows = mock_process_windows.await_args.args[0]
+        assert sum(window["count"] for window in windows) >= 2
+        pending = await self.redis_client.xpending("sensor_events", "database_service")
+        # The reading of the current window stays pending
+        assert pending["pending"] == 1
+        mock_update_realtime.assert_awaited_once()
+
+    async def test_pending_entries_are_buffered_again_after_restart(self):
+        for timestamp in range(3):
+            await self.sensor_stream.add(
+                {"sensorID": 1, "value": 20, "timestamp": timestamp}
+            )
+        await self.ingest.drain_once()
+
+        restarted = DatabaseService(
+            1,
+            AsyncMock(),
+            AsyncMock(),
+            asyncio.Event(),
+            self.redis_client,
+            sensor_window_seconds=60,
+        )
+        assert await restarted.ingest.drain_once() == 3
+        aggregator = restarted.ingest.aggregators["sensor_events"]
+        assert len(aggregator) == 3
+        # Recovery is done, the buffered entries are not read a second time
+        assert await restarted.ingest.drain_once() == 0
+        assert len(aggregator) == 3
@@ -0,0 +1,497 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+import asyncio
+import fakeredis
+import json
+from datetime import datetime
+from irrigation_controller.irrigation_service import IrrigationService
+from irrigation_controller.schedule_index import build_schedule_index
+from irrigation_controller.fire_scheduler import FireTimeScheduler, next_fire_time
+from irrigation_controller.pump_dispatcher import IrrigationJob, PumpDispatcher
+from irrigation_controller.watering_planner import plan_watering
+from irrigation_controller.reading_store import LatestReadingStore
+from irrigation_controller.moisture import MoistureAggregator
+
+# 2024-05-02 was a Thursday
+THURSDAY_MORNING = datetime(2024, 5, 2, 8, 30)
+THURSDAY_EVENING = datetime(2024, 5, 2, 21, 30)
+
+
+class TestScheduleIndex:
+    def test_build_schedule_index(self):
+        index = build_schedule_index(
+            [
+                {
+                    "scheduleID": 1,
+                    "plantID": 4,
+                    "weekdays": ["Thursday", "Friday"],
+                    "startTime": "21:15",
+                    "type": "interval",
+                },
+                {
+                    "scheduleID": 2,
+                    "plantID": 4,
+                    "weekdays": [0],
+                    "startTime": {"hour": 6, "minute": 5},
+                    "type": "threshold",
+                    "threshold": 40,
+                },
+            ]
+        )
+        first, second = index[4]
+        assert first.weekday_mask == 0b0011000
+        assert first.start_minute == 21 * 60 + 15
+        assert second.weekday_mask == 0b0000001
+        assert second.start_minute == 6 * 60 + 5
+        assert second.threshold == 40
+
+    def test_invalid_schedules_are_skipped(self):
+        index = build_schedule_index(
+            [
+                {
+                    "scheduleID": 1,
+                    "plantID": 1,
+                    "weekdays": ["Funday"],
+                    "startTime": "10:00",
+                },
+                {
+                    "scheduleID": 2,
+                    "plantID": 1,
+                    "weekdays": ["Monday"],
+                    "startTime": "25:00",
+                },
+            ]
+        )
+        assert index == {}
+
+
+@pytest.mark.asyncio
+class TestIrrigationService:
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.service = IrrigationService(1, AsyncMock(), asyncio.Event(), test=True)
+
+    async def test_update_schedules_rebuilds_index_only_on_change(self):
+        schedules = [
+            {
+                "scheduleID": 1,
+                "plantID": 4,
+                "weekdays": ["Thursday"],
+                "startTime": "21:15",
+                "type": "interval",
+            }
+        ]
+        await self.service.update_schedules(schedules)
+        index = self.service.schedule_index
+        await self.service.update_schedules([dict(schedules[0])])
+        assert self.service.schedule_index is index
+
+        await self.service.update_schedules([])
+        assert self.service.schedule_index == {}
+
+    async def test_is_irrigation_needed_interval(self):
+        await self.service.update_schedules(
+            [
+                {
+                    "scheduleID": 1,
+                    "plantID": 4,
+                    "weekdays": ["Thursday"],
+                    "startTime": "21:15",
+                    "type": "interval",
+                }
+            ]
+        )
+        plant = {"plantID": 4}
+        assert not await self.service.is_irrigation_needed(plant, THURSDAY_MORNING)
+        assert await self.service.is_irrigation_needed(plant, THURSDAY_EVENING)
+
+        self.service.last_watered_times[4] = THURSDAY_EVENING.timestamp()
+        assert not await self.service.is_irrigation_needed(plant, THURSDAY_EVENING)
+
+    async def test_is_irrigation_needed_threshold(self):
+        await self.service.update_schedules(
+            [
+                {
+                    "scheduleID": 1,
+                    "plantID": 4,
+                    "weekdays": ["Thursday"],
+                    "startTime": "08:00",
+                    "type": "threshold",
+                    "threshold": 40,
+                }
+            ]
+        )
+        self.service.is_threshold_met = AsyncMock(return_value=True)
+        assert await self.service.is_irrigation_needed({"plantID": 4}, THURSDAY_MORNING)
+        self.service.is_threshold_met.assert_awaited_once_with(40, 4)
+
+    async def test_check_for_irrigation_fires_due_schedules(self):
+        await self.service.update_plants(
+            [{"plantID": 4, "pumpIDs": [1], "waterRequirement": 100}]
+        )
+        await self.service.update_pumps(
+            [{"plantID": 4, "gpioPort": 17, "flowRate": 100}]
+        )
+        await self.service.update_schedules(
+            [
+                {
+                    "scheduleID": 1,
+                    "plantID": 4,
+                    "weekdays": [datetime.now().weekday()],
+                    "startTime": "00:00",
+                    "type": "interval",
+                }
+            ]
+        )
+
+        async def irrigate(plant, pumps):
+            self.service.last_watered_times[plant["plantID"]] = (
+                datetime.now().timestamp()
+            )
+
+        self.service.irrigate_plant = AsyncMock(side_effect=irrigate)
+        task = asyncio.create_task(self.service.check_for_irrigation())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        self.service.irrigate_plant.assert_awaited_once()
+        assert self.service.scheduler.seconds_until_next(datetime.now()) > 0
+
+    async def test_irrigate_plant_runs_all_pumps_in_parallel(self):
+        self.service.redis_client = fakeredis.aioredis.FakeRedis()
+        await self.service.update_pumps(
+            [
+                {"pumpID": 1, "plantID": 4, "gpioPort": 17, "flowRate": 100},
+                {"pumpID": 2, "plantID": None, "gpioPort": 27, "flowRate": 200},
+                {"pumpID": 3, "plantID": 5, "gpioPort": 22, "flowRate": 100},
+            ]
+        )
+        plant = {"plantID": 4, "pumpIDs": [1, 2], "waterRequirement": 300}
+        pumps = self.service.get_pumps_for_plant(plant)
+        assert sorted(pump["pumpID"] for pump in pumps) == [1, 2]
+
+        self.service.test = False
+        self.service.GPIO = MagicMock()
+        with patch(
+            "irrigation_controller.irrigation_service.asyncio.sleep",
+            new_callable=AsyncMock,
+        ) as mock_sleep:
+            await self.service.irrigate_plant(plant)
+
+        # 300ml at a combined 300ml/min
+        mock_sleep.assert_awaited_once_with(60.0)
+        assert self.service.GPIO.output.call_count == 4
+        assert 4 in self.service.last_watered_times
+
+    async def test_schedule_irrigation_skips_malformed_plants(self):
+        await self.service.update_pumps(
+            [
+                {"pumpID": 1, "plantID": 4, "gpioPort": 17, "flowRate": 100},
+                {"pumpID": 2, "plantID": 5, "gpioPort": 27, "flowRate": 100},
+                {"pumpID": 3, "plantID": 6, "gpioPort": 22, "flowRate": 0},
+                {"pumpID": 4, "plantID": 7, "gpioPort": 23},
+            ]
+        )
+        self.service.dispatcher.submit = MagicMock(return_value=True)
+        plan = self.service.schedule_irrigation(
+            [
+                {"plantID": 4, "waterRequirement": 300},
+                {"plantID": 5},
+                {"plantID": 6, "waterRequirement": 300},
+                {"plantID": 7, "waterRequirement": 300},
+            ]
+        )
+        assert [job.plant_id for job in plan.jobs] == [4]
+        self.service.dispatcher.submit.assert_called_once_with(plan.jobs[0])
+        assert plan.makespan == 180
+
+    async def test_is_threshold_met_uses_latest_reading_store(self):
+        redis_client = fakeredis.aioredis.FakeRedis()
+        self.service.reading_store = LatestReadingStore(redis_client)
+        await self.service.update_plants(
+            [
+                {"plantID": 4, "sensorIDs": [7, 8, 9]},
+                {"plantID": 5, "sensorIDs": [10]},
+            ]
+        )
+        await self.service.update_sensor_types(
+            {7: "Moisture", 8: "Temperature", 9: "Moisture", 10: "Moisture"}
+        )
+        await LatestReadingStore(redis_client).write(
+            [
+                {"sensorID": 7, "value": 35.0, "timestamp": 100.0},
+                {"sensorID": 8, "value": 21.0, "timestamp": 100.0},
+                {"sensorID": 9, "value": 41.0, "timestamp": 100.0},
+            ]
+        )
+
+        # Plant 4 averages its two moisture sensors, plant 5 has no data yet
+        assert await self.service.is_threshold_met(40, 4)
+        assert not await self.service.is_threshold_met(38, 4)
+        assert not await self.service.is_threshold_met(40, 5)
+        assert self.service.reading_store.get(7)["value"] == 35.0
+
+    async def test_shared_store_skips_redis_after_first_load(self):
+        redis_client = fakeredis.aioredis.FakeRedis()
+        # Written by a previous run of the controller
+        await LatestReadingStore(redis_client).write(
+            [{"sensorID": 9, "value": 41.0, "timestamp": 50.0}]
+        )
+        store = LatestReadingStore(redis_client)
+        self.service.reading_store = store
+        # The SensorService of this process writes through the same store
+        await store.write([{"sensorID": 7, "value": 35.0, "timestamp": 100.0}])
+
+        with patch.object(redis_client, "hgetall", wraps=redis_client.hgetall) as spy:
+            first = await store.snapshot()
+            await store.write([{"sensorID": 7, "value": 36.0, "timestamp": 160.0}])
+            second = await store.snapshot()
+        assert spy.call_count == 1
+        assert first[9]["value"] == 41.0
+        assert second[7]["value"] == 36.0
+
+    async def test_last_watered_hash(self):
+        redis_client = fakeredis.aioredis.FakeRedis()
+        self.service.redis_client = redis_client
+        for plant_id, timestamp in [(4, 100.0), (5, 150.0), (4, 200.0)]:
+            await redis_client.rpush(
+                "watering_logs",
+                json.dumps({"plantID": plant_id, "timestamp": timestamp}),
+            )
+        await self.service.update_plants([{"plantID": 4}, {"plantID": 5}])
+
+        with patch(
+            "irrigation_controller.irrigation_service.Plants.get_last_watering_times",
+            new_callable=AsyncMock,
+        ) as mock_mongodb_times:
+            await self.service.initialize_last_watered_times()
+        mock_mongodb_times.assert_not_awaited()
+        assert self.service.last_watered_times == {4: 200.0, 5: 150.0}
+
+        # The migration only runs while the hash does not exist yet
+        await self.service.record_watering({"plantID": 5, "timestamp": 300.0})
+        assert await self.service.migrate_last_watered_times() == 0
+        assert await self.service.get_last_watering_time(5) == 300.0
+        assert await redis_client.xlen("watering_events") == 1
+
+
+class TestFireTimeScheduler:
+    def setup_method(self):
+        index = build_schedule_index(
+            [
+                {
+                    "scheduleID": 1,
+                    "plantID": 4,
+                    "weekdays": ["Thursday", "Monday"],
+                    "startTime": "21:15",
+                    "type": "interval",
+                }
+            ]
+        )
+        self.schedule = index[4][0]
+
+    def test_next_fire_time(self):
+        assert next_fire_time(self.schedule, THURSDAY_MORNING, False) == datetime(
+            2024, 5, 2, 21, 15
+        )
+        assert next_fire_time(self.schedule, THURSDAY_EVENING, False) == (
+            THURSDAY_EVENING
+        )
+        assert next_fire_time(self.schedule, THURSDAY_EVENING, True) == datetime(
+            2024, 5, 6, 21, 15
+        )
+
+    def test_rearm_and_pop_due(self):
+        scheduler = FireTimeScheduler(recheck_interval=60)
+        scheduler.rebuild(
+            {4: (self.schedule,)}, [4], lambda *_: False, THURSDAY_MORNING
+        )
+        assert not scheduler.needs_rearm()
+        assert scheduler.pop_due(THURSDAY_MORNING) == []
+        assert scheduler.seconds_until_next(THURSDAY_MORNING) == 12 * 3600 + 45 * 60
+
+        assert scheduler.pop_due(THURSDAY_EVENING) == [self.schedule]
+        scheduler.rearm(self.schedule, THURSDAY_EVENING, False)
+        assert scheduler.seconds_until_next(THURSDAY_EVENING) == 60
+
+
+@pytest.mark.asyncio
+class TestPumpDispatcher:
+    async def test_respects_pump_and_line_budgets(self):
+        release = asyncio.Event()
+        started = []
+
+        async def run_job(job):
+            started.append(job.plant_id)
+            await release.wait()
+
+        dispatcher = PumpDispatcher(
+            run_job, max_open_pumps=3, supply_line_limits={"north": 1}
+        )
+        jobs = [
+            IrrigationJob(
+                {"plantID": 1},
+                [{"gpioPort": 1, "flowRate": 100, "supplyLine": "north"}],
+            ),
+            IrrigationJob(
+                {"plantID": 2},
+                [{"gpioPort": 2, "flowRate": 100, "supplyLine": "north"}],
+            ),
+            IrrigationJob({"plantID": 3}, [{"gpioPort": 3, "flowRate": 100}]),
+            IrrigationJob({"plantID": 4}, [{"gpioPort": 3, "flowRate": 100}]),
+            IrrigationJob({"plantID": 5}, [{"gpioPort": 5, "flowRate": 100}]),
+        ]
+        for job in jobs:
+            assert dispatcher.submit(job)
+        assert not dispatcher.submit(jobs[0])
+
+        await asyncio.sleep(0)
+        # Plant 2 waits for the north line, plant 4 for GPIO 3
+        assert started == [1, 3, 5]
+        assert [job.plant_id for job in dispatcher.pending] == [2, 4]
+
+        release.set()
+        await asyncio.gather(*list(dispatcher.running.values()))
+        await asyncio.gather(*list(dispatcher.running.values()))
+        assert sorted(started) == [1, 2, 3, 4, 5]
+        assert dispatcher.open_pumps == 0
+        assert not dispatcher.scheduled
+
+    async def test_waiting_multi_pump_job_is_not_starved(self):
+        releases = {plant_id: asyncio.Event() for plant_id in range(1, 5)}
+        started = []
+
+        async def run_job(job):
+            started.append(job.plant_id)
+            await releases[job.plant_id].wait()
+
+        async def finish(plant_id):
+            task = dispatcher.running[plant_id]
+            releases[plant_id].set()
+            await task
+            await asyncio.sleep(0)
+
+        dispatcher = PumpDispatcher(run_job, max_open_pumps=2, max_overtakes=1)
+        pumps = {
+            1: [{"gpioPort": 1, "flowRate": 100}],
+            2: [{"gpioPort": 2, "flowRate": 100}, {"gpioPort": 6, "flowRate": 100}],
+            3: [{"gpioPort": 3, "flowRate": 100}],
+            4: [{"gpioPort": 4, "flowRate": 100}],
+        }
+        for plant_id, job_pumps in pumps.items():
+            dispatcher.submit(IrrigationJob({"plantID": plant_id}, job_pumps))
+        await asyncio.sleep(0)
+        # Plant 3 overtakes the two pump job once
+        assert started == [1, 3]
+
+        # Plant 4 would fit next to plant 3 but waits behind plant 2
+        await finish(1)
+        assert started == [1, 3]
+        await finish(3)
+        assert started == [1, 3, 2]
+        await finish(2)
+        assert started == [1, 3, 2, 4]
+        await finish(4)
+        assert not dispatcher.overtaken
+
+    async def test_planner_and_dispatcher_share_line_rule(self):
+        release = asyncio.Event()
+        started = []
+
+        async def run_job(job):
+            started.append(job.plant_id)
+            await release.wait()
+
+        limits = {"north": 1}
+        jobs = [
+            # Two pumps on a line limited to one, runs once the line is free
+            IrrigationJob(
+                {"plantID": 1, "waterRequirement": 200},
+                [
+                    {"gpioPort": 1, "flowRate": 100, "supplyLine": "north"},
+                    {"gpioPort": 2, "flowRate": 100, "supplyLine": "north"},
+                ],
+            ),
+            IrrigationJob(
+                {"plantID": 2, "waterRequirement": 100},
+                [{"gpioPort": 3, "flowRate": 100, "supplyLine": "north"}],
+            ),
+            IrrigationJob(
+                {"plantID": 3, "waterRequirement": 100},
+                [{"gpioPort": 4, "flowRate": 100, "supplyLine": "south"}],
+            ),
+        ]
+        plan = plan_watering(jobs, supply_line_limits=limits)
+        dispatcher = PumpDispatcher(
+            run_job, max_open_pumps=None, supply_line_limits=limits
+        )
+        for job in plan.jobs:
+            dispatcher.submit(job)
+        await asyncio.sleep(0)
+
+        planned_now = [run.job.plant_id for run in plan.runs if run.start == 0]
+        assert started == planned_now == [1, 3]
+        release.set()
+        await dispatcher.cancel_all()
+
+
+class TestWateringPlanner:
+    def make_job(self, plant_id, water_requirement, flow_rate=100, line=None):
+        pump = {"gpioPort": plant_id, "flowRate": flow_rate, "supplyLine": line}
+        return IrrigationJob(
+            {"plantID": plant_id, "waterRequirement": water_requirement}, [pump]
+        )
+
+    def test_longest_runs_start_first(self):
+        jobs = [
+            self.make_job(i, requirement)
+            for i, requirement in enumerate([100, 300, 200, 200])
+        ]
+        plan = plan_watering(jobs, max_open_pumps=2)
+        assert [job.plant_id for job in plan.jobs] == [1, 2, 3, 0]
+        # 300 + 100 on one pump slot, 200 + 200 on the other
+        assert plan.makespan == 240
+
+    def test_flow_and_line_limits(self):
+        jobs = [
+            self.make_job(1, 100, flow_rate=200, line="north"),
+            self.make_job(2, 100, flow_rate=100, line="north"),
+            self.make_job(3, 100, flow_rate=100, line="south"),
+        ]
+        plan = plan_watering(jobs, max_total_flow=300, supply_line_limits={"north": 1})
+        starts = {run.job.plant_id: run.start for run in plan.runs}
+        assert starts[2] == 0 and starts[3] == 0
+        assert starts[1] == 60
+        assert plan.makespan == 90
+
+    def test_oversized_run_still_planned(self):
+        plan = plan_watering([self.make_job(1, 100, flow_rate=500)], max_total_flow=100)
+        assert len(plan) == 1
+
+
+class TestMoistureAggregator:
+    def test_aggregates_per_plant_over_sensors_and_window(self):
+        aggregator = MoistureAggregator("median", window=2)
+        plants = [
+            {"plantID": 1, "sensorIDs": [1, 2]},
+            {"plantID": 2, "sensorIDs": [2, 3]},
+            {"plantID": 3, "sensorIDs": []},
+        ]
+        aggregator.rebuild(plants, {1, 2, 3})
+        aggregator.update(
+            {
+                1: {"value": 10.0, "timestamp": 1},
+                2: {"value": 30.0, "timestamp": 1},
+            }
+        )
+        aggregator.update({2: {"value": 50.0, "timestamp": 2}})
+        assert aggregator.aggregate() == {1: 30.0, 2: 40.0}
+
+        # Windows survive a rebuild for sensors that are still in use
+        aggregator.rebuild(plants[1:], {2, 3})
+        assert aggregator.aggregate() == {2: 40.0}
+
+    def test_unknown_method(self):
+        with pytest.raises(ValueError):
+            MoistureAggregator("max")
@@ -0,0 +1,374 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+import asyncio
+import fakeredis
+from irrigation_controller.sampling import SamplingCadence
+from irrigation_controller.sensor_filters import Deadband, GlitchFilter
+from irrigation_controller.sensor_history import SensorHistory
+from irrigation_controller.sensor_service import SensorService
+from irrigation_controller.sensor_drivers import (
+    DHTDriver,
+    SensorDriver,
+    register_driver,
+    DRIVERS,
+)
+
+
+class FakeDHT:
+    def __init__(self, temperature, humidity, failures=0):
+        self.reads = 0
+        self.failures = failures
+        self._temperature = temperature
+        self._humidity = humidity
+        self.exited = False
+
+    @property
+    def temperature(self):
+        self.reads += 1
+        if self.reads <= self.failures:
+            raise RuntimeError("Checksum did not validate. Try again.")
+        return self._temperature
+
+    @property
+    def humidity(self):
+        return self._humidity
+
+    def exit(self):
+        self.exited = True
+
+
+@pytest.mark.asyncio
+class TestDHTDriver:
+    async def test_retries_after_checksum_errors(self):
+        device = FakeDHT(21.0, 55.0, failures=2)
+        reader = DHTDriver(("DHTDriver", 23), MagicMock(), device=device)
+        reader.retry_delay = 0
+        assert await reader.read() == {"temperature": 21.0, "humidity": 55.0}
+        assert device.reads == 3
+        reader.close()
+
+    async def test_gives_up_after_retries(self):
+        device = FakeDHT(21.0, 55.0, failures=5)
+        reader = DHTDriver(("DHTDriver", 23), MagicMock(), device=device)
+        reader.retries, reader.retry_delay = 2, 0
+        assert await reader.read() is None
+        reader.close()
+        assert device.exited
+
+
+@pytest.mark.asyncio
+class TestSensorService:
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.service = SensorService(1, AsyncMock(), asyncio.Event(), test=True)
+
+    async def test_one_read_per_device_fans_out_to_sensors(self):
+        self.service.test = False
+        devices = {23: FakeDHT(21.0, 55.0), 24: FakeDHT(18.0, 70.0)}
+        self.service.drivers = {
+            ("DHTDriver", pin): DHTDriver(
+                ("DHTDriver", pin), MagicMock(), device=device
+            )
+            for pin, device in devices.items()
+        }
+        await self.service.update_sensors(
+            [
+                {"sensorID": 1, "type": "Temperature"},
+                {"sensorID": 2, "type": "Humidity", "gpioPort": 23},
+                {"sensorID": 3, "type": "Temperature", "gpioPort": 24},
+                {"sensorID": 4, "type": "Humidity", "gpioPort": 24},
+            ]
+        )
+        assert len(self.service.drivers) == 2
+
+        readings = await self.service.read_sensor_data()
+        assert {reading["sensorID"]: reading["value"] for reading in readings} == {
+            1: 21.0,
+            2: 55.0,
+            3: 18.0,
+            4: 70.0,
+        }
+        assert devices[23].reads == 1
+        assert devices[24].reads == 1
+
+    async def test_simulated_driver_in_test_mode(self):
+        await self.service.update_sensors(
+            [
+                {"sensorID": 1, "type": "Temperature"},
+                {"sensorID": 2, "type": "Moisture"},
+                {"sensorID": 3, "type": "moisture"},
+            ]
+        )
+        readings = await self.service.read_sensor_data()
+        assert sorted(reading["value"] for reading in readings) == [25.0, 45.0, 45.0]
+
+    async def test_slow_driver_does_not_delay_others(self):
+        release = asyncio.Event()
+
+        @register_driver("Slow")
+        class SlowDriver(SensorDriver):
+            async def read(self):
+                await release.wait()
+                return {"slow": 1.0}
+
+        @register_driver("Fast")
+        class FastDriver(SensorDriver):
+            default_interval = 0.01
+
+            async def read(self):
+                return {"fast": 2.0}
+
+        try:
+            self.service.test = False
+            self.service.publish = AsyncMock()
+            await self.service.update_sensors(
+                [{"sensorID": 1, "type": "Slow"}, {"sensorID": 2, "type": "Fast"}]
+            )
+            await self.service.start()
+            await asyncio.sleep(0.05)
+            assert self.service.publish.await_count >= 2
+            assert all(
+                call.args[0][0]["sensorID"] == 2
+                for call in self.service.publish.await_args_list
+            )
+            release.set()
+            await self.service.stop()
+        finally:
+            DRIVERS.pop("slow")
+            DRIVERS.pop("fast")
+
+    async def test_polls_only_due_sensors_and_publishes_immediately(self):
+        self.service.publish = AsyncMock()
+        await self.service.update_sensors(
+            [
+                {"sensorID": 1, "type": "Moisture", "sampleInterval": 0.01},
+                {"sensorID": 2, "type": "Moisture", "sampleInterval": 3600},
+            ]
+        )
+        await self.service.start()
+        await asyncio.sleep(0.05)
+        await self.service.stop()
+        published = [
+            reading["sensorID"]
+            for call in self.service.publish.await_args_list
+            for reading in call.args[0]
+        ]
+        # Both are read right away, only sensor 1 is due again afterwards
+        assert published.count(2) == 1
+        assert published.count(1) >= 3
+
+    async def test_failing_redis_waits_for_the_interval(self):
+        redis_client = fakeredis.aioredis.FakeRedis()
+        self.service = SensorService(1, redis_client, asyncio.Event(), test=True)
+        await self.service.update_sensors(
+            [{"sensorID": 1, "type": "Moisture", "sampleInterval": 0.1}]
+        )
+        driver = next(iter(self.service.drivers.values()))
+        with (
+            patch.object(driver, "poll", wraps=driver.poll) as poll,
+            patch.object(
+                redis_client, "pipeline", side_effect=ConnectionError("Redis down")
+            ),
+        ):
+            await self.service.start()
+            await asyncio.sleep(0.25)
+            await self.service.stop()
+        # Once right away, then once per interval instead of a busy loop
+        assert 2 <= poll.call_count <= 4
+        assert not self.service.healthy.is_set()
+
+    async def test_publish_suppresses_readings_inside_deadband(self):
+        redis_client = fakeredis.aioredis.FakeRedis()
+        self.service = SensorService(1, redis_client, asyncio.Event(), test=True)
+        await self.service.update_sensors(
+            [{"sensorID": 1, "type": "Moisture", "deadbandAbs": 1.0}]
+        )
+        for timestamp, value in enumerate([45.0, 45.2, 44.5, 47.0]):
+            await self.service.publish(
+                [{"sensorID": 1, "value": value, "timestamp": timestamp}]
+            )
+        assert await redis_client.xlen("sensor_events") == 2
+        assert self.service.get_stats()["emitted"] == 2
+        assert self.service.get_stats()["suppressed"] == 2
+
+    async def test_publish_is_one_round_trip(self):
+        redis_client = fakeredis.aioredis.FakeRedis()
+        self.service = SensorService(1, redis_client, asyncio.Event(), test=True)
+        readings = [
+            {"sensorID": sensor_id, "value": 40.0, "timestamp": 1}
+            for sensor_id in range(20)
+        ]
+        with (
+            patch.object(
+                redis_client, "pipeline", wraps=redis_client.pipeline
+            ) as pipeline,
+            patch.object(redis_client, "xadd") as xadd,
+        ):
+            await self.service.publish(readings)
+        pipeline.assert_called_once()
+        xadd.assert_not_called()
+        assert await redis_client.xlen("sensor_events") == 20
+        assert await redis_client.hlen("sensor_latest") == 20
+
+
+class TestSamplingCadence:
+    def test_fixed_interval_by_default(self):
+        cadence = SamplingCadence.from_sensor({"sampleInterval": 60}, 300)
+        cadence.observe(10.0, 0.0)
+        cadence.observe(30.0, 60.0)
+        assert cadence.interval == 60
+        assert cadence.next_due == 120.0
+
+    def test_adaptive_speeds_up_on_fast_change_and_slows_when_stable(self):
+        cadence = SamplingCadence(60, adaptive=True, min_interval=15, max_interval=240)
+        cadence.observe(40.0, 0.0)
+        assert cadence.interval == 90
+        cadence.observe(50.0, 90.0)
+        assert cadence.interval == 45
+        cadence.observe(60.0, 135.0)
+        cadence.observe(70.0, 157.5)
+        assert cadence.interval == 15
+        for step in range(20):
+            cadence.observe(70.0, 200.0 + step * 300)
+        assert cadence.interval == 240
+
+    def test_adaptive_speeds_up_near_threshold(self):
+        cadence = SamplingCadence(60, adaptive=True, min_interval=15)
+        cadence.observe(42.0, 0.0, thresholds=[40.0])
+        assert cadence.interval == 30
+        assert cadence.next_due == 30.0
+
+    def test_failed_read_keeps_interval(self):
+        cadence = SamplingCadence(60, adaptive=True)
+        cadence.observe(None, 10.0)
+        assert cadence.interval == 60
+        assert cadence.next_due == 70.0
+
+
+class TestDeadband:
+    def test_absolute_deadband_and_heartbeat(self):
+        deadband = Deadband(absolute=0.5, max_silence=600)
+        emitted = [
+            deadband.should_emit(value, timestamp)
+            for value, timestamp in [
+                (20.0, 0),
+                (20.3, 60),
+                (19.6, 120),
+                (19.4, 180),
+                (19.5, 780),
+                (19.5, 840),
+            ]
+        ]
+        assert emitted == [True, False, False, True, True, False]
+
+    def test_relative_deadband(self):
+        deadband = Deadband(relative=0.1)
+        assert deadband.should_emit(40.0, 0)
+        assert not deadband.should_emit(43.0, 1)
+        assert deadband.should_emit(45.0, 2)
+
+    def test_without_deadband_every_reading_is_emitted(self):
+        deadband = Deadband()
+        assert all(deadband.should_emit(1.0, timestamp) for timestamp in range(3))
+
+
+class TestGlitchFilter:
+    def test_rejects_missing_out_of_range_and_spikes(self):
+        glitches = GlitchFilter(window=5)
+        glitches.rebuild(
+            [
+                {"sensorID": 1, "type": "Temperature"},
+                {"sensorID": 2, "type": "Humidity", "maxValue": 90},
+            ]
+        )
+        passed = []
+        for i, (temperature, humidity) in enumerate(
+            [(21, 55), (21, 56), (22, None), (21, 95), (21, 56), (80, 57), (22, 56)]
+        ):
+            readings = [
+                {"sensorID": 1, "value": temperature, "timestamp": i},
+                {"sensorID": 2, "value": humidity, "timestamp": i},
+            ]
+            passed.extend(
+                (reading["sensorID"], reading["value"])
+                for reading in glitches.apply(readings)
+            )
+        assert (1, 80) not in passed
+        assert (2, 95) not in passed
+        assert len(passed) == 11
+        assert glitches.rejected == {"missing": 1, "range": 1, "outlier": 1}
+        assert glitches.rejected_by_sensor == {1: 1, 2: 2}
+
+    def test_step_change_is_accepted_once_it_persists(self):
+        glitches = GlitchFilter(window=5)
+        glitches.rebuild([{"sensorID": 1, "type": "moisture"}])
+        assert glitches.ranges == {1: (0.0, 100.0)}
+        accepted = [
+            bool(glitches.apply([{"sensorID": 1, "value": value, "timestamp": i}]))
+            for i, value in enumerate([40, 40, 40, 60, 60, 60, 60])
+        ]
+        assert accepted == [True, True, True, False, False, False, True]
+
+    @pytest.mark.asyncio
+    async def test_range_overrides_from_mongodb(self):
+        from server_app.database.database import db_connection
+        from server_app.database.models import Sensors
+
+        stored = {
+            "_id": "x",
+            "sensorID": 1,
+            "controllerID": 1,
+            "type": "Moisture",
+            "minValue": 10,
+            "maxValue": 60,
+            "location": "bed 2",
+        }
+
+        def find(query, projection=None):
+            # Apply the inclusion projection like MongoDB does
+            document = {
+                name: value for name, value in stored.items() if projection.get(name)
+            }
+            cursor = MagicMock()
+            cursor.to_list = AsyncMock(return_value=[document])
+            return cursor
+
+        db = MagicMock()
+        db.sensors.find.side_effect = find
+        with patch.multiple(db_connection, client=MagicMock(), db=db):
+            sensors = await Sensors.get_sensors_by_controller(1)
+        glitches = GlitchFilter()
+        glitches.rebuild(sensors)
+        assert glitches.ranges == {1: (10, 60)}
+
+
+class TestSensorHistory:
+    def test_ring_buffer_keeps_latest_samples(self):
+        history = SensorHistory(capacity=4)
+        history.append(1, 1000.0, 0.0)
+        memory_bytes = history.memory_bytes
+        for second in range(1, 10):
+            history.append(1, 1000.0 + second, float(second))
+        timestamps, values = history.window(1, now=1009.0)
+        assert sorted(values.tolist()) == [6.0, 7.0, 8.0, 9.0]
+        assert history.memory_bytes == memory_bytes
+
+    def test_default_capacity_covers_horizon(self):
+        assert SensorHistory().capacity == 6 * 3600
+        assert SensorHistory(horizon=600, sample_rate=0.1).capacity == 60
+
+    def test_queries(self):
+        history = SensorHistory(capacity=100)
+        history.extend(
+            [
+                {"sensorID": sensor_id, "timestamp": 60.0 * i, "value": value}
+                for i in range(10)
+                for sensor_id, value in ((1, 50.0 - i), (2, 30.0))
+            ]
+        )
+        assert history.count(1, now=540.0) == 10
+        assert history.rolling_mean(1, seconds=120, now=540.0) == 42.0
+        assert history.slope(1, now=540.0) == pytest.approx(-60.0)
+        assert history.slope(2, now=540.0) == pytest.approx(0.0)
+        assert history.percentile(1, 50, now=540.0) == 45.5
+        assert history.rolling_mean(3, now=540.0) is None